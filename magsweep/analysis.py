@@ -0,0 +1,184 @@
+import math
+
+def median_filter(values, width=3):
+    """
+    Smooths an array with a running median, which removes isolated outlying
+      points without shifting the switching edges of a spin valve curve
+
+    Parameters
+    ----------
+    values: array of values to smooth
+    width: number of points in the running window (odd)
+    """
+
+    # numpy is imported on first use to keep the GUI startup fast
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    half = width//2
+    padded = np.pad(values, half, mode="edge")
+    return np.array([np.median(padded[n:n+width]) for n in range(len(values))])
+
+def find_spin_states(setpoints, r_nl):
+    """
+    Finds the parallel and antiparallel states in the forward leg of a field
+      sweep (measured from negative to positive field)
+
+    The parallel level is taken as the median non-local resistance, since the
+      electrodes are parallel over most of the sweep. The antiparallel state is
+      the middle of the run of setpoints around the largest deviation of the
+      (median filtered) resistance from it, where the deviation stays above
+      half of its peak, so that the held field sits well inside the
+      antiparallel plateau. Holding the magnet at that setpoint after saturating at negative
+      field gives the antiparallel state, and after saturating at positive
+      field gives the parallel state at the same field
+
+    Returns a dictionary with...
+    ap_setpoint: magnet current setpoint of the antiparallel state (amps)
+    p_level: non-local resistance of the parallel state (ohms)
+    ap_level: non-local resistance of the antiparallel state (ohms)
+    spin_signal: difference between the antiparallel and parallel resistance (ohms)
+
+    Parameters
+    ----------
+    setpoints: magnet current setpoints of the sweep (amps)
+    r_nl: non-local resistance at each setpoint (ohms)
+    """
+
+    import numpy as np
+
+    setpoints = np.asarray(setpoints, dtype=float)
+    r_nl = np.asarray(r_nl, dtype=float)
+
+    valid = np.isfinite(setpoints) & np.isfinite(r_nl)
+    setpoints = setpoints[valid]
+    r_nl = r_nl[valid]
+
+    if len(r_nl) < 3:
+        raise ValueError("Not enough datapoints to find the spin states")
+
+    smoothed = median_filter(r_nl)
+    p_level = np.median(smoothed)
+    deviation = np.abs(smoothed - p_level)
+
+    peak = int(np.argmax(deviation))
+    lower = upper = peak
+    while (lower > 0) and (deviation[lower-1] > deviation[peak]/2):
+        lower -= 1
+    while (upper < len(deviation)-1) and (deviation[upper+1] > deviation[peak]/2):
+        upper += 1
+    ap_index = (lower + upper)//2
+
+    return {"ap_setpoint": float(setpoints[ap_index]),
+            "p_level": float(p_level),
+            "ap_level": float(smoothed[ap_index]),
+            "spin_signal": float(smoothed[ap_index] - p_level)}
+
+class RunningStats:
+    def __init__(self):
+        """
+        Class that accumulates the mean and variance of a stream of values in a
+          single pass (Welford's algorithm), without keeping the values
+        """
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        """
+        Adds a value to the running mean and variance
+
+        Parameters
+        ----------
+        value: value to add
+        """
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta/self.n
+        self._m2 += delta*(value - self.mean)
+
+    @property
+    def variance(self):
+        """
+        Sample variance of the values (NaN with fewer than two values)
+        """
+        if self.n < 2:
+            return float("nan")
+        return self._m2/(self.n - 1)
+
+    @property
+    def sem(self):
+        """
+        Standard error of the mean (NaN with fewer than two values)
+        """
+        if self.n < 2:
+            return float("nan")
+        return math.sqrt(self.variance/self.n)
+
+class RepeatStats:
+    def __init__(self):
+        """
+        Class that accumulates repeated field sweeps of the same test matrix
+          entry point by point, keeping the running mean and spread of the
+          field and non-local resistance at each magnet current setpoint of
+          each leg, and of the spin signal found in each repeat
+        """
+        self.points = {}
+        self.spin_signal = RunningStats()
+
+    def add_point(self, leg, setpoint, field, r_nl):
+        """
+        Adds a datapoint of a repeat
+
+        Parameters
+        ----------
+        leg: leg the datapoint was measured in
+        setpoint: magnet current setpoint of the datapoint (amps)
+        field: measured magnetic field (Gauss)
+        r_nl: non-local resistance (ohms)
+        """
+        leg_points = self.points.setdefault(leg, {})
+        if setpoint not in leg_points:
+            leg_points[setpoint] = (RunningStats(), RunningStats())
+        field_stats, r_nl_stats = leg_points[setpoint]
+        field_stats.add(field)
+        r_nl_stats.add(r_nl)
+
+    def add_repeat(self, setpoints, r_nl):
+        """
+        Adds the spin signal of a completed repeat, found from its forward leg
+
+        Parameters
+        ----------
+        setpoints: magnet current setpoints of the forward leg (amps)
+        r_nl: non-local resistance at each setpoint (ohms)
+        """
+        self.spin_signal.add(find_spin_states(setpoints, r_nl)["spin_signal"])
+
+    def curve(self, leg):
+        """
+        Returns the averaged curve of a leg as (field, mean r_nl, r_nl standard
+          error) arrays, in the order the setpoints were swept
+
+        Parameters
+        ----------
+        leg: leg of the sweep
+        """
+        import numpy as np
+
+        stats = list(self.points.get(leg, {}).values())
+        return (np.array([field.mean for field, _ in stats]),
+                np.array([r_nl.mean for _, r_nl in stats]),
+                np.array([r_nl.sem for _, r_nl in stats]))
+
+    def converged(self, target, min_repeats):
+        """
+        Checks whether the standard error of the spin signal has fallen below
+          the target, once at least min_repeats repeats have been completed
+
+        Parameters
+        ----------
+        target: spin signal uncertainty to reach (ohms)
+        min_repeats: minimum number of repeats to average
+        """
+        return (self.spin_signal.n >= min_repeats) and (self.spin_signal.sem <= target)
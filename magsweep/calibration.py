@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+
+from .config import FIELD_CALIBRATION_DEGREE, FIELD_CALIBRATION_PATH
+
+# branch of the magnet hysteresis loop traversed by each leg of a field sweep:
+#   the forward leg ramps the current up, the reverse leg ramps it down
+LEG_BRANCHES = {"forward": "up", "reverse": "down"}
+
+class FieldCalibration:
+    def __init__(self, branches=None, degree=FIELD_CALIBRATION_DEGREE):
+        """
+        Class that models the magnetic field produced by the electromagnet as a
+          function of its measured current. The iron of the magnet makes the
+          field depend on the direction the current was ramped in, so a
+          separate polynomial is fitted to each branch of the hysteresis loop
+          ("up" for increasing and "down" for decreasing current)
+
+        Parameters
+        ----------
+        branches: optional dictionary mapping branch names to fits, each a
+          dictionary with the polynomial "coefficients" (highest power first),
+          the "residual" standard deviation of the fit (Gauss), the current
+          "range" it was fitted over (amps) and the number of points "n"
+        degree: degree of the polynomials fitted to new data
+        """
+        self.branches = dict(branches or {})
+        self.degree = degree
+
+    def fit_branch(self, branch, current, field):
+        """
+        Fits the model of a branch to measured datapoints, replacing any
+          previous fit of that branch
+
+        Returns the residual standard deviation of the fit (Gauss)
+
+        Parameters
+        ----------
+        branch: "up" or "down"
+        current: measured magnet currents (amps)
+        field: measured magnetic fields (Gauss)
+        """
+        # numpy is imported on first use to keep the GUI startup fast
+        import numpy as np
+
+        current = np.asarray(current, dtype=float)
+        field = np.asarray(field, dtype=float)
+
+        valid = np.isfinite(current) & np.isfinite(field)
+        current = current[valid]
+        field = field[valid]
+
+        if len(current) <= self.degree:
+            raise ValueError(f"Not enough datapoints to fit the {branch} branch")
+
+        coefficients = np.polyfit(current, field, self.degree)
+        residual = float(np.std(field - np.polyval(coefficients, current)))
+
+        self.branches[branch] = {"coefficients": coefficients.tolist(),
+                                 "residual": residual,
+                                 "range": [float(current.min()), float(current.max())],
+                                 "n": int(len(current))}
+        return residual
+
+    def covers(self, branch, current):
+        """
+        Checks whether the model of a branch has been fitted over the given
+          current, so that the modeled field is interpolated rather than
+          extrapolated
+
+        Parameters
+        ----------
+        branch: "up" or "down"
+        current: magnet current (amps)
+        """
+        fit = self.branches.get(branch)
+        if fit is None:
+            return False
+        lower, upper = fit["range"]
+        return lower <= current <= upper
+
+    def predict(self, branch, current):
+        """
+        Returns the modeled field (Gauss) at the given magnet current
+
+        Parameters
+        ----------
+        branch: "up" or "down"
+        current: magnet current (amps)
+        """
+        import numpy as np
+
+        return float(np.polyval(self.branches[branch]["coefficients"], current))
+
+    def to_dict(self):
+        return {"degree": self.degree, "branches": self.branches}
+
+    @classmethod
+    def from_dict(cls, calibration):
+        return cls(calibration["branches"], calibration.get("degree", FIELD_CALIBRATION_DEGREE))
+
+    def save(self, path=FIELD_CALIBRATION_PATH):
+        """
+        Saves the calibration to a JSON file
+
+        Parameters
+        ----------
+        path: path of the calibration file
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=FIELD_CALIBRATION_PATH):
+        """
+        Loads a calibration from a JSON file, or returns None if there is none
+
+        Parameters
+        ----------
+        path: path of the calibration file
+        """
+        if not os.path.isfile(path):
+            return None
+
+        with open(path, "r") as f:
+            return cls.from_dict(json.load(f))
+
+def measured_points(data):
+    """
+    Returns the (current, field) arrays of the datapoints of a leg whose field
+      was read from the gaussmeter, leaving out any modeled fields
+
+    Parameters
+    ----------
+    data: data dictionary or DataFrame of a leg, with the "PSUP I (A)" and
+      "MAGFIELD (G)" columns (and "FIELD MODELED" if the field was modeled)
+    """
+
+    import numpy as np
+
+    current = np.asarray(data["PSUP I (A)"], dtype=float)
+    field = np.asarray(data["MAGFIELD (G)"], dtype=float)
+    if "FIELD MODELED" in data:
+        read = np.asarray(data["FIELD MODELED"], dtype=float) == 0
+        current = current[read]
+        field = field[read]
+    return current, field
+
+def calibrate_from_files(paths, degree=FIELD_CALIBRATION_DEGREE):
+    """
+    Fits a calibration to the data files of past field sweeps. The
+      *_forward.csv files are fitted to the up branch and the *_reverse.csv
+      files to the down branch
+
+    Parameters
+    ----------
+    paths: paths of the data files
+    degree: degree of the fitted polynomials
+    """
+
+    import pandas as pd
+
+    points = {}
+    for path in paths:
+        for leg, branch in LEG_BRANCHES.items():
+            if path.endswith(f"_{leg}.csv"):
+                current, field = measured_points(pd.read_csv(path))
+                branch_current, branch_field = points.setdefault(branch, ([], []))
+                branch_current.extend(current)
+                branch_field.extend(field)
+
+    calibration = FieldCalibration(degree=degree)
+    for branch, (current, field) in points.items():
+        calibration.fit_branch(branch, current, field)
+    return calibration
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Fit the magnet current to field calibration to past field sweeps")
+    parser.add_argument("files", nargs="+", help="*_forward.csv and *_reverse.csv data files of past sweeps")
+    parser.add_argument("--degree", type=int, default=FIELD_CALIBRATION_DEGREE, help="degree of the fitted polynomials")
+    parser.add_argument("--output", default=FIELD_CALIBRATION_PATH, help="path of the calibration file to write")
+    args = parser.parse_args(args)
+
+    calibration = calibrate_from_files(args.files, args.degree)
+    if not calibration.branches:
+        parser.error("no *_forward.csv or *_reverse.csv files given")
+
+    for branch, fit in calibration.branches.items():
+        print(f"{branch}: {fit['n']} points from {fit['range'][0]:g} to {fit['range'][1]:g} A, "
+              f"residual {fit['residual']:.3g} G")
+    calibration.save(args.output)
+    print(f"Saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import csv
+import json
+import os
+
+# name of the run state file written to the save folder
+CHECKPOINT_NAME = "magsweep_checkpoint.json"
+
+class Checkpoint:
+    def __init__(self, folder):
+        """
+        Class that keeps the state of a running test matrix on disk, so that an
+          interrupted run can be resumed from the exact point it stopped at.
+          The run state (settings, completed entries, current leg and field
+          index) is kept in a JSON file, and the datapoints of the entry being
+          run are streamed to partial CSV files as they are measured
+
+        Parameters
+        ----------
+        folder: folder the data is being saved to
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, CHECKPOINT_NAME)
+
+    def exists(self):
+        """
+        Checks whether there is a run state to resume in the folder
+        """
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """
+        Loads the saved run state, or returns None if there is none
+        """
+        if not self.exists():
+            return None
+
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def save(self, state):
+        """
+        Saves the run state. The file is replaced atomically so that a crash
+          while saving never leaves a corrupt checkpoint behind
+
+        Parameters
+        ----------
+        state: dictionary describing the run state
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def partial_path(self, base_name, leg):
+        """
+        Path of the partial data file of one leg of a test matrix entry
+
+        Parameters
+        ----------
+        base_name: base file name of the entry
+        leg: "forward" or "reverse"
+        """
+        return os.path.join(self.folder, f"{base_name}_{leg}.partial.csv")
+
+    def append_point(self, base_name, leg, row):
+        """
+        Appends a datapoint to the partial data file of a leg, writing the
+          header first if the file is new
+
+        Parameters
+        ----------
+        base_name: base file name of the entry
+        leg: "forward" or "reverse"
+        row: dictionary of column name to value for the datapoint
+        """
+        path = self.partial_path(base_name, leg)
+        new_file = not os.path.isfile(path)
+
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load_partial(self, base_name, leg, columns, max_points=None):
+        """
+        Reads the partial data file of a leg back into a data dictionary
+
+        Parameters
+        ----------
+        base_name: base file name of the entry
+        leg: "forward" or "reverse"
+        columns: column names of the data dictionary
+        max_points: optional number of points to keep (any points written after
+          the last saved run state are dropped)
+        """
+        data = {column: [] for column in columns}
+
+        path = self.partial_path(base_name, leg)
+        if not os.path.isfile(path):
+            return data
+
+        with open(path, "r", newline="") as f:
+            for n, row in enumerate(csv.DictReader(f)):
+                if (max_points is not None) and (n >= max_points):
+                    break
+                for column in columns:
+                    value = row.get(column, "")
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        pass
+                    data[column].append(value)
+
+        return data
+
+    def truncate_partial(self, base_name, leg, data):
+        """
+        Rewrites the partial data file of a leg so that it holds exactly the
+          given data (used on resume to drop points that were written after the
+          last saved run state)
+
+        Parameters
+        ----------
+        base_name: base file name of the entry
+        leg: "forward" or "reverse"
+        data: data dictionary to write
+        """
+        path = self.partial_path(base_name, leg)
+        columns = list(data)
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(zip(*[data[column] for column in columns]))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear_partial(self, base_name):
+        """
+        Removes the partial data files of an entry once its data has been exported
+
+        Parameters
+        ----------
+        base_name: base file name of the entry
+        """
+        for leg in ("forward", "reverse"):
+            path = self.partial_path(base_name, leg)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def clear(self):
+        """
+        Removes the run state once the whole test matrix has completed
+        """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
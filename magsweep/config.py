@@ -1,9 +1,112 @@
-import matplotlib.colors as mcolors
-
 # maximum allowed injection current (A)
 CURRENT_LIMIT = 200e-6
 
 # maximum allowed frequency (Hz)
 FREQ_LIMIT = 200
 
-COLORS = mcolors.TABLEAU_COLORS
+# maximum allowed backgate voltage magnitude (V)
+BGV_LIMIT = 80
+
+# maximum magnet power supply current magnitude, used to saturate the magnet (A)
+MAGNET_CURRENT_LIMIT = 9.5
+
+# time allowed for the magnet to ramp to the start of a sweep leg (sec)
+RAMP_WAIT = 10
+
+# time between arming and initiating the current source output (sec)
+ARM_DELAY = 2
+
+# initial guess of the time spent setting and querying instruments per datapoint (sec)
+DEFAULT_QUERY_TIME = 0.3
+
+# time between live readout polls while no sweep is running (sec)
+LIVE_POLL_INTERVAL = 1
+
+# live readings older than this are shown as missing (sec)
+READING_MAX_AGE = 5
+
+# longest time the GUI waits for a running sweep to stop when it is closed,
+#   before shutting the instruments down itself (sec)
+SWEEP_STOP_TIMEOUT = 30
+
+# keep the lock-ins on a valid sensitivity during sweeps, re-measuring a
+#   datapoint after a sensitivity change
+LIA_AUTO_RANGE = True
+
+# fraction of full scale below which a lock-in is switched to a finer sensitivity
+LIA_UNDERRANGE = 0.1
+
+# largest number of sensitivity changes for a single datapoint
+LIA_MAX_RANGE_STEPS = 4
+
+# number of delta readings averaged per datapoint in DC delta mode
+DELTA_COUNT = 10
+
+# delay between each current reversal and its nanovoltmeter reading in DC
+#   delta mode (sec)
+DELTA_DELAY = 0.002
+
+# longest time allowed for the delta readings of a datapoint (sec)
+DELTA_TIMEOUT = 30
+
+# maximum temperature controller setpoint (K)
+TEMP_LIMIT = 400
+
+# sensor input of the temperature controller that reads the sample temperature
+TEMP_CHANNEL = "A"
+
+# a temperature has settled once it stays within this band of the setpoint (K)...
+TEMP_TOLERANCE = 0.1
+
+# ...for this long (sec)
+TEMP_SETTLE_TIME = 60
+
+# time between temperature readings while waiting for it to settle (sec)
+TEMP_POLL_INTERVAL = 2
+
+# a temperature that has not settled after this long fails the run (sec)
+TEMP_SETTLE_TIMEOUT = 3600
+
+# file holding the magnet current to field calibration
+FIELD_CALIBRATION_PATH = "field_calibration.json"
+
+# degree of the polynomials fitted to each branch of the calibration
+FIELD_CALIBRATION_DEGREE = 5
+
+# with sparse field reads, the gaussmeter is always read while the modeled
+#   field is within this range of zero, where the electrodes switch (G)
+FIELD_READ_WINDOW = 250
+
+# a gaussmeter reading further than this from the modeled field means the
+#   calibration has drifted (G)
+FIELD_DRIFT_LIMIT = 5
+
+# repeats of a test matrix entry are only stopped early once at least this many
+#   have been averaged
+MIN_REPEATS = 3
+
+# number of runs overlaid on the sweep plots, older runs are removed
+MAX_PLOT_RUNS = 10
+
+# number of points kept of each line of a past run on the sweep plots
+PLOT_HISTORY_POINTS = 100
+
+# downsampling of past runs on the sweep plots, "lttb" keeps the shape of the
+#   curves, "minmax" keeps every spike of noisy ones
+PLOT_DOWNSAMPLING = "lttb"
+
+# colors of the runs on the sweep plots (the matplotlib Tableau palette, listed
+#   here so that matplotlib is not imported at startup)
+COLORS = ["tab:blue", "tab:orange", "tab:green", "tab:red", "tab:purple",
+          "tab:brown", "tab:pink", "tab:gray", "tab:olive", "tab:cyan"]
+
+# largest number of messages held for a single remote viewer of the live
+#   stream, the oldest are dropped when a viewer falls behind
+STREAM_QUEUE_SIZE = 1000
+
+# time after which an idle live stream connection is sent a keepalive (sec)
+STREAM_HEARTBEAT = 15
+
+# a station that has not reported any status or progress for this long while
+#   running a job is considered hung, and its worker process is ended (sec)
+STATION_HANG_TIMEOUT = 300
@@ -0,0 +1,219 @@
+from importlib import import_module
+from importlib import metadata
+
+# entry point group under which other packages register instrument drivers
+ENTRY_POINT_GROUP = "magsweep.drivers"
+
+# drivers that ship with magsweep, given as "module:class" paths so that a
+#   driver is only imported once a role in config.json uses it
+BUILTIN_DRIVERS = {"Kth6221": "magsweep.instruments:Kth6221",
+                   "Kth2400": "magsweep.sourcemeters:Kth2400",
+                   "SR850": "magsweep.instruments:SR850",
+                   "LS332": "magsweep.temperature:LS332",
+                   "LS340": "magsweep.temperature:LS340",
+                   "LS475": "magsweep.instruments:LS475",
+                   "LS642": "magsweep.instruments:LS642",
+                   "B1500A": "magsweep.instruments:B1500A"}
+
+# instrument roles used by the sweeps, and the driver and "equipment" entry of
+#   config.json that fill each role when config.json does not list any roles
+DEFAULT_ROLES = {"kth": {"driver": "Kth6221", "equipment": "KEITHLEY 6221 CURR_SOURCE"},
+                 "mag_psup": {"driver": "LS642", "equipment": "LAKESHORE 642 MAG_PSUP"},
+                 "gmeter": {"driver": "LS475", "equipment": "LAKESHORE 475 GAUSSMETER"},
+                 "spa": {"driver": "B1500A", "equipment": "AGILENT B1500A SPA"}}
+
+# roles the sweep engines talk to directly. Any other role is optional, and
+#   its snapshot readings are only recorded alongside the sweep if its entry
+#   in config.json sets "record"
+REQUIRED_ROLES = tuple(DEFAULT_ROLES)
+
+# lock-in driver of a detector listed in config.json by its "equipment" entry
+#   alone, and the detector measured when config.json does not list any
+DEFAULT_DETECTOR_DRIVER = "SR850"
+DEFAULT_DETECTORS = {"LIA": {"driver": DEFAULT_DETECTOR_DRIVER, "equipment": "SR850 LIA"}}
+
+def _import_path(path):
+    """
+    Imports a class from a "module:class" path
+    """
+
+    module_name, _, class_name = path.partition(":")
+    return getattr(import_module(module_name), class_name)
+
+class DriverRegistry:
+    def __init__(self, builtins=BUILTIN_DRIVERS, group=ENTRY_POINT_GROUP):
+        """
+        Class that maps driver names to instrument classes. Drivers are found
+          among the built-in drivers, those registered at run time, and the
+          entry points of installed packages, and are only imported when
+          they are first looked up
+
+        A plug-in package registers a driver in its packaging metadata, e.g.
+          [project.entry-points."magsweep.drivers"]
+          SR830 = "mypackage.lockins:SR830"
+
+        Parameters
+        ----------
+        builtins: dictionary of driver names to "module:class" paths
+        group: entry point group to search for plug-in drivers
+        """
+        self.group = group
+        self._paths = dict(builtins)
+        self._drivers = {}
+        self._entry_points = None
+
+    def _plugins(self):
+        """
+        Returns the entry points of the plug-in drivers, keyed by driver name.
+          Entry points are listed once, but only loaded when looked up
+        """
+        if self._entry_points is None:
+            try:
+                entry_points = metadata.entry_points(group=self.group)
+            except TypeError:
+                # python < 3.10
+                entry_points = metadata.entry_points().get(self.group, [])
+            self._entry_points = {entry_point.name: entry_point for entry_point in entry_points}
+        return self._entry_points
+
+    def register(self, name, driver):
+        """
+        Registers a driver under a name, replacing any driver of the same name
+
+        Parameters
+        ----------
+        name: driver name used in config.json
+        driver: instrument class, or a "module:class" path to import it from
+        """
+        self._drivers.pop(name, None)
+        if isinstance(driver, str):
+            self._paths[name] = driver
+        else:
+            self._drivers[name] = driver
+
+    def names(self):
+        """
+        Returns the names of every known driver, without importing any of them
+        """
+        return sorted(set(self._paths) | set(self._drivers) | set(self._plugins()))
+
+    def load(self, name):
+        """
+        Returns the instrument class registered under a driver name, importing
+          it on first use. Raises a KeyError if there is no such driver
+
+        Parameters
+        ----------
+        name: driver name used in config.json
+        """
+        if name not in self._drivers:
+            if name in self._paths:
+                driver = _import_path(self._paths[name])
+            elif name in self._plugins():
+                driver = self._plugins()[name].load()
+            else:
+                raise KeyError(f"No instrument driver named {name}")
+
+            from .instruments import Instrument
+            if not (isinstance(driver, type) and issubclass(driver, Instrument)):
+                raise TypeError(f"Instrument driver {name} does not subclass Instrument")
+            self._drivers[name] = driver
+
+        return self._drivers[name]
+
+# registry used by the GUI
+registry = DriverRegistry()
+
+def setup_kth(kth):
+    """
+    Puts a newly connected Keithley 6221 into a known state
+    """
+
+    # set output low to earth ground
+    kth.set_output_low()
+
+    # set output amplitude
+    kth.set_wave_ampl(10e-6)
+
+    # make sure output is off
+    kth.stop_output()
+
+def setup_spa(spa):
+    """
+    Puts a newly connected B1500A into a known state
+    """
+
+    # make sure voltage to SMU3 is off
+    spa.connect_smu()
+    spa.set_voltage(0)
+
+# functions that put the instrument filling a role into a known state when it
+#   is first connected
+ROLE_SETUP = {"kth": setup_kth,
+              "spa": setup_spa}
+
+def instrument_roles(config):
+    """
+    Returns a dictionary mapping each instrument role to the name of its driver,
+      its address and whether its readings are recorded with every datapoint,
+      from the "roles" and "equipment" sections of config.json. Roles missing
+      from config.json fall back to DEFAULT_ROLES
+
+    Parameters
+    ----------
+    config: contents of config.json
+    """
+
+    roles = dict(DEFAULT_ROLES)
+    roles.update(config.get("roles", {}))
+
+    return {role: {"driver": spec["driver"],
+                   "addr": config["equipment"][spec["equipment"]],
+                   "record": bool(spec.get("record", False))}
+            for role, spec in roles.items()}
+
+def engine_instruments(instruments, lias, roles):
+    """
+    Returns connected instruments in the form taken by the sweep engines. The
+      optional roles that are not connected are left out (a temperature
+      series checks for its "temp" controller itself), and only those marked
+      to be recorded are read at every datapoint
+
+    Parameters
+    ----------
+    instruments: dictionary mapping each role to its instrument object, or to
+      None if it could not be connected
+    lias: dictionary mapping each detector to its lock-in
+    roles: roles as returned by instrument_roles
+    """
+
+    skipped = [role for role, instrument in instruments.items() if (role not in REQUIRED_ROLES) and (instrument is None)]
+    if skipped:
+        print(f"Skipping the optional roles that are not connected: {', '.join(skipped)}")
+
+    connected = {role: instruments[role] for role in REQUIRED_ROLES}
+    connected["lia"] = lias
+    connected["temp"] = instruments.get("temp")
+    connected["extra"] = {role: instrument for role, instrument in instruments.items()
+                          if (role not in REQUIRED_ROLES) and (instrument is not None) and roles[role]["record"]}
+    return connected
+
+def detector_specs(config):
+    """
+    Returns a dictionary mapping each detector electrode to the name of the
+      driver of its lock-in and its address, from the "detectors" and
+      "equipment" sections of config.json. A detector may also be given as
+      just the "equipment" entry of its lock-in, which then uses
+      DEFAULT_DETECTOR_DRIVER
+
+    Parameters
+    ----------
+    config: contents of config.json
+    """
+
+    detectors = {}
+    for detector, spec in config.get("detectors", DEFAULT_DETECTORS).items():
+        if isinstance(spec, str):
+            spec = {"driver": DEFAULT_DETECTOR_DRIVER, "equipment": spec}
+        detectors[detector] = {"driver": spec["driver"], "addr": config["equipment"][spec["equipment"]]}
+    return detectors
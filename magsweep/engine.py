@@ -0,0 +1,1305 @@
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import os
+import time
+
+from .analysis import RepeatStats, RunningStats
+from .calibration import LEG_BRANCHES, FieldCalibration, measured_points
+from .checkpoint import Checkpoint
+from .config import (ARM_DELAY, BGV_LIMIT, CURRENT_LIMIT, DELTA_COUNT, DELTA_DELAY, DELTA_TIMEOUT, FIELD_DRIFT_LIMIT, FIELD_READ_WINDOW, FREQ_LIMIT,
+                     LIA_AUTO_RANGE, LIA_MAX_RANGE_STEPS, LIA_UNDERRANGE, MAGNET_CURRENT_LIMIT, MIN_REPEATS, RAMP_WAIT,
+                     TEMP_CHANNEL, TEMP_LIMIT, TEMP_POLL_INTERVAL, TEMP_SETTLE_TIME, TEMP_SETTLE_TIMEOUT, TEMP_TOLERANCE)
+from .estimate import SweepEstimator
+from .events import EVENT_LOG_NAME, EventLog
+from .instruments import PRIORITY_NORMAL, PRIORITY_SAFETY, DeltaNanovoltmeter, SR850RangeManager, sample_together
+
+# columns of the data saved for each leg of a sweep
+DATA_COLUMNS = ["DATETIME",
+                "PSUP SP (A)",
+                "PSUP I (A)",
+                "PSUP V (V)",
+                "MAGFIELD (G)",
+                "TEMP (C)",
+                "LIA X (V)",
+                "LIA Y (V)",
+                "LIA R (V)",
+                "LIA THETA (deg)",
+                "KTH OUTPUT (A)",
+                "KTH FREQ (HZ)",
+                "BGV (V)",
+                "R_NL (ohm)"]
+
+# columns that are saved for each detector when several lock-ins are used
+DETECTOR_COLUMNS = ["LIA X (V)",
+                    "LIA Y (V)",
+                    "LIA R (V)",
+                    "LIA THETA (deg)",
+                    "R_NL (ohm)"]
+
+def detector_column(column, detector, detectors):
+    """
+    Returns the name of a lock-in column for the given detector. With a single
+      detector the plain column name is used, so the data keeps the same
+      format as a single lock-in setup
+
+    Parameters
+    ----------
+    column: plain column name (e.g. "R_NL (ohm)")
+    detector: name of the detector electrode
+    detectors: names of all the detector electrodes being measured
+    """
+
+    if len(detectors) <= 1:
+        return column
+    return f"{column} [{detector}]"
+
+def data_columns(detectors):
+    """
+    Returns the columns of the data saved for each leg of a sweep, with a set
+      of lock-in columns for every detector
+
+    Parameters
+    ----------
+    detectors: names of the detector electrodes being measured
+    """
+
+    columns = []
+    for column in DATA_COLUMNS:
+        if column in DETECTOR_COLUMNS:
+            columns += [detector_column(column, detector, detectors) for detector in detectors]
+        else:
+            columns.append(column)
+    return columns
+
+LEGS = ("forward", "reverse")
+
+def empty_data(columns=DATA_COLUMNS):
+    """
+    Returns a data dictionary with an empty list for every column
+
+    Parameters
+    ----------
+    columns: column names of the data dictionary
+    """
+
+    return {column: [] for column in columns}
+
+def export_frame(data):
+    """
+    Returns a data dictionary as a DataFrame ready to save, with the timestamps
+      of the datapoints formatted as dates
+
+    Parameters
+    ----------
+    data: data dictionary of a leg, with wall clock timestamps (sec) in the
+      DATETIME column
+    """
+
+    # pandas is imported on first use to keep the GUI startup fast
+    import pandas as pd
+
+    frame = pd.DataFrame(data=data)
+    frame["DATETIME"] = [datetime.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") for t in frame["DATETIME"]]
+    return frame
+
+class SweepEngine:
+    legs = LEGS
+
+    # whether the run state is checkpointed, so that a failed run can be resumed
+    checkpointed = True
+
+    def __init__(self, instruments, settings, on_status=None, on_entry=None, on_point=None, stream=None):
+        """
+        Class that runs a test matrix of magnetic field sweeps, independently of
+          the GUI. The state of the run is checkpointed to the save folder after
+          every datapoint, so that an interrupted run can be resumed
+
+        Parameters
+        ----------
+        instruments: dictionary holding the "kth", "lia", "mag_psup", "gmeter"
+          and "spa" instrument objects. "lia" may also be a dictionary mapping
+          detector electrode names to lock-ins, to measure several detectors
+          at once. An optional "extra" dictionary maps further roles to
+          instruments whose snapshot readings are saved with every datapoint
+        settings: dictionary describing the run, with keys...
+            folder: folder to save the data to
+            row, col: device row and column
+            notes: notes to save alongside the data
+            electrodes: electrode configuration to save alongside the data
+            forward, reverse: magnet current setpoints of each leg (amps)
+            delay: delay between setting the field and taking a datapoint (sec),
+              raised to the settle time of the lock-ins if that is longer
+            test_matrix: list of {"frequency", "current", "bgv"} entries
+            target_uncertainty: optional spin signal standard error (ohms), the
+              remaining repeats of an entry are skipped once it is reached
+            field_read_every: optional number of datapoints per gaussmeter
+              reading (1 to read it at every point), the field of the other
+              points is modeled from the magnet current
+            synchronized: optional flag to sample the magnet current, field and
+              lock-ins of each datapoint together (see sample_together)
+            detection: optional "lockin" (the default) to inject an AC current
+              and detect with the lock-ins, or "delta" to measure with the
+              current source in DC delta mode and its attached nanovoltmeter
+            delta_count: optional number of delta readings per datapoint
+            ramp_wait, arm_delay: optional time allowed for each magnet ramp
+              and for the current source to arm (sec), RAMP_WAIT and
+              ARM_DELAY by default
+        on_status: optional function called with (text, color) when the status
+          of the run changes
+        on_entry: optional function called with (entry_index, entry) when a test
+          matrix entry starts
+        on_point: optional function called with (leg, points_done, duration)
+          after each datapoint
+        stream: optional StreamServer that the status, datapoints and progress
+          of the run are published to
+        """
+
+        self.kth = instruments["kth"]
+        self.lias = instruments["lia"] if isinstance(instruments["lia"], dict) else {"LIA": instruments["lia"]}
+        self.mag_psup = instruments["mag_psup"]
+        self.gmeter = instruments["gmeter"]
+        self.spa = instruments["spa"]
+        self.extras = instruments.get("extra", {})
+
+        # in delta mode the nanovoltmeter attached to the current source takes
+        #   the place of the lock-ins, and its readings are saved as theirs
+        self.delta = settings.get("detection", "lockin") == "delta"
+        if self.delta:
+            self.lias = {"NVM": DeltaNanovoltmeter(self.kth, settings.get("delta_count", DELTA_COUNT), DELTA_DELAY, DELTA_TIMEOUT)}
+
+        self.settings = settings
+        self.checkpoint = Checkpoint(settings["folder"])
+
+        # events are only written to the save folder while the run is running
+        self.events = EventLog()
+
+        self.on_status = on_status
+        self.on_entry = on_entry
+        self.on_point = on_point
+        self.stream = stream
+
+        # with sparse field reads, the field of most datapoints is modeled from
+        #   the magnet current, and the calibration is refitted once an entry
+        #   has been measured if it drifted (or had not been fitted yet)
+        self.field_read_every = settings.get("field_read_every", 1)
+        self.calibration = FieldCalibration.load() if self.field_read_every > 1 else None
+        self.calibration_stale = False
+        self._gmeter_temp = None
+
+        # synchronized sampling needs every instrument of a datapoint to read
+        #   its snapshot with a single query
+        self.synchronized = settings.get("synchronized", False)
+        if self.synchronized and not all(instrument.snapshot_query for instrument in [self.mag_psup, self.gmeter, *self.lias.values()]):
+            print("Synchronized sampling is not supported by these instruments, sampling them in turn")
+            self.synchronized = False
+
+        self.detectors = list(self.lias)
+        self.columns = self._columns()
+        self.rnl_columns = [detector_column("R_NL (ohm)", detector, self.detectors) for detector in self.detectors]
+        self._lia_columns = {detector: [detector_column(column, detector, self.detectors) for column in DETECTOR_COLUMNS]
+                             for detector in self.detectors}
+
+        # every datapoint is measured into the same row, and timestamped from
+        #   the monotonic clock, offset to wall clock time
+        self._row = dict.fromkeys(self.columns)
+        self._clock_offset = time.time() - time.monotonic()
+        self.kth_output = None
+        self.kth_freq = None
+
+        # time allowed for the magnet to ramp and for the current source to arm
+        #   (sec), shortened when a recorded run is replayed
+        self.ramp_wait = settings.get("ramp_wait", RAMP_WAIT)
+        self.arm_delay = settings.get("arm_delay", ARM_DELAY)
+
+        # time spent reading the instruments and recording each datapoint (sec)
+        self.timing = {"acquire": RunningStats(), "record": RunningStats()}
+
+        # run time estimate, refined from the measured datapoint durations
+        self.estimator = SweepEstimator([self.leg_length(leg) for leg in self.legs], self.n_entries, settings["delay"],
+                                        ramp_wait=self.ramp_wait, arm_delay=self.arm_delay)
+
+        # lock-ins are read in parallel, each on its own thread
+        self._lia_executor = ThreadPoolExecutor(max_workers=len(self.lias)) if len(self.lias) > 1 else None
+
+        # sensitivity management of each lock-in, and the longest time the
+        #   lock-in outputs take to settle after a step (sec)
+        self.rangers = {}
+        if LIA_AUTO_RANGE and not self.delta:
+            self.rangers = {detector: SR850RangeManager(lia, LIA_UNDERRANGE, LIA_MAX_RANGE_STEPS,
+                                                        on_change=self._range_logger(detector))
+                            for detector, lia in self.lias.items()}
+        self.lia_settle = 0.0
+
+        self.stop_requested = False
+        self.entry_index = 0
+        self.base_name = None
+        self.data = self._empty_data()
+
+        # repeats of the same entry are averaged point by point as they are
+        #   measured. The base names of the completed repeats of each entry
+        #   are kept so that the averages can be rebuilt on resume
+        self.repeats = {}
+        self.repeat_stats = {}
+
+    def _columns(self):
+        columns = data_columns(self.detectors)
+        if self.field_read_every > 1:
+            columns.append("FIELD MODELED")
+        return columns + self._extra_columns()
+
+    def _range_logger(self, detector):
+        """
+        Returns a function that logs the sensitivity changes of a lock-in
+        """
+
+        return lambda old, new: self.events.log("range_change", detector=detector, old=old, new=new)
+
+    def _extra_columns(self):
+        """
+        Returns the columns of the snapshot readings of the extra instruments,
+          suffixed with the role of each instrument
+        """
+
+        return [f"{column} [{role}]" for role, instrument in self.extras.items() for column in instrument.snapshot_columns.values()]
+
+    def _empty_data(self):
+        return {leg: empty_data(self.columns) for leg in self.legs}
+
+    def _status(self, text, color):
+        self._publish("status", {"text": text, "color": color})
+        if self.on_status is not None:
+            self.on_status(text, color)
+
+    def _publish(self, event, data):
+        """
+        Publishes an event to the remote viewers of the run, if it is streamed
+        """
+
+        if self.stream is not None:
+            self.stream.publish(event, data)
+
+    def _start_entry(self, entry_index, entry):
+        """
+        Reports the start of a test matrix entry to the remote viewers and the
+          on_entry callback
+        """
+
+        self._publish("entry", {"entry_index": entry_index, "n_entries": self.n_entries,
+                                "entry": entry, "base_name": self.base_name})
+        if self.on_entry is not None:
+            self.on_entry(entry_index, entry)
+
+    def _point_done(self, leg, points_done, row, duration):
+        """
+        Adds the duration of a datapoint to the run time estimate, and reports
+          the point and the progress of the run to the remote viewers and the
+          on_point callback
+
+        Parameters
+        ----------
+        leg: name of the leg being measured
+        points_done: number of points measured so far in the leg
+        row: measured datapoint, or None if it timed out
+        duration: time taken by the datapoint (sec)
+        """
+
+        self.estimator.record_point(duration)
+
+        if self.stream is not None:
+            if row is not None:
+                # the row is reused for the next datapoint, so a copy is sent
+                self.stream.publish("point", {"entry_index": self.entry_index, "leg": leg,
+                                              "point": points_done - 1, "row": dict(row)})
+            remaining = self.estimator.remaining(self.entry_index, self.legs.index(leg), points_done)
+            eta = datetime.datetime.now() + datetime.timedelta(seconds=remaining)
+            self.stream.publish("progress", {"entry_index": self.entry_index, "n_entries": self.n_entries,
+                                             "leg": leg, "points_done": points_done, "leg_length": self.leg_length(leg),
+                                             "remaining": remaining, "eta": eta.isoformat(timespec="seconds")})
+
+        if self.on_point is not None:
+            self.on_point(leg, points_done, duration)
+
+    @property
+    def n_entries(self):
+        """
+        Number of test matrix entries in the run
+        """
+
+        return len(self.settings["test_matrix"])
+
+    def leg_length(self, leg):
+        """
+        Number of points in a leg of each entry
+
+        Parameters
+        ----------
+        leg: name of the leg
+        """
+
+        return len(self.settings[leg])
+
+    def stop(self):
+        """
+        Requests the run to stop before the next datapoint
+        """
+
+        self.stop_requested = True
+        self.events.log("stop_request")
+
+    def _save_state(self, leg, points_done):
+        """
+        Saves the run state to the checkpoint
+
+        Parameters
+        ----------
+        leg: leg being measured
+        points_done: number of points measured so far in that leg
+        """
+
+        self.checkpoint.save({"settings": self.settings,
+                              "entry_index": self.entry_index,
+                              "base_name": self.base_name,
+                              "leg": leg,
+                              "points_done": points_done,
+                              "rows": {l: len(self.data[l]["DATETIME"]) for l in LEGS},
+                              "repeats": self.repeats})
+
+    def repeat_key(self, entry):
+        """
+        Returns the key shared by the repeats of a test matrix entry
+
+        Parameters
+        ----------
+        entry: test matrix entry
+        """
+
+        key = f"{entry['frequency']:g} Hz, {entry['current']:g} uA, {entry['bgv']:g} V"
+        if "temperature" in entry:
+            key += f", {entry['temperature']:g} K"
+        return key
+
+    @property
+    def entry_stats(self):
+        """
+        Running averages of the repeats of the entry being measured, or None
+        """
+
+        test_matrix = self.settings["test_matrix"]
+        if self.entry_index >= len(test_matrix):
+            return None
+        return self.repeat_stats.get(self.repeat_key(test_matrix[self.entry_index]))
+
+    def _accumulate(self, key, leg, rows):
+        """
+        Adds datapoints to the running averages of the repeats of an entry,
+          using the first detector
+
+        Parameters
+        ----------
+        key: repeat key of the entry
+        leg: leg the datapoints were measured in
+        rows: iterable of dictionaries of column name to value
+        """
+
+        stats = self.repeat_stats.setdefault(key, RepeatStats())
+        for row in rows:
+            stats.add_point(leg, row["PSUP SP (A)"], row["MAGFIELD (G)"], row[self.rnl_columns[0]])
+        return stats
+
+    def _complete_repeat(self, key, forward):
+        """
+        Records a completed repeat of an entry and adds its spin signal to the
+          running average
+
+        Parameters
+        ----------
+        key: repeat key of the entry
+        forward: data of the forward leg of the repeat
+        """
+
+        stats = self.repeat_stats.setdefault(key, RepeatStats())
+        try:
+            stats.add_repeat(forward["PSUP SP (A)"], forward[self.rnl_columns[0]])
+        except ValueError as e:
+            print(f"No spin signal found in {self.base_name}: {e}")
+        self.repeats.setdefault(key, []).append(self.base_name)
+
+    def _load_repeats(self, repeats):
+        """
+        Rebuilds the running averages of the completed repeats of each entry
+          from their exported data, when resuming a run
+
+        Parameters
+        ----------
+        repeats: dictionary mapping repeat keys to the base names of the
+          completed repeats
+        """
+
+        import pandas as pd
+
+        for key, base_names in repeats.items():
+            for base_name in base_names:
+                self.base_name = base_name
+                legs = {}
+                for leg in LEGS:
+                    path = os.path.join(self.settings["folder"], f"{base_name}_{leg}.csv")
+                    if os.path.isfile(path):
+                        legs[leg] = pd.read_csv(path)
+                        self._accumulate(key, leg, legs[leg].to_dict("records"))
+                if "forward" in legs:
+                    self._complete_repeat(key, legs["forward"])
+                else:
+                    self.repeats.setdefault(key, []).append(base_name)
+        self.base_name = None
+
+    def _repeats_done(self, entry):
+        """
+        Checks whether the spin signal uncertainty target has been reached for
+          an entry, so its remaining repeats can be skipped
+
+        Parameters
+        ----------
+        entry: test matrix entry
+        """
+
+        target = self.settings.get("target_uncertainty")
+        stats = self.repeat_stats.get(self.repeat_key(entry))
+        return (target is not None) and (stats is not None) and stats.converged(target, MIN_REPEATS)
+
+    def _configure(self, entry):
+        """
+        Sets up the current source and backgate for a test matrix entry
+
+        Returns an error message if the entry is outside of the instrument
+          limits, otherwise None
+
+        Parameters
+        ----------
+        entry: test matrix entry
+        """
+
+        # getting injection current amplitude
+        inj_current = float(entry["current"])*1.0e-6
+        if abs(inj_current) > CURRENT_LIMIT:
+            return f"Keep the injection current below the limit of {CURRENT_LIMIT} A!"
+
+        # getting injection current frequency, a DC delta measurement has none
+        inj_freq = 0.0 if self.delta else float(entry["frequency"])
+        if (not self.delta) and ((inj_freq > FREQ_LIMIT) or (inj_freq <= 0)):
+            return f"Keep the injection frequency below the limit of {FREQ_LIMIT} Hz!"
+
+        # getting BGV
+        if abs(entry["bgv"]) > BGV_LIMIT:
+            return f"Keep the backgate voltage between -{BGV_LIMIT} and {BGV_LIMIT} V!"
+
+        # the output amplitude is read back once per entry rather than per point
+        if self.delta:
+            try:
+                self.kth_output = self.lias["NVM"].configure(inj_current)
+            except ConnectionError as e:
+                return f"{e}, delta mode needs a 2182A on its RS-232 port and trigger link!"
+        else:
+            self.kth.set_wave_ampl(inj_current)
+            self.kth.set_wave_freq(inj_freq)
+            self.kth_output = float(self.kth.get_wave_ampl())
+        self.kth_freq = inj_freq
+        self.spa.set_voltage(entry["bgv"])
+
+        if self.rangers:
+            self.lia_settle = max(ranger.refresh() for ranger in self.rangers.values())
+        return None
+
+    def _start_output(self):
+        """
+        Starts the AC current output. In delta mode the output is instead
+          switched on for the readings of each datapoint
+        """
+
+        if not self.delta:
+            self.kth.start_output(self.arm_delay)
+
+    def _dwell(self):
+        """
+        Time to wait between setting the field (or backgate) and taking a
+          datapoint, the shortest that is at least the user's delay and lets
+          the lock-in outputs settle (sec)
+        """
+
+        return max(self.settings["delay"], self.lia_settle)
+
+    def _modeled_field(self, leg, point, current):
+        """
+        Returns the field modeled from the magnet current, or None if the
+          gaussmeter must be read at this point. With sparse field reads, the
+          gaussmeter is read at one of every field_read_every points, while
+          the modeled field is within FIELD_READ_WINDOW of zero, when the
+          calibration does not cover the current and once it has drifted
+
+        Parameters
+        ----------
+        leg: leg being measured, or None to always read the gaussmeter
+        point: index of the datapoint in the leg
+        current: magnet current (amps)
+        """
+
+        branch = LEG_BRANCHES.get(leg)
+        if (self.calibration is None) or self.calibration_stale or (self._gmeter_temp is None):
+            return None
+        if not (point % self.field_read_every) or not self.calibration.covers(branch, current):
+            return None
+
+        modeled = self.calibration.predict(branch, current)
+        return modeled if abs(modeled) > FIELD_READ_WINDOW else None
+
+    def _check_field(self, leg, point, current, gmeter):
+        """
+        Checks a gaussmeter reading against the calibration. A reading further
+          than FIELD_DRIFT_LIMIT from the modeled field marks the calibration
+          as drifted, after which the field is read at every remaining point
+          of the entry
+
+        Parameters
+        ----------
+        leg: leg being measured
+        point: index of the datapoint in the leg
+        current: measured magnet current (amps)
+        gmeter: gaussmeter snapshot
+        """
+
+        self._gmeter_temp = gmeter["temp"]
+
+        branch = LEG_BRANCHES.get(leg)
+        if (self.calibration is None) or self.calibration_stale or not self.calibration.covers(branch, current):
+            return
+
+        modeled = self.calibration.predict(branch, current)
+        if abs(gmeter["field"] - modeled) > FIELD_DRIFT_LIMIT:
+            print(f"Field calibration drifted: read {gmeter['field']:g} G, modeled {modeled:g} G")
+            self.events.log("field_drift", leg=leg, point=point, current=current, field=gmeter["field"], modeled=modeled)
+            self.calibration_stale = True
+
+    def _read_field(self, leg, point, current, gmeter=None):
+        """
+        Returns a (field, gaussmeter temperature, modeled) tuple for a
+          datapoint, taking the field from the model where the gaussmeter can
+          be skipped (see _modeled_field) and otherwise from the gaussmeter
+
+        Parameters
+        ----------
+        leg: leg being measured, or None to always read the gaussmeter
+        point: index of the datapoint in the leg
+        current: measured magnet current (amps)
+        gmeter: gaussmeter snapshot if it has already been read at this point
+        """
+
+        if gmeter is None:
+            modeled = self._modeled_field(leg, point, current)
+            if modeled is not None:
+                return modeled, self._gmeter_temp, True
+            gmeter = self.gmeter.snapshot()
+
+        self._check_field(leg, point, current, gmeter)
+        return gmeter["field"], gmeter["temp"], False
+
+    def _sample_synchronized(self, leg, point):
+        """
+        Samples the magnet power supply, gaussmeter and lock-ins together (see
+          sample_together), so that the readings of a datapoint are taken at
+          the same moment. Whether the gaussmeter can be skipped is decided
+          from the current setpoint, before the current is measured. A
+          lock-in reading that calls for a sensitivity change is re-ranged
+          and measured again on its own
+
+        Returns a (magnet power supply snapshot, gaussmeter snapshot or None,
+          lock-in readings, skew) tuple
+
+        Parameters
+        ----------
+        leg: leg being measured
+        point: index of the datapoint in the leg
+        """
+
+        skip_gmeter = (leg in LEG_BRANCHES) and (self._modeled_field(leg, point, self.settings[leg][point]) is not None)
+        instruments = [self.mag_psup] + ([] if skip_gmeter else [self.gmeter]) + list(self.lias.values())
+
+        snapshots, skew = sample_together(instruments)
+
+        lia_rdgs = dict(zip(self.lias, snapshots[-len(self.lias):]))
+        for detector, ranger in self.rangers.items():
+            lia_rdgs[detector] = ranger.check(lia_rdgs[detector])
+
+        return snapshots[0], (None if skip_gmeter else snapshots[1]), lia_rdgs, skew
+
+    def _recalibrate(self):
+        """
+        Refits the current to field calibration to the gaussmeter readings of
+          the entry just measured, for each branch that has drifted or had not
+          been fitted yet, and saves it
+        """
+
+        if self.field_read_every <= 1:
+            return
+
+        calibration = self.calibration if self.calibration is not None else FieldCalibration()
+        refitted = False
+        for leg, branch in LEG_BRANCHES.items():
+            if (not self.calibration_stale) and (branch in calibration.branches):
+                continue
+            current, field = measured_points(self.data[leg])
+            try:
+                residual = calibration.fit_branch(branch, current, field)
+            except ValueError:
+                continue
+            self.events.log("calibration", branch=branch, n=len(current), residual=residual)
+            refitted = True
+
+        if refitted:
+            calibration.save()
+            self.calibration = calibration
+        self.calibration_stale = False
+
+    def _measure_point(self, entry, leg=None, point=0):
+        """
+        Queries the instruments for a datapoint. The timestamp is taken from
+          the monotonic clock (as wall clock seconds), and only formatted as a
+          date when the data is exported
+
+        Returns a dictionary of column name to value, or None if an instrument
+          timed out. The same dictionary is reused for every datapoint, so its
+          values must be copied out before the next one is measured
+
+        Parameters
+        ----------
+        entry: test matrix entry being measured
+        leg: leg being measured, used to model the field (see _read_field)
+        point: index of the datapoint in the leg
+        """
+
+        row = self._row
+        try:
+            start = time.monotonic()
+            row["DATETIME"] = start + self._clock_offset
+            if self.synchronized:
+                psup, gmeter, lia_rdgs, skew = self._sample_synchronized(leg, point)
+                timing = {"sample": time.monotonic() - start, "skew": skew}
+            else:
+                psup = self.mag_psup.snapshot()
+                psup_done = time.monotonic()
+                gmeter = None if self._modeled_field(leg, point, psup["current"]) is not None else self.gmeter.snapshot()
+                gmeter_done = time.monotonic()
+                lia_rdgs = self._read_lias()
+                # the readings are spread from the magnet current being read to the lock-ins being read
+                timing = {"psup": psup_done - start, "gmeter": gmeter_done - psup_done,
+                          "lia": time.monotonic() - gmeter_done, "skew": gmeter_done - start}
+            sampled = time.monotonic()
+            row["PSUP SP (A)"] = psup["setpoint"]
+            row["PSUP I (A)"] = psup["current"]
+            row["PSUP V (V)"] = psup["voltage"]
+            field, temp, modeled = self._read_field(leg, point, psup["current"], gmeter)
+            row["MAGFIELD (G)"] = field
+            row["TEMP (C)"] = temp
+            if self.field_read_every > 1:
+                row["FIELD MODELED"] = int(modeled)
+            row["KTH OUTPUT (A)"] = self.kth_output
+            row["KTH FREQ (HZ)"] = self.kth_freq
+            row["BGV (V)"] = entry["bgv"]
+            for detector, lia_rdg in lia_rdgs.items():
+                x_column, y_column, r_column, theta_column, rnl_column = self._lia_columns[detector]
+                row[x_column] = lia_rdg["X"]
+                row[y_column] = lia_rdg["Y"]
+                row[r_column] = lia_rdg["R"]
+                row[theta_column] = lia_rdg["T"]
+                row[rnl_column] = lia_rdg["X"]/self.kth_output
+            for role, instrument in self.extras.items():
+                snapshot = instrument.snapshot()
+                for key, column in instrument.snapshot_columns.items():
+                    row[f"{column} [{role}]"] = snapshot[key]
+            now = time.monotonic()
+            self.events.log("measure", t=start, duration=now - start, extra=now - sampled, **timing)
+            return row
+        except Exception as e:
+            print(e)
+            print("Timeout error...")
+            self.events.log("timeout", t=start, duration=time.monotonic() - start, error=str(e))
+            with self.events.span("retry_wait"):
+                time.sleep(5)
+            return None
+
+    def _record_timing(self, acquire_start, record_start, measured):
+        """
+        Adds the time spent reading the instruments and recording a datapoint
+          to the running timing statistics
+
+        Parameters
+        ----------
+        acquire_start: monotonic time the instruments started being read
+        record_start: monotonic time the reading finished
+        measured: whether the datapoint was measured (timed out points are
+          left out of the acquisition time)
+        """
+
+        now = time.monotonic()
+        if measured:
+            self.timing["acquire"].add(record_start - acquire_start)
+        self.timing["record"].add(now - record_start)
+        self.events.log("record", t=record_start, duration=now - record_start)
+
+    def _read_lias(self):
+        """
+        Reads a datapoint from every lock-in, in parallel when there are several
+
+        Returns a dictionary mapping detector names to lock-in readings
+        """
+
+        read = {detector: (self.rangers[detector].read if self.rangers else lia.data_point) for detector, lia in self.lias.items()}
+
+        if self._lia_executor is None:
+            return {detector: read[detector]() for detector in self.lias}
+
+        futures = {detector: self._lia_executor.submit(read[detector]) for detector in self.lias}
+        return {detector: future.result() for detector, future in futures.items()}
+
+    def _rehome(self, leg):
+        """
+        Saturates the magnet at the field the given leg starts from, so that
+          the magnetization history is the same as in an uninterrupted sweep
+
+        Parameters
+        ----------
+        leg: leg about to be resumed
+        """
+
+        self._status(f"Re-homing magnet before resuming the {leg} leg", "cyan")
+        with self.events.span("rehome", leg=leg):
+            self.mag_psup.set_current(-MAGNET_CURRENT_LIMIT if leg == "forward" else MAGNET_CURRENT_LIMIT)
+            time.sleep(self.ramp_wait)
+
+    def _run_leg(self, entry, leg, start, rehome=False):
+        """
+        Measures one leg of a sweep, starting from the given point
+
+        Returns False if the run was stopped, otherwise True
+
+        Parameters
+        ----------
+        entry: test matrix entry being measured
+        leg: "forward" or "reverse"
+        start: index of the first setpoint to measure
+        rehome: whether to saturate the magnet first (when resuming)
+        """
+
+        setpoints = self.settings[leg]
+
+        if rehome and (start < len(setpoints)):
+            self._rehome(leg)
+
+        for n in range(start, len(setpoints)):
+            if self.stop_requested:
+                return False
+
+            self.mag_psup.set_current(setpoints[n])
+            self.events.log("setpoint", leg=leg, point=n, current=setpoints[n])
+            # delay for longer on first measurement to allow magnet to ramp
+            if n == start:
+                with self.events.span("ramp", leg=leg):
+                    time.sleep(self.ramp_wait)
+            point_start = time.monotonic()
+
+            with self.events.span("dwell", leg=leg, point=n):
+                time.sleep(self._dwell())
+            acquire_start = time.monotonic()
+            row = self._measure_point(entry, leg, n)
+            record_start = time.monotonic()
+            if row is not None:
+                data = self.data[leg]
+                for column, value in row.items():
+                    data[column].append(value)
+                self.checkpoint.append_point(self.base_name, leg, row)
+                self._accumulate(self.repeat_key(entry), leg, [row])
+            self._save_state(leg, n+1)
+            self._record_timing(acquire_start, record_start, row is not None)
+
+            self._point_done(leg, n+1, row, time.monotonic() - point_start)
+
+        return True
+
+    def _export_data(self):
+        """
+        Saves the data of the current entry
+        """
+
+        for leg in self.legs:
+            export_frame(self.data[leg]).to_csv(os.path.join(self.settings["folder"], f"{self.base_name}_{leg}.csv"), index=False)
+
+    def _export(self):
+        """
+        Saves the data, notes and electrode configuration of the current entry
+        """
+
+        folder = self.settings["folder"]
+
+        self._export_data()
+
+        if self.settings["notes"]:
+            with open(os.path.join(folder, f"{self.base_name}_notes.txt"), "w") as f:
+                f.write(self.settings["notes"])
+
+        # saving electrode configuration
+        with open(os.path.join(folder, f"{self.base_name}_electrodes.json"), "w") as f:
+            json.dump(self.settings["electrodes"], f, indent=4)
+
+    def _shutdown_outputs(self, priority):
+        """
+        Zeroes the magnet, stops the current source and turns off the backgate
+        """
+
+        self.mag_psup.set_current(0, priority)
+        self.kth.stop_output()
+        self.spa.set_voltage(0, priority=priority)
+        self.spa.disconnect_smu()
+        self.spa.connect_smu()
+
+    def _cleanup(self):
+        """
+        Puts the instruments in a safe state after an interrupt. The checkpoint
+          is kept so that the run can be resumed
+        """
+
+        try:
+            with self.events.span("safety_shutdown"):
+                self._shutdown_outputs(PRIORITY_SAFETY)
+        except Exception as e:
+            print(e)
+        self.data = self._empty_data()
+
+    def run(self, resume=None):
+        """
+        Runs the test matrix. Blocks until the run completes or is stopped
+
+        Returns True if the whole test matrix completed
+
+        Parameters
+        ----------
+        resume: optional run state loaded from a checkpoint, to continue an
+          interrupted run from the point it stopped at
+        """
+
+        self.events = EventLog(os.path.join(self.settings["folder"], EVENT_LOG_NAME))
+        self.events.log("run_start", engine=type(self).__name__, resume=bool(resume), n_entries=self.n_entries,
+                        first_entry=resume["entry_index"] if resume else 0)
+
+        completed = False
+        try:
+            completed = self._run(resume)
+            return completed
+        except Exception as e:
+            print(e)
+            self.events.log("error", message=str(e))
+            self._cleanup()
+            # a checkpoint left in the folder by an earlier run cannot resume
+            #   an engine that does not checkpoint
+            hint = ", use Resume Sweep to continue" if self.checkpointed and self.checkpoint.exists() else ""
+            self._status(f"Sweep failed ({e}){hint}", "red")
+            return False
+        finally:
+            if self._lia_executor is not None:
+                self._lia_executor.shutdown()
+                self._lia_executor = None
+            self.events.log("run_end", completed=completed, stopped=self.stop_requested)
+            self.events.close()
+
+    def _new_base_name(self):
+        return f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.settings['row']}_{self.settings['col']}"
+
+    def _prepare_entry(self, entry):
+        """
+        Called before a test matrix entry is configured, to bring the setup to
+          the conditions of the entry
+
+        Returns False if the run was stopped, otherwise True
+
+        Parameters
+        ----------
+        entry: test matrix entry about to be measured
+        """
+
+        return True
+
+    def _entry_measured(self, entry_index):
+        """
+        Called once the last datapoint of a test matrix entry has been taken,
+          before the magnet is reset and the data exported
+
+        Parameters
+        ----------
+        entry_index: index of the entry that was measured
+        """
+
+        pass
+
+    def _run(self, resume):
+        test_matrix = self.settings["test_matrix"]
+
+        first_entry = resume["entry_index"] if resume else 0
+        if resume:
+            self._load_repeats(resume.get("repeats", {}))
+
+        for entry_index in range(first_entry, len(test_matrix)):
+            entry = test_matrix[entry_index]
+            self.entry_index = entry_index
+
+            start_leg, start_point = "forward", 0
+            resuming = bool(resume) and (entry_index == first_entry) and bool(resume["base_name"])
+
+            if (not resuming) and self._repeats_done(entry):
+                stats = self.repeat_stats[self.repeat_key(entry)]
+                self.events.log("skip", entry_index=entry_index, spin_signal=stats.spin_signal.mean,
+                                uncertainty=stats.spin_signal.sem, repeats=stats.spin_signal.n)
+                self._status(f"Skipping run {entry_index+1}, spin signal {stats.spin_signal.mean:.4g} "
+                             f"+/- {stats.spin_signal.sem:.2g} ohm after {stats.spin_signal.n} repeats", "green")
+                self.entry_index = entry_index + 1
+                self._save_state("forward", 0)
+                continue
+
+            if resuming:
+                # continuing a partially measured entry
+                self.base_name = resume["base_name"]
+                start_leg, start_point = resume["leg"], resume["points_done"]
+                for leg in LEGS:
+                    self.data[leg] = self.checkpoint.load_partial(self.base_name, leg, self.columns, resume["rows"][leg])
+                    self.checkpoint.truncate_partial(self.base_name, leg, self.data[leg])
+                    self._accumulate(self.repeat_key(entry), leg,
+                                     [dict(zip(self.data[leg], values)) for values in zip(*self.data[leg].values())])
+            else:
+                self.base_name = self._new_base_name()
+                self.data = self._empty_data()
+
+            if not self._prepare_entry(entry):
+                self._cleanup()
+                self._status("Sweep interrupted", "red")
+                return False
+
+            self._status(f"Running sweep: Frequency={entry['frequency']:g} Hz, Current={entry['current']:g} uA, BGV={entry['bgv']:g} V", "cyan")
+
+            self.events.log("entry_start", entry_index=entry_index, entry=entry, base_name=self.base_name,
+                            leg=start_leg, point=start_point)
+
+            with self.events.span("configure", entry_index=entry_index):
+                error = self._configure(entry)
+            if error is not None:
+                self.events.log("error", message=error)
+                self._status(error, "red")
+                return False
+
+            self._save_state(start_leg, start_point)
+
+            # starting current output
+            with self.events.span("arm"):
+                self._start_output()
+
+            self._start_entry(entry_index, entry)
+
+            if start_leg == "forward":
+                if not self._run_leg(entry, "forward", start_point, rehome=resuming):
+                    self._cleanup()
+                    self._status("Sweep interrupted", "red")
+                    return False
+
+                # resetting magnet by sweeping to high positive current
+                with self.events.span("reset", current=MAGNET_CURRENT_LIMIT):
+                    self.mag_psup.set_current(MAGNET_CURRENT_LIMIT)
+                    time.sleep(self.ramp_wait)
+                self._save_state("reverse", 0)
+                start_point = 0
+                resuming = False
+
+            if not self._run_leg(entry, "reverse", start_point, rehome=resuming):
+                self._cleanup()
+                self._status("Sweep interrupted", "red")
+                return False
+
+            self._entry_measured(entry_index)
+
+            # resetting magnet by sweeping to high negative current
+            with self.events.span("reset", current=-MAGNET_CURRENT_LIMIT):
+                self.mag_psup.set_current(-MAGNET_CURRENT_LIMIT)
+                time.sleep(self.ramp_wait)
+
+            with self.events.span("export", base_name=self.base_name):
+                self._export()
+            self._recalibrate()
+            self._complete_repeat(self.repeat_key(entry), self.data["forward"])
+
+            # entry complete, the next run starts from the following entry
+            self.checkpoint.clear_partial(self.base_name)
+            self.entry_index = entry_index + 1
+            self.base_name = None
+            self._save_state("forward", 0)
+
+            with self.events.span("shutdown"):
+                self._shutdown_outputs(PRIORITY_NORMAL)
+            self.events.log("entry_end", entry_index=entry_index)
+            self._status("Sweep complete", "green")
+
+        self.checkpoint.clear()
+        return True
+
+class TemperatureSweepEngine(SweepEngine):
+    def __init__(self, instruments, settings, on_status=None, on_entry=None, on_point=None, stream=None):
+        """
+        Class that runs a test matrix of magnetic field sweeps at a series of
+          temperatures, set on a Lakeshore 332/340 temperature controller.
+          Each test matrix entry carries a "temperature" key, and consecutive
+          entries at the same temperature are measured without waiting again
+
+        Before the first entry at a new temperature, the controller setpoint is
+          changed and the run waits for the sample temperature to stay within
+          TEMP_TOLERANCE of it for TEMP_SETTLE_TIME. To cut the idle time, the
+          setpoint of the next temperature is sent as soon as the last
+          datapoint of an entry has been taken, so the temperature approach
+          overlaps with the magnet reset and ramp down, during which no data
+          is taken
+
+        Parameters
+        ----------
+        instruments: dictionary of instrument objects as for SweepEngine, plus
+          the temperature controller under "temp"
+        settings: dictionary describing the run as for SweepEngine, where every
+          test matrix entry also has a "temperature" (K)
+        on_status: optional function called with (text, color) when the status
+          of the run changes
+        on_entry: optional function called with (entry_index, entry) when a test
+          matrix entry starts
+        on_point: optional function called with (leg, points_done, duration)
+          after each datapoint
+        stream: optional StreamServer that the status, datapoints and progress
+          of the run are published to
+        """
+
+        super().__init__(instruments, settings, on_status, on_entry, on_point, stream)
+        self.temp = instruments["temp"]
+
+        # setpoint last sent to the controller by this run, and the temperature
+        #   it was last seen to settle at
+        self.temp_setpoint = None
+        self.settled_temperature = None
+
+    def _new_base_name(self):
+        temperature = self.settings["test_matrix"][self.entry_index]["temperature"]
+        return f"{super()._new_base_name()}_{temperature:g}K"
+
+    def _set_temperature(self, temperature):
+        """
+        Sends a new setpoint to the temperature controller
+
+        Parameters
+        ----------
+        temperature: setpoint (K)
+        """
+
+        if (temperature <= 0) or (temperature > TEMP_LIMIT):
+            raise ValueError(f"Keep the temperature between 0 and {TEMP_LIMIT} K!")
+
+        self.temp.set_setpoint(temperature)
+        self.temp_setpoint = temperature
+        self.events.log("temperature_setpoint", temperature=temperature)
+
+    def _wait_for_temperature(self, temperature):
+        """
+        Waits for the sample temperature to settle at the setpoint. Raises a
+          RuntimeError if it has not settled within TEMP_SETTLE_TIMEOUT
+
+        Returns False if the run was stopped, otherwise True
+
+        Parameters
+        ----------
+        temperature: setpoint (K)
+        """
+
+        start = time.monotonic()
+        settled_since = None
+
+        while not self.stop_requested:
+            reading = self.temp.get_temperature(TEMP_CHANNEL)
+            now = time.monotonic()
+
+            if abs(reading - temperature) <= TEMP_TOLERANCE:
+                if settled_since is None:
+                    settled_since = now
+                if now - settled_since >= TEMP_SETTLE_TIME:
+                    return True
+            else:
+                settled_since = None
+
+            if now - start > TEMP_SETTLE_TIMEOUT:
+                raise RuntimeError(f"temperature did not settle at {temperature:g} K, last read {reading:.3f} K")
+
+            self._status(f"Waiting for the temperature to settle at {temperature:g} K ({reading:.3f} K)", "cyan")
+            time.sleep(TEMP_POLL_INTERVAL)
+
+        return False
+
+    def _prepare_entry(self, entry):
+        temperature = entry["temperature"]
+        if temperature == self.settled_temperature:
+            return True
+
+        if temperature != self.temp_setpoint:
+            self._set_temperature(temperature)
+        with self.events.span("temperature_settle", temperature=temperature):
+            if not self._wait_for_temperature(temperature):
+                return False
+
+        self.settled_temperature = temperature
+        return True
+
+    def _entry_measured(self, entry_index):
+        test_matrix = self.settings["test_matrix"]
+        if entry_index + 1 < len(test_matrix):
+            next_temperature = test_matrix[entry_index + 1]["temperature"]
+            if next_temperature != self.temp_setpoint:
+                self._set_temperature(next_temperature)
+
+class GateSweepEngine(SweepEngine):
+    legs = ("P", "AP")
+    checkpointed = False
+
+    def __init__(self, instruments, settings, on_status=None, on_entry=None, on_point=None, stream=None):
+        """
+        Class that sweeps the backgate voltage with the magnetic field held
+          fixed, first in the parallel and then in the antiparallel state, to
+          measure the gate dependence of the spin signal without a full field
+          sweep at every backgate voltage. The gate leakage current is read
+          from the SMU at every point
+
+        Both states are held at the same magnet current setpoint, the one at
+          which the antiparallel state was found in a prior sweep (see
+          analysis.find_spin_states). The parallel state is reached by ramping
+          down to it from high positive field, and the antiparallel state by
+          ramping up to it from high negative field
+
+        Parameters
+        ----------
+        instruments: dictionary holding the "kth", "lia", "mag_psup", "gmeter"
+          and "spa" instrument objects
+        settings: dictionary describing the run, with keys...
+            folder: folder to save the data to
+            row, col: device row and column
+            notes: notes to save alongside the data
+            electrodes: electrode configuration to save alongside the data
+            delay: delay between setting the backgate and taking a datapoint (sec)
+            frequency: injection current frequency (Hz)
+            current: injection current amplitude (uA)
+            bgvs: backgate voltages to sweep through (V)
+            hold_setpoint: magnet current setpoint to hold the field at (amps)
+        on_status: optional function called with (text, color) when the status
+          of the run changes
+        on_entry: optional function called with (0, entry) when the sweep starts
+        on_point: optional function called with (state, points_done, duration)
+          after each datapoint, where state is "P" or "AP"
+        stream: optional StreamServer that the status, datapoints and progress
+          of the sweep are published to
+        """
+
+        super().__init__(instruments, settings, on_status, on_entry, on_point, stream)
+
+    def _columns(self):
+        return ["STATE"] + data_columns(self.detectors) + ["GATE I (A)"] + self._extra_columns()
+
+    @property
+    def n_entries(self):
+        return 1
+
+    def leg_length(self, leg):
+        return len(self.settings["bgvs"])
+
+    def _export_data(self):
+        """
+        Saves the data of both states to a single file
+        """
+
+        data = {column: self.data["P"][column] + self.data["AP"][column] for column in self.columns}
+        export_frame(data).to_csv(os.path.join(self.settings["folder"], f"{self.base_name}_bgv.csv"), index=False)
+
+    def _run_state(self, entry, state, saturation):
+        """
+        Puts the electrodes in the given magnetic state and sweeps the backgate
+
+        Returns False if the run was stopped, otherwise True
+
+        Parameters
+        ----------
+        entry: {"frequency", "current", "bgv"} entry of the sweep
+        state: "P" or "AP"
+        saturation: magnet current to saturate the electrodes at first (amps)
+        """
+
+        self._status(f"Setting up the {state} state", "cyan")
+        with self.events.span("saturate", state=state, current=saturation):
+            self.mag_psup.set_current(saturation)
+            time.sleep(self.ramp_wait)
+        with self.events.span("ramp", state=state, current=self.settings["hold_setpoint"]):
+            self.mag_psup.set_current(self.settings["hold_setpoint"])
+            time.sleep(self.ramp_wait)
+
+        self._status(f"Running gate sweep in the {state} state", "cyan")
+        for n, bgv in enumerate(self.settings["bgvs"]):
+            if self.stop_requested:
+                return False
+
+            self.spa.set_voltage(bgv)
+            self.events.log("setpoint", state=state, point=n, bgv=bgv)
+            point_start = time.monotonic()
+
+            with self.events.span("dwell", state=state, point=n):
+                time.sleep(self._dwell())
+            acquire_start = time.monotonic()
+            row = self._measure_point(dict(entry, bgv=bgv))
+            if row is not None:
+                try:
+                    row["GATE I (A)"] = self.spa.get_current()
+                except Exception as e:
+                    print(e)
+                    row["GATE I (A)"] = float("nan")
+            record_start = time.monotonic()
+            if row is not None:
+                row["STATE"] = state
+                data = self.data[state]
+                for column, value in row.items():
+                    data[column].append(value)
+            self._record_timing(acquire_start, record_start, row is not None)
+
+            self._point_done(state, n+1, row, time.monotonic() - point_start)
+
+        return True
+
+    def _run(self, resume=None):
+        entry = {"frequency": self.settings["frequency"],
+                 "current": self.settings["current"],
+                 "bgv": self.settings["bgvs"][0]}
+
+        self.entry_index = 0
+        self.base_name = self._new_base_name()
+        self.data = self._empty_data()
+
+        error = self._configure(entry)
+        if error is not None:
+            self._status(error, "red")
+            return False
+
+        # starting current output
+        self._start_output()
+
+        self._start_entry(0, entry)
+
+        for state, saturation in (("P", MAGNET_CURRENT_LIMIT), ("AP", -MAGNET_CURRENT_LIMIT)):
+            if not self._run_state(entry, state, saturation):
+                self._cleanup()
+                self._status("Gate sweep interrupted", "red")
+                return False
+
+        self._export()
+        self._shutdown_outputs(PRIORITY_NORMAL)
+        self._status("Gate sweep complete", "green")
+        return True
@@ -0,0 +1,148 @@
+import datetime
+
+from .config import ARM_DELAY, DEFAULT_QUERY_TIME, RAMP_WAIT
+
+def format_duration(seconds):
+    """
+    Formats a duration in seconds as a short human readable string
+      (e.g. "2h 05m", "4m 30s")
+
+    Parameters
+    ----------
+    seconds: duration to format
+    """
+
+    seconds = int(round(max(seconds, 0)))
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+
+    if hours:
+        return f"{hours}h {minutes:02d}m"
+    if minutes:
+        return f"{minutes}m {secs:02d}s"
+    return f"{secs}s"
+
+class SweepEstimator:
+    def __init__(self, leg_points, n_entries, delay, query_time=DEFAULT_QUERY_TIME, ramp_wait=RAMP_WAIT,
+                 arm_delay=ARM_DELAY):
+        """
+        Class that models how long a test matrix will take to run, and refines
+          the model from the measured point timings once the run has started
+
+        Each entry of the test matrix arms the current source, then measures each
+          leg in turn with a magnet ramp before it and a magnet reset after it.
+          For a field sweep the legs are the forward and reverse sweeps (the
+          reverse leg being empty if the sweep is one way, in which case it
+          has no ramp but still ends with a reset)
+
+        Parameters
+        ----------
+        leg_points: list of the number of points in each leg of an entry
+        n_entries: number of entries in the test matrix
+        delay: delay between datapoints (sec)
+        query_time: time spent setting and querying the instruments per point (sec),
+          used until a point has been measured
+        ramp_wait: time allowed for each magnet ramp and reset (sec)
+        arm_delay: time allowed for the current source to arm (sec)
+        """
+
+        self.leg_points = list(leg_points)
+        self.n_entries = n_entries
+        self.delay = delay
+        self.query_time = query_time
+        self.ramp_wait = ramp_wait
+        self.arm_delay = arm_delay
+
+        # measured point timings
+        self.n_measured = 0
+        self.mean_point_time = 0.0
+
+    @property
+    def point_time(self):
+        """
+        Best estimate of the time taken by a single datapoint (sec)
+        """
+
+        if self.n_measured:
+            return self.mean_point_time
+        return self.delay + self.query_time
+
+    def record_point(self, seconds):
+        """
+        Adds a measured datapoint duration to the running mean
+
+        Parameters
+        ----------
+        seconds: time taken by the datapoint, excluding the initial magnet ramp
+        """
+
+        self.n_measured += 1
+        self.mean_point_time += (seconds - self.mean_point_time)/self.n_measured
+
+    def entry_duration(self):
+        """
+        Estimated duration of a single test matrix entry (sec)
+        """
+
+        return self.arm_delay + sum(self.leg_duration(n) for n in self.leg_points)
+
+    def leg_duration(self, n_points):
+        """
+        Estimated duration of a leg of an entry, from its magnet ramp to the
+          end of the magnet reset after it (sec)
+
+        Parameters
+        ----------
+        n_points: number of points in the leg
+        """
+
+        ramp = self.ramp_wait if n_points else 0.0
+        return ramp + n_points*self.point_time + self.ramp_wait
+
+    def total_duration(self):
+        """
+        Estimated duration of the whole test matrix (sec)
+        """
+
+        return self.n_entries*self.entry_duration()
+
+    def elapsed_in_entry(self, leg, points_done):
+        """
+        Estimated time spent in the current entry once the given number of points
+          of the given leg have been measured (sec)
+
+        Parameters
+        ----------
+        leg: index of the leg being measured
+        points_done: number of points measured so far in that leg
+        """
+
+        elapsed = self.arm_delay + sum(self.leg_duration(n) for n in self.leg_points[:leg])
+        return elapsed + self.ramp_wait + points_done*self.point_time
+
+    def remaining(self, entry_index, leg, points_done):
+        """
+        Estimated time remaining in the test matrix (sec)
+
+        Parameters
+        ----------
+        entry_index: index of the test matrix entry being run
+        leg: index of the leg being measured
+        points_done: number of points measured so far in that leg
+        """
+
+        entry_left = max(self.entry_duration() - self.elapsed_in_entry(leg, points_done), 0)
+        return entry_left + (self.n_entries - entry_index - 1)*self.entry_duration()
+
+    def eta(self, entry_index, leg, points_done):
+        """
+        Estimated wall-clock time at which the test matrix will finish
+
+        Parameters
+        ----------
+        entry_index: index of the test matrix entry being run
+        leg: index of the leg being measured
+        points_done: number of points measured so far in that leg
+        """
+
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.remaining(entry_index, leg, points_done))
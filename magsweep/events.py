@@ -0,0 +1,97 @@
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+# name of the event log written to the save folder
+EVENT_LOG_NAME = "magsweep_events.jsonl"
+
+class EventLog:
+    def __init__(self, path=None):
+        """
+        Class that appends the events of a run to a JSON lines file, one JSON
+          object per line, for post-mortem and performance analysis (see
+          timeline.py). Every event holds its name, the monotonic time it
+          happened at ("t") and the wall clock time ("wall"). Events that
+          cover a phase of the run, such as a magnet ramp, also hold its
+          duration in seconds. The file is only ever appended to, and each
+          line is flushed as it is written so the log survives a crash
+
+        Parameters
+        ----------
+        path: path of the log file, or None to discard the events
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path is not None else None
+
+    def log(self, event, t=None, **fields):
+        """
+        Appends an event to the log
+
+        Parameters
+        ----------
+        event: name of the event
+        t: monotonic time of the event (defaults to now)
+        fields: further JSON serializable values describing the event
+        """
+        if self._file is None:
+            return
+
+        if t is None:
+            t = time.monotonic()
+        record = {"event": event, "t": t, "wall": time.time() - (time.monotonic() - t)}
+        record.update(fields)
+        line = json.dumps(record, default=str)
+
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    @contextmanager
+    def span(self, event, **fields):
+        """
+        Context manager that logs a phase of the run once it ends, with the
+          time it started at and its duration. A phase cut short by an error
+          is logged with the error
+
+        Parameters
+        ----------
+        event: name of the phase
+        fields: further JSON serializable values describing the phase
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.log(event, t=start, duration=time.monotonic() - start, error=str(e), **fields)
+            raise
+        self.log(event, t=start, duration=time.monotonic() - start, **fields)
+
+    def close(self):
+        """
+        Closes the log file
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def read_events(path):
+    """
+    Reads the events of a log file, skipping any line that was cut short
+
+    Parameters
+    ----------
+    path: path of the log file
+    """
+
+    events = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
@@ -1,10 +1,5 @@
-import asyncio
-import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
-import os
-from queue import Queue
-import random
-import sys
 import threading
 import time
 
@@ -12,18 +7,25 @@ import tkinter as tk
 from tkinter import filedialog as fd
 from tkinter import messagebox
 
-import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-
-import numpy as np
-import pandas as pd
-import pyvisa as visa
-
-from .config import COLORS, CURRENT_LIMIT, FREQ_LIMIT
-from .instruments import *
-from .utils import parse_entry
+from .analysis import find_spin_states
+from .checkpoint import Checkpoint
+from .config import (BGV_LIMIT, CURRENT_LIMIT, FREQ_LIMIT, LIVE_POLL_INTERVAL, MAGNET_CURRENT_LIMIT, READING_MAX_AGE,
+                     SWEEP_STOP_TIMEOUT, TEMP_LIMIT)
+from .drivers import REQUIRED_ROLES, ROLE_SETUP, detector_specs, engine_instruments, instrument_roles, registry
+from .engine import GateSweepEngine, SweepEngine, TemperatureSweepEngine, detector_column
+from .estimate import SweepEstimator, format_duration
+from .instruments import PRIORITY_SAFETY, InstrumentPool
+from .live import LivePoller, ReadingCache
+from .plotting import SweepPlots
+from .utils import compile_sweep_spec, sweep_profile
+
+# titles of the connection indicators of the roles the GUI knows, any other
+#   role is shown by its name
+ROLE_TITLES = {"kth": "Current Source",
+               "mag_psup": "Magnet Power Supply",
+               "gmeter": "Gaussmeter",
+               "spa": "SPA",
+               "temp": "Temperature Controller"}
 
 def auto_update_entry(entry, value):
     """
@@ -52,57 +54,27 @@ class App(tk.Frame):
         self.index = 0
         self.base_file_name = ""
 
-        self.data_forward = {"DATETIME": [],
-                             "PSUP SP (A)": [],
-                             "PSUP I (A)": [],
-                             "PSUP V (V)": [],
-                             "MAGFIELD (G)": [],
-                             "TEMP (C)": [],
-                             "LIA X (V)": [],
-                             "LIA Y (V)": [],
-                             "LIA R (V)": [],
-                             "LIA THETA (deg)": [],
-                             "KTH OUTPUT (A)": [],
-                             "KTH FREQ (HZ)": [],
-                             "BGV (V)": [],
-                             "R_NL (ohm)": []}
-
-        self.data_reverse = {"DATETIME": [],
-                             "PSUP SP (A)": [],
-                             "PSUP I (A)": [],
-                             "PSUP V (V)": [],
-                             "MAGFIELD (G)": [],
-                             "TEMP (C)": [],
-                             "LIA X (V)": [],
-                             "LIA Y (V)": [],
-                             "LIA R (V)": [],
-                             "LIA THETA (deg)": [],
-                             "KTH OUTPUT (A)": [],
-                             "KTH FREQ (HZ)": [],
-                             "BGV (V)": [],
-                             "R_NL (ohm)": []}
-
         with open("config.json", "r") as f:
             self.config = json.load(f)
 
-        # instrument addresses
-        self.kth_addr = self.config["equipment"]["KEITHLEY 6221 CURR_SOURCE"]    # Keithley 6221 current source
-        self.lia_addr = self.config["equipment"]["SR850 LIA"]                    # SR850 lock-in amplifier
-        self.mag_psup_addr = self.config["equipment"]["LAKESHORE 642 MAG_PSUP"]  # Lakeshore 642 Magnet power supply
-        self.gmeter_addr = self.config["equipment"]["LAKESHORE 475 GAUSSMETER"]  # Lakeshore 475 gaussmeter
-        self.spa_addr = self.config["equipment"]["AGILENT B1500A SPA"]           # Agilent B1500A SPA
+        # driver and address of the instrument filling each role
+        self.roles = instrument_roles(self.config)
+
+        # driver and address of the lock-in amplifier of each detector
+        #   electrode, measured simultaneously
+        self.detector_specs = detector_specs(self.config)
+        self.lia_addrs = {detector: spec["addr"] for detector, spec in self.detector_specs.items()}
 
-        # instrument objects
-        self.kth = None
+        # instrument objects, keyed by role
+        self.instruments = {}
         self.lia = None
-        self.mag_psup = None
-        self.gmeter = None
-        self.spa = None
+        self.lias = {}
 
         # values to test
         self.freqs = []
         self.currents = []
         self.bgvs = []
+        self.temperatures = []
         self.test_matrix = []
 
         self.colors_used = []
@@ -110,9 +82,15 @@ class App(tk.Frame):
         # GUI dimensions
         self.window_w = 1200
 
-        # GPIB configuration
+        # GPIB configuration, the resource manager is opened on the first
+        #   connection so that the window does not wait on the VISA library
         self.backend = self.config["backend"]
-        self.rm = visa.ResourceManager(self.backend)
+        self.rm = None
+        self.pool = None
+        self.connect_lock = threading.Lock()
+
+        # set once the plots have been drawn after the window first shows
+        self.plots_ready = threading.Event()
 
         self.label_font = ("Helvetica", 10, "bold")
 
@@ -120,16 +98,42 @@ class App(tk.Frame):
         self._place_user_input_frame()
         self._place_sweep_frame()
         self._place_rdg_frame()
-        # self._test()
-        
-        self._update_connections()
+        self.after_idle(self._place_plots)
+
+        # instruments are connected in the background, and each connection
+        #   indicator is updated as soon as its instrument answers
+        self._start_connections()
+
+        # live readout, polled in the background between sweeps
+        self.readings = ReadingCache()
+        self.poller = LivePoller(self.readings,
+                                 {"lia": self._poll_lia,
+                                  "gmeter": lambda: self._poll_role("gmeter"),
+                                  "mag_psup": lambda: self._poll_role("mag_psup")},
+                                 interval=LIVE_POLL_INTERVAL)
+        self.poller.start()
+        self._refresh_readouts()
 
         # adding handling for when user closes the window
         self.master.protocol("WM_DELETE_WINDOW", self.closing_cleanup)
 
-        # event loop variable for sweep event
-        self.sweep_loop = None
-        self.stop_thread = False
+        # thread and engine of the running sweep
+        self.sweep_thread = None
+        self.engine = None
+
+        # optional live stream of the runs to remote viewers
+        self.stream = None
+        stream_config = self.config.get("stream")
+        if stream_config:
+            # the stream server (and asyncio) is only imported when streaming
+            from .stream import StreamServer
+
+            self.stream = StreamServer(stream_config.get("host", "127.0.0.1"), stream_config.get("port", 8765))
+            try:
+                self.stream.start()
+            except OSError as e:
+                print(e)
+                self.stream = None
 
     def _build_frames(self):
         """
@@ -171,32 +175,27 @@ class App(tk.Frame):
         
         self.row_n += 1
 
-        # Keithley 6221
-        self.kth_label = tk.Label(self.user_input_frame, text="Keithley 6221 Source", font=self.label_font, background="red", borderwidth=2, relief="groove")
-        self.kth_label.grid(column=0, row=self.row_n, columnspan=3, sticky="wens")
-
-        # LIA
-        self.lia_label = tk.Label(self.user_input_frame, text="SR850 L.I.A.", font=self.label_font, background="red", borderwidth=2, relief="groove")
-        self.lia_label.grid(column=3, row=self.row_n, columnspan=3, sticky="wens")
-
-        self.row_n += 1
-
-        # Magnet power supply
-        self.mag_psup_label = tk.Label(self.user_input_frame, text="Lakeshore 642 Power Supply", font=self.label_font, background="red", borderwidth=2, relief="groove")
-        self.mag_psup_label.grid(column=0, row=self.row_n, columnspan=2, sticky="wens")
-
-        # Gaussmeter
-        self.gmeter_label = tk.Label(self.user_input_frame, text="Lakeshore 475 Gaussmeter", font=self.label_font, background="red", borderwidth=2, relief="groove")
-        self.gmeter_label.grid(column=2, row=self.row_n, columnspan=2, sticky="wens")
-
-        # SPA
-        self.spa_label = tk.Label(self.user_input_frame, text="Agilent B1500A SPA", font=self.label_font, background="red", borderwidth=2, relief="groove")
-        self.spa_label.grid(column=4, row=self.row_n, columnspan=2, sticky="wens")
+        # connection indicators, one per instrument role and one for the
+        #   lock-ins, three to a row
+        indicators = [(role, f"{ROLE_TITLES.get(role, role)} ({spec['driver']})") for role, spec in self.roles.items()]
+        drivers = sorted({spec["driver"] for spec in self.detector_specs.values()})
+        lia_text = (f"L.I.A. ({', '.join(drivers)})" if len(self.detector_specs) == 1
+                    else f"L.I.A.s ({', '.join(self.detector_specs)})")
+        indicators.insert(1, ("lia", lia_text))
+
+        self.role_labels = {}
+        for i, (key, text) in enumerate(indicators):
+            label = tk.Label(self.user_input_frame, text=text, font=self.label_font, background="red", borderwidth=2, relief="groove")
+            label.grid(column=2*(i % 3), row=self.row_n + i//3, columnspan=2, sticky="wens")
+            if key == "lia":
+                self.lia_label = label
+            else:
+                self.role_labels[key] = label
 
-        self.row_n += 1
+        self.row_n += (len(indicators) + 2)//3
 
         # reconnect instruments button
-        self.recon_instr_button = tk.Button(self.user_input_frame, text="Connect Instruments", command=self._update_connections, font=self.label_font)
+        self.recon_instr_button = tk.Button(self.user_input_frame, text="Connect Instruments", command=self._start_connections, font=self.label_font)
         self.recon_instr_button.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
         
         self.row_n += 1
@@ -331,7 +330,7 @@ class App(tk.Frame):
         # delay
         self.delay_label = tk.Label(self.sweep_frame, text="Delay (sec):", font=self.label_font)
         self.delay_label.grid(column=2, row=self.row_n, columnspan=1, sticky="w")
-        self.delay_entry = tk.Entry(self.sweep_frame)
+        self.delay_entry = tk.Entry(self.sweep_frame, validate="focusout", validatecommand=self._update_num_points)
         self.delay_entry.grid(column=3, row=self.row_n, columnspan=1, sticky="wens")
         auto_update_entry(self.delay_entry, "0.5")
 
@@ -345,12 +344,53 @@ class App(tk.Frame):
 
         self.row_n += 1
 
+        # temperature series, left empty to sweep at the current temperature
+        self.temps_label = tk.Label(self.sweep_frame, text="Temperatures (K):", font=self.label_font)
+        self.temps_label.grid(column=0, row=self.row_n, columnspan=1, sticky="w")
+        self.temps_entry = tk.Entry(self.sweep_frame, validate="focusout", validatecommand=self._check_sweep_params)
+        self.temps_entry.grid(column=1, row=self.row_n, columnspan=1, sticky="wens")
+
+        # number of datapoints per gaussmeter reading, the field of the others is modeled from the magnet current
+        self.field_every_label = tk.Label(self.sweep_frame, text="Field read every:", font=self.label_font)
+        self.field_every_label.grid(column=2, row=self.row_n, columnspan=1, sticky="w")
+        self.field_every_entry = tk.Entry(self.sweep_frame)
+        self.field_every_entry.grid(column=3, row=self.row_n, columnspan=1, sticky="wens")
+        auto_update_entry(self.field_every_entry, "1")
+
+        # spin signal uncertainty at which the remaining repeats are skipped, left empty to run them all
+        self.target_label = tk.Label(self.sweep_frame, text="Target unc. (ohm):", font=self.label_font)
+        self.target_label.grid(column=4, row=self.row_n, columnspan=1, sticky="w")
+        self.target_entry = tk.Entry(self.sweep_frame)
+        self.target_entry.grid(column=5, row=self.row_n, columnspan=1, sticky="wens")
+
+        self.row_n += 1
+
+        # synchronized sampling checkbox, reads the magnet current, field and lock-ins of a datapoint together
+        self.sync_var = tk.IntVar(self.sweep_frame, value=0)
+        self.sync_cb = tk.Checkbutton(self.sweep_frame, variable=self.sync_var, text="Synchronized sampling?", font=self.label_font)
+        self.sync_cb.grid(column=0, row=self.row_n, columnspan=2, sticky="w")
+
+        # DC delta mode checkbox, measures with the current source and its nanovoltmeter instead of the lock-ins
+        self.delta_var = tk.IntVar(self.sweep_frame, value=0)
+        self.delta_cb = tk.Checkbutton(self.sweep_frame, variable=self.delta_var, text="DC delta mode?", font=self.label_font)
+        self.delta_cb.grid(column=2, row=self.row_n, columnspan=2, sticky="w")
+        self.row_n += 1
+
         # datapoint readout
         self.points_label = tk.Label(self.sweep_frame, text=f"Datapoints/run: {self._calc_datapoints()}", font=self.label_font)
         self.points_label.grid(column=0, row=self.row_n, columnspan=2, sticky="wens")
 
         self.num_runs_label = tk.Label(self.sweep_frame, text=f"Number of runs: {len(self.test_matrix)}", font=self.label_font)
         self.num_runs_label.grid(column=2, row=self.row_n, columnspan=2, sticky="wens")
+
+        # run time estimate
+        self.est_label = tk.Label(self.sweep_frame, text="Est. time: -", font=self.label_font)
+        self.est_label.grid(column=4, row=self.row_n, columnspan=2, sticky="wens")
+        self.row_n += 1
+
+        # live progress readout
+        self.progress_label = tk.Label(self.sweep_frame, text="Progress: -", font=self.label_font)
+        self.progress_label.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
         self.row_n += 1
 
         # start sweep button
@@ -358,6 +398,16 @@ class App(tk.Frame):
         self.start_swp_button.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
         self.row_n += 1
 
+        # resume sweep button
+        self.resume_swp_button = tk.Button(self.sweep_frame, text="Resume Sweep", command=self._resume_sweep, font=("Helvetica", 14, "bold"))
+        self.resume_swp_button.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
+        self.row_n += 1
+
+        # gate voltage sweep button
+        self.gate_swp_button = tk.Button(self.sweep_frame, text="Gate Sweep (field fixed at P/AP)", command=self._begin_gate_sweep, font=("Helvetica", 14, "bold"))
+        self.gate_swp_button.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
+        self.row_n += 1
+
         # stop sweep button
         self.stop_swp_button = tk.Button(self.sweep_frame, text="Stop Sweep", command=self._stop_sweep, font=("Helvetica", 14, "bold"))
         self.stop_swp_button.grid(column=0, row=self.row_n, columnspan=6, sticky="wens")
@@ -368,9 +418,40 @@ class App(tk.Frame):
         Places live reading frame
         """
 
+        # live instrument readouts
+        self.readout_frame = tk.Frame(self.rdg_frame)
+        self.readout_frame.grid(column=0, row=self.row_n, sticky="wens")
+
+        self.lia_x_rdg = tk.Label(self.readout_frame, text="X: -", font=self.label_font, width=14)
+        self.lia_y_rdg = tk.Label(self.readout_frame, text="Y: -", font=self.label_font, width=14)
+        self.lia_r_rdg = tk.Label(self.readout_frame, text="R: -", font=self.label_font, width=14)
+        self.lia_theta_rdg = tk.Label(self.readout_frame, text="Theta: -", font=self.label_font, width=14)
+        self.gmeter_field_rdg = tk.Label(self.readout_frame, text="Field: -", font=self.label_font, width=16)
+        self.gmeter_temp_rdg = tk.Label(self.readout_frame, text="Temp: -", font=self.label_font, width=12)
+        self.mag_psup_setpt = tk.Label(self.readout_frame, text="Setpoint: -", font=self.label_font, width=16)
+        self.mag_psup_curr_rdg = tk.Label(self.readout_frame, text="Output Current: -", font=self.label_font, width=22)
+        self.mag_psup_volt_rdg = tk.Label(self.readout_frame, text="Output Voltage: -", font=self.label_font, width=22)
+
+        for n, label in enumerate([self.lia_x_rdg, self.lia_y_rdg, self.lia_r_rdg, self.lia_theta_rdg,
+                                   self.gmeter_field_rdg, self.gmeter_temp_rdg,
+                                   self.mag_psup_setpt, self.mag_psup_curr_rdg, self.mag_psup_volt_rdg]):
+            label.grid(column=n, row=0, sticky="w")
+
+        self.row_n += 1
+
+    def _place_plots(self):
+        """
+        Places the live plots once the window is showing. matplotlib is only
+          imported here, as importing it takes longer than building the rest
+          of the window
+        """
+
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+
         # setting up the live plotting
         # forward scan
-        self.f_fig = plt.figure(figsize=(7,2), dpi=100)
+        self.f_fig = Figure(figsize=(7,2), dpi=100)
         self.f_ax1 = self.f_fig.add_subplot(1,1,1)
         self.f_ax1.set_xlabel("Mag. Field (G)")
         self.f_ax1.set_ylabel("R_NL (Ohm)")
@@ -381,7 +462,7 @@ class App(tk.Frame):
         self.row_n += 1
         
         # reverse scan
-        self.r_fig = plt.figure(figsize=(7,2), dpi=100)
+        self.r_fig = Figure(figsize=(7,2), dpi=100)
         self.r_ax1 = self.r_fig.add_subplot(1,1,1)
         self.r_ax1.set_xlabel("Mag. Field (G)")
         self.r_ax1.set_ylabel("R_NL (Ohm)")
@@ -390,6 +471,9 @@ class App(tk.Frame):
         self.r_plotcanv.get_tk_widget().grid(column=0, row=self.row_n)
 
         self.row_n += 1
+        self.sweep_plots = SweepPlots({"forward": self.f_ax1, "reverse": self.r_ax1},
+                                      {"forward": self.f_plotcanv, "reverse": self.r_plotcanv})
+        self.plots_ready.set()
 
     def _choose_folder(self):
         """
@@ -404,449 +488,693 @@ class App(tk.Frame):
         else:
             self.folder = ""
 
-    def _calc_datapoints(self):
+    def _sweep_profile(self):
         """
-        Calculates the number of datapoints in the measurement
+        Builds the magnet current setpoints from the sweep limit entries
+
+        Returns a (forward, reverse) tuple of lists of setpoints (amps)
         """
-        
+
         try:
             lower = float(self.swp_low_lim_entry.get())
             upper = float(self.swp_upp_lim_entry.get())
             step = float(self.swp_step_var.get())
         except ValueError:
-            return 0
+            return [], []
+
+        if upper > MAGNET_CURRENT_LIMIT:
+            auto_update_entry(self.swp_upp_lim_entry, f"{MAGNET_CURRENT_LIMIT}")
+            upper = MAGNET_CURRENT_LIMIT
+
+        if lower < -MAGNET_CURRENT_LIMIT:
+            auto_update_entry(self.swp_low_lim_entry, f"{-MAGNET_CURRENT_LIMIT}")
+            lower = -MAGNET_CURRENT_LIMIT
+
+        return sweep_profile(lower, upper, step, self.swp_sym_var.get())
+
+    def _calc_datapoints(self):
+        """
+        Calculates the number of datapoints in the measurement
+        """
+
+        swp_forward, swp_reverse = self._sweep_profile()
+        return len(swp_forward) + len(swp_reverse)
+
+    def _make_estimator(self):
+        """
+        Builds a run time estimator for the current sweep parameters and test
+          matrix, or returns None if the parameters are invalid
+        """
+
+        swp_forward, swp_reverse = self._sweep_profile()
+        try:
+            delay = float(self.delay_entry.get())
+        except ValueError:
+            return None
 
-        if upper > 9.5:
-            auto_update_entry(self.swp_upp_lim_entry, "9.5")
+        return SweepEstimator([len(swp_forward), len(swp_reverse)], len(self.test_matrix), delay)
 
-        if lower < -9.5:
-            auto_update_entry(self.swp_low_lim_entry, "-9.5")
+    def _update_estimate(self):
+        """
+        Updates the run time estimate label
+        """
 
-        if (upper > lower):
-            num_pts = int((upper-lower)/step)
-            if self.swp_sym_var.get():
-                num_pts *= 2
-            return num_pts
+        estimator = self._make_estimator()
+        if (estimator is None) or (estimator.total_duration() == 0) or (not self.test_matrix):
+            self.est_label["text"] = "Est. time: -"
         else:
-            return 0
+            self.est_label["text"] = f"Est. time: {format_duration(estimator.total_duration())}"
 
     def _update_num_points(self):
         """
         Callback function for updating number of points label
         """
         
-        self.points_label["text"] = f"Datapoints: {self._calc_datapoints()}"
+        self.points_label["text"] = f"Datapoints/run: {self._calc_datapoints()}"
+        self._update_estimate()
         return True
 
+    def _update_progress(self, leg, points_done):
+        """
+        Updates the live progress readout during a sweep
+
+        Parameters
+        ----------
+        leg: name of the leg being measured
+        points_done: number of points measured so far in that leg
+        """
+
+        engine = self.engine
+        leg_index = engine.legs.index(leg)
+        remaining = engine.estimator.remaining(engine.entry_index, leg_index, points_done)
+        eta = engine.estimator.eta(engine.entry_index, leg_index, points_done)
+        self.progress_label["text"] = (f"Progress: run {engine.entry_index+1}/{engine.n_entries}, "
+                                       f"{leg} point {points_done}/{engine.leg_length(leg)} | "
+                                       f"{format_duration(remaining)} left, ETA {eta.strftime('%a %H:%M')} | "
+                                       f"read {engine.timing['acquire'].mean*1e3:.0f} ms, "
+                                       f"record {engine.timing['record'].mean*1e3:.1f} ms per point")
+
+    def _connect(self, driver, addr, on_open=None):
+        """
+        Returns a live instrument object from the pool for the given driver
+          and address, or None if the driver cannot be loaded or the
+          instrument cannot be reached
+        """
+
+        try:
+            cls = registry.load(driver)
+        except Exception as e:
+            print(f"Could not load instrument driver {driver}: {e}")
+            return None
+        return self.pool.get(cls, addr, on_open)
+
+    def _start_connections(self):
+        """
+        Handles button that updates instrument connections, connecting them on
+          a background thread so the window stays responsive
+        """
+
+        threading.Thread(target=self._update_connections, daemon=True).start()
+
+    def _open_resource_manager(self):
+        """
+        Opens the VISA resource manager and instrument pool on first use.
+          pyvisa is only imported here, off the GUI thread, as loading the
+          VISA library can be slow
+        """
+
+        if self.rm is None:
+            import pyvisa as visa
+
+            self.rm = visa.ResourceManager(self.backend)
+            self.pool = InstrumentPool(self.rm)
+
     def _update_connections(self):
         """
-        Handles button that updates intstrument connections
+        Updates the instrument connections. Sessions are kept open in the
+          instrument pool, so an instrument is only re-opened and
+          re-initialized if it has stopped responding. The instruments are
+          connected in parallel, so an instrument that is switched off only
+          costs a single VISA timeout, and each connection indicator is set as
+          soon as its instrument has answered (or failed to)
         """
-        
-        resources = self.rm.list_resources()
-        
-        if self.kth_addr in resources:
-            self.kth_label["background"] = "green"
-            self.kth = Kth6221(self.rm, self.kth_addr)
 
-            # set output low to earth ground
-            self.kth.set_output_low()
+        with self.connect_lock:
+            try:
+                self._open_resource_manager()
+            except Exception as e:
+                self._set_status(f"Could not open the VISA backend: {e}", "red")
+                return
 
-            # set output amplitude
-            self.kth.set_wave_ampl(10e-6)
+            labels = self.role_labels
+            on_open = ROLE_SETUP
+
+            for label in list(labels.values()) + [self.lia_label]:
+                label["background"] = "yellow"
+
+            lias = {}
+            with ThreadPoolExecutor(max_workers=len(self.roles) + len(self.lia_addrs)) as executor:
+                futures = {executor.submit(self._connect, spec["driver"], spec["addr"], on_open.get(role)): (role, None)
+                           for role, spec in self.roles.items()}
+                futures.update({executor.submit(self._connect, spec["driver"], spec["addr"]): ("lia", detector)
+                                for detector, spec in self.detector_specs.items()})
+
+                for future in as_completed(futures):
+                    role, detector = futures[future]
+                    instrument = future.result()
+                    if detector is not None:
+                        lias[detector] = instrument
+                        if instrument is None:
+                            self.lia_label["background"] = "red"
+                        elif (len(lias) == len(self.lia_addrs)) and (None not in lias.values()):
+                            self.lia_label["background"] = "green"
+                        continue
+
+                    self.instruments[role] = instrument
+                    if role in labels:
+                        labels[role]["background"] = "green" if instrument is not None else "red"
+
+            # one lock-in per detector, the first one is used for the live readout
+            self.lias = {detector: lias[detector] for detector in self.lia_addrs}
+            self.lia = next(iter(self.lias.values()))
+
+    def _set_status(self, text, color):
+        """
+        Sets the text and color of the status label
+        """
 
-            # make sure output is off
-            self.kth.stop_output()
+        self.status["text"] = text
+        self.status["background"] = color
 
-            # self.current_value["text"] = f"{round(float(self.kth.get_wave_ampl())/(1e-6), 3)}"
-        else:
-            self.kth_label["background"] = "red"
-            self.kth = None
+    def _device_settings(self):
+        """
+        Collects the run settings shared by every kind of sweep from the GUI fields
 
-        if self.lia_addr in resources:
-            self.lia_label["background"] = "green"
-            self.lia = SR850(self.rm, self.lia_addr)
-        else:
-            self.lia_label["background"] = "red"
-            self.lia = None
+        Returns the settings dictionary, or None if the fields are invalid
+        """
 
-        if self.mag_psup_addr in resources:
-            self.mag_psup_label["background"] = "green"
-            self.mag_psup = LS642(self.rm, self.mag_psup_addr)
-        else:
-            self.mag_psup_label["background"] = "red"
-            self.mag_psup = None
+        if self.folder == "":
+            self._set_status("Please select a folder to save the data to!", "red")
+            return None
 
-        if self.gmeter_addr in resources:
-            self.gmeter_label["background"] = "green"
-            self.gmeter = LS475(self.rm, self.gmeter_addr)
-        else:
-            self.gmeter_label["background"] = "red"
-            self.gmeter = None
+        try:
+            delay = float(self.delay_entry.get())
+        except ValueError:
+            self._set_status("Invalid input for delay!", "red")
+            return None
+
+        return {"folder": self.folder,
+                "row": self.device_row_entry.get(),
+                "col": self.device_col_entry.get(),
+                "notes": self.notes_tb.get("1.0", "end-1c"),
+                "electrodes": self._electrode_config(),
+                "delay": delay,
+                "synchronized": bool(self.sync_var.get()),
+                "detection": "delta" if self.delta_var.get() else "lockin"}
+
+    def _electrode_config(self):
+        """
+        Collects the electrode configuration from the GUI fields. With several
+          detectors, the detector distance field holds a comma separated list
+          of distances in the order the detectors are listed in config.json
+        """
 
-        if self.spa_addr in resources:
-            self.spa_label["background"] = "green"
-            self.spa = B1500A(self.rm, self.spa_addr)
+        e_data = {"injector": self.injector_entry.get(),
+                  "detector dist": self.detector_dist_entry.get(),
+                  "detector angle": self.detector_angle_entry.get()}
 
-            # make sure voltage to SMU3 is off
-            self.spa.connect_smu()
-            self.spa.set_voltage(0)
-            
-        else:
-            self.spa_label["background"] = "red"
-            self.spa = None
-
-    def _reset_data(self):
-        self.data_forward = {"DATETIME": [],
-                             "PSUP SP (A)": [],
-                             "PSUP I (A)": [],
-                             "PSUP V (V)": [],
-                             "MAGFIELD (G)": [],
-                             "TEMP (C)": [],
-                             "LIA X (V)": [],
-                             "LIA Y (V)": [],
-                             "LIA R (V)": [],
-                             "LIA THETA (deg)": [],
-                             "KTH OUTPUT (A)": [],
-                             "KTH FREQ (HZ)": [],
-                             "BGV (V)": [],
-                             "R_NL (ohm)": []}
-                             
-
-        self.data_reverse = {"DATETIME": [],
-                             "PSUP SP (A)": [],
-                             "PSUP I (A)": [],
-                             "PSUP V (V)": [],
-                             "MAGFIELD (G)": [],
-                             "TEMP (C)": [],
-                             "LIA X (V)": [],
-                             "LIA Y (V)": [],
-                             "LIA R (V)": [],
-                             "LIA THETA (deg)": [],
-                             "KTH OUTPUT (A)": [],
-                             "KTH FREQ (HZ)": [],
-                             "BGV (V)": [],
-                             "R_NL (ohm)": []}
+        if len(self.lia_addrs) > 1:
+            distances = [d.strip() for d in e_data["detector dist"].split(",")]
+            if len(distances) != len(self.lia_addrs):
+                distances = [e_data["detector dist"]]*len(self.lia_addrs)
+            e_data["detectors"] = {detector: {"lock-in": addr, "detector dist": distance}
+                                   for (detector, addr), distance in zip(self.lia_addrs.items(), distances)}
 
-    def _begin_sweep(self):
+        return e_data
+
+    def _sweep_settings(self):
         """
-        Creates separate thread and runs the sweep callback function
+        Collects the run settings from the GUI fields
+
+        Returns the settings dictionary for the sweep engine, or None if the
+          fields are invalid
         """
 
+        swp_forward, swp_reverse = self._sweep_profile()
+        if not swp_forward:
+            self._set_status("Make sure that the sweep lower limit is lower than the sweep upper limit!", "red")
+            return None
+
+        settings = self._device_settings()
+        if settings is None:
+            return None
+
+        if not self.test_matrix:
+            self._set_status("Please enter valid sweep parameters!", "red")
+            return None
+
+        target = None
+        if self.target_entry.get().strip():
+            try:
+                target = float(self.target_entry.get())
+            except ValueError:
+                target = -1
+            if target <= 0:
+                self._set_status("Invalid input for target uncertainty!", "red")
+                return None
+
+        try:
+            field_read_every = int(self.field_every_entry.get())
+        except ValueError:
+            field_read_every = 0
+        if field_read_every < 1:
+            self._set_status("Invalid input for field read interval!", "red")
+            return None
+
+        settings.update({"forward": swp_forward,
+                         "reverse": swp_reverse,
+                         "test_matrix": self.test_matrix,
+                         "target_uncertainty": target,
+                         "field_read_every": field_read_every})
+        return settings
+
+    def _gate_sweep_settings(self):
         """
-        threading.Thread(target=lambda loop: loop.run_until_complete(self._run_sweep()),
-                         args=(asyncio.new_event_loop(),)).start()
+        Collects the gate sweep settings from the GUI fields and the forward
+          data of a prior sweep chosen by the user
+
+        Returns the settings dictionary for the gate sweep engine, or None if
+          the fields are invalid or the user cancels
         """
-        self.sweep_loop = asyncio.new_event_loop()
-        self.stop_thread = False
-        threading.Thread(target=lambda loop: loop.run_until_complete(self._run_sweep()),
-                         args=(self.sweep_loop,)).start()
 
-    def _test(self, frame=None):
-        self.master.after(1000, self._test, self.master)
-        self._update_connections()
+        settings = self._device_settings()
+        if settings is None:
+            return None
 
-        if self.lia:
-            lia_rdg = self.lia.data_point()
-            self.lia_x_rdg["text"] = f"X: {round(lia_rdg['X']/(1e-6), 3)} uV"
-            self.lia_y_rdg["text"] = f"Y: {round(lia_rdg['Y']/(1e-6), 3)} uV"
-            self.lia_r_rdg["text"] = f"R: {round(lia_rdg['R']/(1e-6), 3)} uV"
-            self.lia_theta_rdg["text"] = f"Theta: {round(lia_rdg['T'], 1)} deg"
-        else:
-            self.lia_x_rdg["text"] = "X: -"
-            self.lia_y_rdg["text"] = "Y: -"
-            self.lia_r_rdg["text"] = "R: -"
-            self.lia_theta_rdg["text"] = "Theta: -"
+        if not (self.freqs and self.currents and self.bgvs):
+            self._set_status("Please enter valid sweep parameters!", "red")
+            return None
 
-        if self.gmeter:
-            self.gmeter_field_rdg["text"] = f"Field: {round(self.gmeter.get_field_reading(), 3)} G"
-            self.gmeter_temp_rdg["text"] = f"Temp: {round(self.gmeter.get_temp_reading(), 1)} C"
-        else:
-            self.gmeter_field_rdg["text"] = "Field: -"
-            self.gmeter_temp_rdg["text"] = "Temp: -"
+        if (len(self.freqs) > 1) or (len(self.currents) > 1):
+            self._set_status("Gate sweeps use a single frequency and current!", "red")
+            return None
 
-        if self.mag_psup:
-            self.mag_psup_setpt["text"] = f"Setpoint: {round(float(self.mag_psup.get_setpoint()), 3)} A"
-            self.mag_psup_curr_rdg["text"] = f"Output Current: {round(float(self.mag_psup.get_current()), 3)} A"
-            self.mag_psup_volt_rdg["text"] = f"Output Voltage: {round(float(self.mag_psup.get_voltage()), 3)} V"
-        else:
-            self.mag_psup_curr_rdg["text"] = "-"
+        path = fd.askopenfilename(title="Select the forward data of a prior sweep", initialdir=self.folder,
+                                  filetypes=[("Forward sweep data", "*_forward.csv"), ("CSV files", "*.csv")])
+        if not path:
+            return None
 
-    def _await_test(self):
-        threading.Thread(target=lambda loop: loop.run_until_complete(self._test_2()))
+        import pandas as pd
 
-    async def _run_sweep(self):
+        try:
+            prior = pd.read_csv(path)
+            # with several detectors, the spin states of the first one are used
+            rnl_columns = [column for column in prior.columns if column.startswith("R_NL (ohm)")]
+            if not rnl_columns:
+                raise KeyError("R_NL (ohm)")
+            states = find_spin_states(prior["PSUP SP (A)"], prior[rnl_columns[0]])
+        except (OSError, KeyError, ValueError) as e:
+            self._set_status(f"Could not find the spin states in '{path}': {e}", "red")
+            return None
+
+        if not messagebox.askokcancel("Gate sweep",
+                                      f"Hold the magnet at {states['ap_setpoint']:g} A, where the prior sweep "
+                                      f"had a spin signal of {states['spin_signal']:.4g} ohm, and sweep the "
+                                      f"backgate through {len(self.bgvs)} voltages in the P and AP states?"):
+            return None
+
+        settings["electrodes"]["prior sweep"] = path
+        settings.update({"frequency": self.freqs[0],
+                         "current": self.currents[0],
+                         "bgvs": self.bgvs,
+                         "hold_setpoint": states["ap_setpoint"]})
+        return settings
+
+    def _sweep_running(self):
         """
-        Callback function that runs in separate thread to maintain updating features
+        Checks whether a sweep is already running, reporting it on the status label
         """
 
-        self._update_connections()
+        if (self.sweep_thread is not None) and self.sweep_thread.is_alive():
+            self._set_status("A sweep is already running!", "red")
+            return True
+        return False
 
-        if self._calc_datapoints() == 0:
-            self.status["text"] = "Make sure that the sweep lower limit is lower than the sweep upper limit!"
-            self.status["background"] = "red"
+    def _sweep_engine_cls(self, settings):
+        """
+        Returns the engine class that runs a field sweep test matrix, which is
+          the TemperatureSweepEngine if the entries have temperatures. Reports
+          on the status label and returns None if there is no temperature
+          controller for a temperature series
+        """
+
+        if "temperature" not in settings["test_matrix"][0]:
+            return SweepEngine
+
+        if "temp" not in self.roles:
+            self._set_status("Add a \"temp\" temperature controller role to config.json to run a temperature series!", "red")
+            return None
+        return TemperatureSweepEngine
+
+    def _begin_sweep(self):
+        """
+        Creates separate thread and runs the sweep callback function
+        """
+
+        if self._sweep_running():
+            return
+
+        settings = self._sweep_settings()
+        if settings is None:
+            return
+
+        engine_cls = self._sweep_engine_cls(settings)
+        if engine_cls is None:
+            return
+
+        checkpoint = Checkpoint(self.folder)
+        if checkpoint.exists():
+            if not messagebox.askyesno("Interrupted run found",
+                                       "This folder holds an interrupted run that can be resumed. Start a new sweep and discard it?"):
+                return
+            checkpoint.clear()
+
+        self._start_sweep_thread(settings, engine_cls=engine_cls)
+
+    def _resume_sweep(self):
+        """
+        Resumes the interrupted run saved in the selected folder
+        """
+
+        if self._sweep_running():
             return
 
         if self.folder == "":
-            self.status["text"] = "Please select a folder to save the data to!"
-            self.status["background"] = "red"
+            self._set_status("Please select the folder of the run to resume!", "red")
             return
 
-        if None in [self.kth, self.lia, self.mag_psup, self.gmeter]:
-            self.status["text"] = "Please make sure all instruments are connected!"
-            self.status["background"] = "red"
+        state = Checkpoint(self.folder).load()
+        if state is None:
+            self._set_status(f"No interrupted run to resume in '{self.folder}'", "red")
             return
-        
-        # clearing the plots
-        self.f_ax1.cla()
-        self.r_ax1.cla()
-        self.colors_used = []
 
-        for datapoint in self.test_matrix:
-            run_freq = datapoint["frequency"]
-            run_curr = datapoint["current"]
-            run_bgv = datapoint["bgv"]
-            
-            self.status["text"] = f"Running sweep: Frequency={run_freq} Hz, Current={run_curr} uA, BGV={run_bgv} V"
-            self.status["background"] = "cyan"
+        engine_cls = self._sweep_engine_cls(state["settings"])
+        if engine_cls is None:
+            return
 
-            row = self.device_row_entry.get()
-            col = self.device_col_entry.get()
+        num_entries = len(state["settings"]["test_matrix"])
+        if not messagebox.askokcancel("Resume sweep",
+                                      f"Resume at run {state['entry_index']+1}/{num_entries}, "
+                                      f"{state['leg']} leg, point {state['points_done']+1}? "
+                                      "The magnet will be re-homed first."):
+            return
 
-            base_name = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{row}_{col}"
+        self._start_sweep_thread(state["settings"], state, engine_cls)
 
-            # getting injection current amplitude
-            inj_current = float(run_curr)*1.0e-6
-            if abs(inj_current) <= CURRENT_LIMIT:
-                self.kth.set_wave_ampl(inj_current)
-            else:
-                self.status["text"] = f"Keep the injection current below the limit of {CURRENT_LIMIT} A!"
-                self.status["background"] = "red"
-                return
+    def _begin_gate_sweep(self):
+        """
+        Runs a backgate voltage sweep with the field held at the spin states
+          found in a prior sweep
+        """
 
-            # getting injection current frequency
-            inj_freq = float(run_freq)
-            if (inj_freq <= FREQ_LIMIT) and (inj_freq > 0):
-                self.kth.set_wave_freq(inj_freq)
-            else:
-                self.status["text"] = f"Keep the injection frequency below the limit of {FREQ_LIMIT} Hz!"
-                self.status["background"] = "red"
-                return
+        if self._sweep_running():
+            return
 
-            # setting BGV
-            if (run_bgv <= 80) and (run_bgv >= -80):
-                self.spa.set_voltage(run_bgv)
-            else:
-                self.status["text"] = f"Keep the backgate voltage between -80 and 80 V!"
-                self.status["background"] = "red"
+        settings = self._gate_sweep_settings()
+        if settings is None:
+            return
+
+        self._start_sweep_thread(settings, engine_cls=GateSweepEngine)
+
+    def _start_sweep_thread(self, settings, resume=None, engine_cls=SweepEngine):
+        self.sweep_thread = threading.Thread(target=self._sweep_thread, args=(settings, resume, engine_cls))
+        self.sweep_thread.start()
+
+    def _reset_plots(self, xlabel):
+        """
+        Clears the plots before a new sweep
+        """
+
+        self.sweep_plots.reset(xlabel)
+        self.colors_used = []
+
+    def _sweep_thread(self, settings, resume=None, engine_cls=SweepEngine):
+        """
+        Runs the sweep engine, with the live readout poller paused so the sweep
+          has the instruments to itself
+
+        Parameters
+        ----------
+        settings: run settings for the sweep engine
+        resume: optional run state to resume from
+        engine_cls: SweepEngine, or GateSweepEngine for a gate voltage sweep
+        """
+
+        self.poller.pause()
+        try:
+            self._update_connections()
+            self.plots_ready.wait()
+
+            # the lock-ins are not used in delta mode, and optional roles that
+            #   are not connected are skipped
+            lias = [] if settings.get("detection") == "delta" else list(self.lias.values())
+            if None in [self.instruments[role] for role in REQUIRED_ROLES] + lias:
+                self._set_status("Please make sure all instruments are connected!", "red")
+                return
+            if (engine_cls is TemperatureSweepEngine) and (self.instruments.get("temp") is None):
+                self._set_status("Please make sure the temperature controller is connected!", "red")
                 return
 
-            # getting sweep profile
-            swp_start = float(self.swp_low_lim_entry.get())
-            swp_end = float(self.swp_upp_lim_entry.get())
-            swp_delta = float(self.swp_step_entry.get())
-
-            swp_forward = list(np.arange(swp_start, swp_end+swp_delta, swp_delta))
-            swp_reverse = []
-
-            if self.swp_sym_var.get():
-                swp_reverse = swp_forward[::-1]
-
-            swp_forward = [round(i, 3) for i in swp_forward]
-            swp_reverse = [round(i, 3) for i in swp_reverse]
-
-            notes = self.notes_tb.get("1.0", "end-1c")
-
-            delay = float(self.delay_entry.get())     
-
-            # starting current output
-            self.kth.start_output()
-
-            # plot color
-            plot_color = random.choice(list(COLORS.keys()))
-
-            # setting up new line to draw
-            self.f_line, = self.f_ax1.plot(self.data_forward["MAGFIELD (G)"], self.data_forward["R_NL (ohm)"], color=plot_color, marker="o", markersize=3,
-                                           label=f"Frequency={run_freq} Hz, Current={run_curr} uA, BGV={run_bgv} V")
-            self.r_line, = self.r_ax1.plot(self.data_reverse["MAGFIELD (G)"], self.data_reverse["R_NL (ohm)"], color=plot_color, marker="o", markersize=3,
-                                           label=f"Frequency={run_freq} Hz, Current={run_curr} uA, BGV={run_bgv} V")
-
-            for m,i in enumerate(swp_forward):
-                if self.stop_thread:
-                    self._cleanup_sweep()
-                    return
-                    
-                self.mag_psup.set_current(i)
-                # delay for longer on first measurement to allow magnet to ramp
-                if m == 0:
-                    time.sleep(10)
-
-                # appending data
-                try:
-                    self.data_forward["DATETIME"].append(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                    self.data_forward["PSUP SP (A)"].append(round(float(self.mag_psup.get_setpoint()), 3))
-                    # self.data_forward["PSUP SP (A)"].append("-")
-                    self.data_forward["PSUP I (A)"].append(round(float(self.mag_psup.get_current()), 3))
-                    self.data_forward["PSUP V (V)"].append(round(float(self.mag_psup.get_voltage()), 3))
-                    self.data_forward["MAGFIELD (G)"].append(round(self.gmeter.get_field_reading(), 3))
-                    self.data_forward["TEMP (C)"].append(round(self.gmeter.get_temp_reading(), 1))
-                    lia_rdg = self.lia.data_point()
-                    self.data_forward["LIA X (V)"].append(lia_rdg["X"])
-                    self.data_forward["LIA Y (V)"].append(lia_rdg["Y"])
-                    self.data_forward["LIA R (V)"].append(lia_rdg["R"])
-                    self.data_forward["LIA THETA (deg)"].append(lia_rdg["T"])
-                    curr = float(self.kth.get_wave_ampl())
-                    self.data_forward["KTH OUTPUT (A)"].append(curr)
-                    self.data_forward["KTH FREQ (HZ)"].append(inj_freq)
-                    self.data_forward["BGV (V)"].append(run_bgv)
-                    self.data_forward["R_NL (ohm)"].append(round(lia_rdg["X"]/curr, 3))
-                    
-                    time.sleep(delay)
-                except Exception as e:
-                    print(e)
-                    print("Timeout error...")
-                    time.sleep(5)
-                    
-                self.f_ax1.relim()
-                self.f_ax1.autoscale_view()
-                self.f_line.set_data(self.data_forward["MAGFIELD (G)"], self.data_forward["R_NL (ohm)"])
-                self.f_plotcanv.draw()
-                self.f_plotcanv.flush_events()
-
-            # resetting magnet by sweeping to high positive current
-            self.mag_psup.set_current(9.5)
-            time.sleep(10)
-            
-
-            for n,j in enumerate(swp_reverse):
-                if self.stop_thread:
-                    self._cleanup_sweep()
-                    return
-                
-                self.mag_psup.set_current(j)
-                # delay for longer on first measurement to allow magnet to ramp
-                if n == 0:
-                    time.sleep(10)
-                
-                # appending data
-                try:
-                    self.data_reverse["DATETIME"].append(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-                    self.data_reverse["PSUP SP (A)"].append(round(float(self.mag_psup.get_setpoint()), 3))
-                    # self.data_reverse["PSUP SP (A)"].append("-")
-                    self.data_reverse["PSUP I (A)"].append(round(float(self.mag_psup.get_current()), 3))
-                    self.data_reverse["PSUP V (V)"].append(round(float(self.mag_psup.get_voltage()), 3))
-                    self.data_reverse["MAGFIELD (G)"].append(round(self.gmeter.get_field_reading(), 3))
-                    self.data_reverse["TEMP (C)"].append(round(self.gmeter.get_temp_reading(), 1))
-                    lia_rdg = self.lia.data_point()
-                    self.data_reverse["LIA X (V)"].append(lia_rdg["X"])
-                    self.data_reverse["LIA Y (V)"].append(lia_rdg["Y"])
-                    self.data_reverse["LIA R (V)"].append(lia_rdg["R"])
-                    self.data_reverse["LIA THETA (deg)"].append(lia_rdg["T"])
-                    curr = float(self.kth.get_wave_ampl())
-                    self.data_reverse["KTH OUTPUT (A)"].append(curr)
-                    self.data_reverse["KTH FREQ (HZ)"].append(inj_freq)
-                    self.data_reverse["BGV (V)"].append(run_bgv)
-                    self.data_reverse["R_NL (ohm)"].append(round(lia_rdg["X"]/curr, 3))
-                    
-                    time.sleep(delay)
-                except Exception as e:
-                    print(e)
-                    print("Timeout error...")
-                    time.sleep(5)
-
-                self.r_ax1.relim()
-                self.r_ax1.autoscale_view()
-                self.r_line.set_data(self.data_reverse["MAGFIELD (G)"], self.data_reverse["R_NL (ohm)"])
-                self.r_plotcanv.draw()
-                self.r_plotcanv.flush_events()
-
-            # resetting magnet by sweeping to high negative current
-            self.mag_psup.set_current(-9.5)
-            time.sleep(10)
-
-            
-            
-            pd.DataFrame(data=self.data_forward).to_csv(os.path.join(self.folder, f"{base_name}_forward.csv"), index=False)
-            pd.DataFrame(data=self.data_reverse).to_csv(os.path.join(self.folder, f"{base_name}_reverse.csv"), index=False)
-
-            if notes:
-                with open(os.path.join(self.folder, f"{base_name}_notes.txt"), "w") as f:
-                    f.write(notes)
-
-            # saving electrode configuration
-            e_data = {"injector": self.injector_entry.get(),
-                    "detector dist": self.detector_dist_entry.get(),
-                    "detector angle": self.detector_angle_entry.get()}
-
-            with open(os.path.join(self.folder, f"{base_name}_electrodes.json"), "w") as f:
-                json.dump(e_data, f, indent=4)
-                
-
-            self.mag_psup.set_current(0)
-            self.kth.stop_output()
-            self.spa.set_voltage(0)
-            self.spa.disconnect_smu()
-            self.spa.connect_smu()
-            
-            self.status["text"] = "Sweep complete"
-            self.status["background"] = "green"
-            self._reset_data()
+            gate_sweep = engine_cls is GateSweepEngine
+
+            # clearing the plots
+            self._reset_plots("BGV (V)" if gate_sweep else "Mag. Field (G)")
+            if gate_sweep:
+                self.r_ax1.set_ylabel("R_NL AP - P (Ohm)")
+
+            instruments = engine_instruments(self.instruments, self.lias, self.roles)
+
+            self.engine = engine_cls(instruments,
+                                     settings,
+                                     on_status=self._set_status,
+                                     on_entry=self._on_gate_entry if gate_sweep else self._on_sweep_entry,
+                                     on_point=self._on_gate_point if gate_sweep else self._on_sweep_point,
+                                     stream=self.stream)
+
+            if self.engine.run(resume):
+                self.progress_label["text"] = f"Progress: all {self.engine.n_entries} runs complete"
+        finally:
+            self.engine = None
+            self.poller.resume()
+
+    def _on_sweep_entry(self, entry_index, entry):
+        """
+        Sets up new plot lines when the sweep engine starts a test matrix entry
+        """
+
+        self.sweep_plots.start_entry(self.engine, entry)
+
+    def _on_sweep_point(self, leg, points_done, duration):
+        """
+        Updates the plots, live readouts and progress after each datapoint
+
+        Parameters
+        ----------
+        leg: "forward" or "reverse"
+        points_done: number of points measured so far in the leg
+        duration: time taken by the datapoint (sec)
+        """
+
+        data = self.engine.data[leg]
+        if data["DATETIME"]:
+            self._publish_point(data)
+
+        self.sweep_plots.point(self.engine, leg)
 
+        self._update_progress(leg, points_done)
+
+    def _on_gate_entry(self, entry_index, entry):
+        """
+        Sets up the plot lines of a gate voltage sweep
+        """
+
+        label = f"Frequency={entry['frequency']:g} Hz, Current={entry['current']:g} uA"
+        self.gate_lines = {"P": self.f_ax1.plot([], [], color="tab:blue", marker="o", markersize=3, label=f"P, {label}")[0],
+                           "AP": self.f_ax1.plot([], [], color="tab:red", marker="o", markersize=3, label=f"AP, {label}")[0]}
+        self.f_ax1.legend(loc="upper right", fontsize="small")
+        self.r_line, = self.r_ax1.plot([], [], color="tab:purple", marker="o", markersize=3, label=label)
+
+    def _on_gate_point(self, state, points_done, duration):
+        """
+        Updates the plots, live readouts and progress after each datapoint of
+          a gate voltage sweep. The lower plot shows the spin signal (AP - P)
+          at the backgate voltages measured in both states so far
+
+        Parameters
+        ----------
+        state: "P" or "AP"
+        points_done: number of points measured so far in that state
+        duration: time taken by the datapoint (sec)
+        """
+
+        data = self.engine.data[state]
+        if data["DATETIME"]:
+            self._publish_point(data)
+
+        # with several detectors, the first one is plotted
+        rnl_column = self.engine.rnl_columns[0]
+        self.gate_lines[state].set_data(data["BGV (V)"], data[rnl_column])
+        self.f_ax1.relim()
+        self.f_ax1.autoscale_view()
+        self.f_plotcanv.draw()
+        self.f_plotcanv.flush_events()
+
+        p_rnl = dict(zip(self.engine.data["P"]["BGV (V)"], self.engine.data["P"][rnl_column]))
+        ap = self.engine.data["AP"]
+        bgvs = [bgv for bgv in ap["BGV (V)"] if bgv in p_rnl]
+        signal = [r - p_rnl[bgv] for bgv, r in zip(ap["BGV (V)"], ap[rnl_column]) if bgv in p_rnl]
+        self.r_line.set_data(bgvs, signal)
+        self.r_ax1.relim()
+        self.r_ax1.autoscale_view()
+        self.r_plotcanv.draw()
+        self.r_plotcanv.flush_events()
+
+        self._update_progress(state, points_done)
+
+    def _poll_lia(self):
+        if self.lia:
+            return self.lia.data_point()
+
+    def _poll_role(self, role):
+        instrument = self.instruments.get(role)
+        if instrument:
+            return instrument.snapshot()
+
+    def _publish_point(self, data):
+        """
+        Publishes the latest datapoint of a sweep to the live readout cache, in
+          place of the readings the paused poller would have taken
+
+        Parameters
+        ----------
+        data: data dictionary (forward or reverse) the point was appended to
+        """
+
+        # the live readout shows the first detector
+        detectors = self.engine.detectors
+        lia_columns = {key: detector_column(column, detectors[0], detectors)
+                       for key, column in (("X", "LIA X (V)"), ("Y", "LIA Y (V)"), ("R", "LIA R (V)"), ("T", "LIA THETA (deg)"))}
+        self.readings.update("lia", {key: data[column][-1] for key, column in lia_columns.items()})
+        self.readings.update("gmeter", {"field": data["MAGFIELD (G)"][-1],
+                                        "temp": data["TEMP (C)"][-1]})
+        self.readings.update("mag_psup", {"setpoint": data["PSUP SP (A)"][-1],
+                                          "current": data["PSUP I (A)"][-1],
+                                          "voltage": data["PSUP V (V)"][-1]})
+
+    def _refresh_readouts(self):
+        """
+        Updates the live readout labels from the reading cache. Never touches
+          the instruments, so it is safe to run on the GUI thread
+        """
+
+        self.master.after(1000, self._refresh_readouts)
+
+        lia_rdg, _ = self.readings.get("lia", READING_MAX_AGE)
+        if lia_rdg:
+            self.lia_x_rdg["text"] = f"X: {round(lia_rdg['X']/(1e-6), 3)} uV"
+            self.lia_y_rdg["text"] = f"Y: {round(lia_rdg['Y']/(1e-6), 3)} uV"
+            self.lia_r_rdg["text"] = f"R: {round(lia_rdg['R']/(1e-6), 3)} uV"
+            self.lia_theta_rdg["text"] = f"Theta: {round(lia_rdg['T'], 1)} deg"
+        else:
+            self.lia_x_rdg["text"] = "X: -"
+            self.lia_y_rdg["text"] = "Y: -"
+            self.lia_r_rdg["text"] = "R: -"
+            self.lia_theta_rdg["text"] = "Theta: -"
+
+        gmeter_rdg, _ = self.readings.get("gmeter", READING_MAX_AGE)
+        if gmeter_rdg:
+            self.gmeter_field_rdg["text"] = f"Field: {round(gmeter_rdg['field'], 3)} G"
+            self.gmeter_temp_rdg["text"] = f"Temp: {round(gmeter_rdg['temp'], 1)} C"
+        else:
+            self.gmeter_field_rdg["text"] = "Field: -"
+            self.gmeter_temp_rdg["text"] = "Temp: -"
+
+        mag_psup_rdg, _ = self.readings.get("mag_psup", READING_MAX_AGE)
+        if mag_psup_rdg:
+            self.mag_psup_setpt["text"] = f"Setpoint: {round(mag_psup_rdg['setpoint'], 3)} A"
+            self.mag_psup_curr_rdg["text"] = f"Output Current: {round(mag_psup_rdg['current'], 3)} A"
+            self.mag_psup_volt_rdg["text"] = f"Output Voltage: {round(mag_psup_rdg['voltage'], 3)} V"
+        else:
+            self.mag_psup_setpt["text"] = "Setpoint: -"
+            self.mag_psup_curr_rdg["text"] = "Output Current: -"
+            self.mag_psup_volt_rdg["text"] = "Output Voltage: -"
 
     def _stop_sweep(self):
         """
         Handles interrupt of sweep function
         """
-        if self.sweep_loop is not None:
-            self.stop_thread = True
-            self.sweep_loop = None
+        if self.engine is not None:
+            self.engine.stop()
 
-    def _cleanup_sweep(self):
+    def _parse_sweep_entry(self, entry, name, unit, limits):
         """
-        Cleans up after interrupt
+        Compiles the sweep specification in an entry box, reporting any
+          problem with it on the status label
+
+        Returns the list of values, or None if the specification is invalid
+
+        Parameters
+        ----------
+        entry: tkinter Entry widget holding the specification
+        name: name of the quantity, used in the error message
+        unit: unit of the values in the entry box
+        limits: (lower, upper) tuple the values must lie within
         """
-        self.mag_psup.set_current(0)
-        self.kth.stop_output()
-        self.spa.set_voltage(0)
-        self.spa.disconnect_smu()
-        self.spa.connect_smu()
-        self.status["text"] = "Sweep interrupted"
-        self.status["background"] = "red"
-        self._reset_data()
+
+        try:
+            return compile_sweep_spec(entry.get(), unit, limits).tolist()
+        except ValueError as e:
+            self.status["text"] = f"Invalid input for {name}: {e}"
+            self.status["background"] = "red"
+            return None
 
     def _check_sweep_params(self):
-        self.freqs = parse_entry(self.freq_entry.get())
         self.test_matrix = []
+        self.num_runs_label["text"] = "Number of runs: 0"
 
+        self.freqs = self._parse_sweep_entry(self.freq_entry, "frequency", "Hz", (0, FREQ_LIMIT))
         if self.freqs is None:
-            self.status["text"] = "Invalid input for frequency!"
-            self.status["background"] = "red"
             return True
-        else:
-            self.status["text"] = "-"
-            self.status["background"] = "green"
-
-        self.currents = parse_entry(self.current_entry.get())
 
-        if self.currents is None:
-            self.status["text"] = "Invalid input for current!"
+        if min(self.freqs) <= 0:
+            self.status["text"] = "Invalid input for frequency: frequencies must be above 0 Hz"
             self.status["background"] = "red"
             return True
-        else:
-            self.status["text"] = "-"
-            self.status["background"] = "green"
 
-        self.bgvs = parse_entry(self.bgv_entry.get())
+        self.currents = self._parse_sweep_entry(self.current_entry, "current", "uA",
+                                                (-CURRENT_LIMIT/1e-6, CURRENT_LIMIT/1e-6))
+        if self.currents is None:
+            return True
 
+        self.bgvs = self._parse_sweep_entry(self.bgv_entry, "backgate voltage", "V", (-BGV_LIMIT, BGV_LIMIT))
         if self.bgvs is None:
-            self.status["text"] = "Invalid input for backgate voltage!"
+            return True
+
+        self.temperatures = []
+        if self.temps_entry.get().strip():
+            self.temperatures = self._parse_sweep_entry(self.temps_entry, "temperature", "K", (0, TEMP_LIMIT))
+            if self.temperatures is None:
+                return True
+
+        try:
+            num_runs = int(self.num_entry.get())
+        except ValueError:
+            self.status["text"] = "Invalid input for runs per setting!"
             self.status["background"] = "red"
             return True
-        else:
-            self.status["text"] = "-"
-            self.status["background"] = "green"
 
-        num_runs = int(self.num_entry.get())
+        self.status["text"] = "-"
+        self.status["background"] = "green"
 
         for i in self.freqs:
             for j in self.currents:
@@ -854,19 +1182,55 @@ class App(tk.Frame):
                     for n in range(num_runs):
                         self.test_matrix.append({"frequency": i, "current": j, "bgv": k})
 
+        # the whole matrix is run at each temperature in turn
+        if self.temperatures:
+            self.test_matrix = [dict(entry, temperature=t) for t in self.temperatures for entry in self.test_matrix]
+
         self.num_runs_label["text"] = f"Number of runs: {len(self.test_matrix)}"
+        self._update_estimate()
         return True
 
+    def _wait_for_sweep(self, timeout):
+        """
+        Waits for the sweep thread to finish, so that it is not left using the
+          instruments while they are shut down and closed. The sweep thread
+          draws its plots through the GUI, so events are processed while
+          waiting
+
+        Parameters
+        ----------
+        timeout: longest time to wait (sec)
+        """
+
+        if self.sweep_thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self.sweep_thread.is_alive() and (time.monotonic() < deadline):
+            self.master.update()
+            self.sweep_thread.join(timeout=0.05)
+
     def closing_cleanup(self):
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
-            if self.mag_psup:
-                self.mag_psup.set_current(0)
-            if self.kth:
-                self.kth.stop_output()
-            if self.spa:
-                self.spa.set_voltage(0)
-                self.spa.disconnect_smu()
-            self.rm.close()
+            if self.engine is not None:
+                self.engine.stop()
+            self._wait_for_sweep(SWEEP_STOP_TIMEOUT)
+            self.poller.stop()
+            if self.stream is not None:
+                self.stream.stop()
+            mag_psup = self.instruments.get("mag_psup")
+            kth = self.instruments.get("kth")
+            spa = self.instruments.get("spa")
+            if mag_psup:
+                mag_psup.zero()
+            if kth:
+                kth.stop_output()
+            if spa:
+                spa.set_voltage(0, priority=PRIORITY_SAFETY)
+                spa.disconnect_smu()
+            if self.pool is not None:
+                self.pool.close_all()
+            if self.rm is not None:
+                self.rm.close()
             self.master.destroy()
 
 
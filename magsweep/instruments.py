@@ -1,9 +1,128 @@
+from contextlib import ExitStack, contextmanager
+import heapq
+import itertools
+import re
+import threading
 import time
 
-class Kth6221:
+# command priorities, higher priority commands are sent before lower priority
+#   commands that are waiting for the same instrument
+PRIORITY_NORMAL = 0
+PRIORITY_SAFETY = 10
+
+# full scale sensitivity of each SR850 sensitivity setting, 2 nV to 1 V (volts)
+SR850_SENSITIVITIES = [[2, 5, 10][i % 3]*10.0**(i//3 - 9) for i in range(27)]
+
+# SR850 output time constant of each time constant setting, 10 us to 30 ks (sec)
+SR850_TIME_CONSTANTS = [[1, 3][i % 2]*10.0**(i//2 - 5) for i in range(20)]
+
+# number of time constants the SR850 output takes to settle after a step, for
+#   each filter slope setting (6, 12, 18 and 24 dB/oct)
+SR850_SETTLE_FACTORS = [5, 7, 9, 10]
+
+class PriorityLock:
+    def __init__(self):
+        """
+        Re-entrant lock that is handed to waiting threads in order of priority
+          (and in order of arrival within a priority). A command that is already
+          being sent is never interrupted, but a high priority command waiting
+          for the lock goes ahead of every lower priority command
+        """
+        self._cond = threading.Condition()
+        self._owner = None
+        self._depth = 0
+        self._waiting = []
+        self._tickets = itertools.count()
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """
+        Blocks until the lock is granted to the calling thread
+
+        Parameters
+        ----------
+        priority: priority of the caller, higher values are granted the lock first
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                return
+
+            ticket = (-priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            while (self._owner is not None) or (self._waiting[0] != ticket):
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+
+            self._owner = me
+            self._depth = 1
+
+    def release(self):
+        """
+        Releases the lock held by the calling thread
+        """
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Cannot release a lock held by another thread")
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def hold(self, priority=PRIORITY_NORMAL):
+        """
+        Context manager that holds the lock for the duration of the block
+
+        Parameters
+        ----------
+        priority: priority of the caller, higher values are granted the lock first
+        """
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+_resource_locks = {}
+_resource_locks_guard = threading.Lock()
+
+def resource_lock(addr):
+    """
+    Returns the lock that serializes commands to the instrument at the given
+      address. Every object talking to the same address shares one lock, while
+      instruments at different addresses (or on different buses) have their
+      own locks and can be used in parallel
+
+    Parameters
+    ----------
+    addr: address of the instrument in your GPIB network
+    """
+    with _resource_locks_guard:
+        if addr not in _resource_locks:
+            _resource_locks[addr] = PriorityLock()
+        return _resource_locks[addr]
+
+class Instrument:
+    # maps the keys of a snapshot reading to the data column they are saved
+    #   under when the instrument is recorded alongside a sweep
+    snapshot_columns = {}
+
+    # single query that takes every value of a snapshot at once, the separator
+    #   of its response and the keys of the values in order. Instruments that
+    #   have one can be sampled together with others (see sample_together)
+    snapshot_query = None
+    snapshot_separator = ","
+    snapshot_keys = ()
+
     def __init__(self, rm, addr):
         """
-        Class that allows for interfacing with Keithley 6221 DC/AC current source
+        Base class for instruments on the GPIB network, holding the VISA session.
+          Drivers subclass it, sending their commands through write/query, and
+          override snapshot to report the readings they can take. Drivers
+          override initialize, rather than extending __init__, to send the
+          start-up commands of the instrument, so that the session is closed
+          if these fail
 
         Parameters
         ----------
@@ -12,7 +131,129 @@ class Kth6221:
         """
         self.rm = rm
         self.addr = addr
+        self.lock = resource_lock(self.addr)
+        self.instr = None
+        self.connect()
+
+    def connect(self):
+        """
+        Opens the VISA session to the instrument
+        """
         self.instr = self.rm.open_resource(self.addr)
+
+    def write(self, command, priority=PRIORITY_NORMAL):
+        """
+        Sends a command to the instrument, waiting for any other thread using
+          the instrument to finish first
+
+        Parameters
+        ----------
+        command: command string to send
+        priority: priority of the command (PRIORITY_SAFETY jumps the queue)
+        """
+        with self.lock.hold(priority):
+            self.instr.write(command)
+
+    def query_values(self, command, separator=",", priority=PRIORITY_NORMAL):
+        """
+        Sends a query to the instrument and returns the response parsed as a
+          list of floats, waiting for any other thread using the instrument to
+          finish first
+
+        Parameters
+        ----------
+        command: query string to send
+        separator: separator between the values of the response
+        priority: priority of the query (PRIORITY_SAFETY jumps the queue)
+        """
+        with self.lock.hold(priority):
+            return self.instr.query_ascii_values(command, separator=separator)
+
+    def query(self, command, priority=PRIORITY_NORMAL):
+        """
+        Sends a query to the instrument and returns the response, waiting for
+          any other thread using the instrument to finish first
+
+        Parameters
+        ----------
+        command: query string to send
+        priority: priority of the query (PRIORITY_SAFETY jumps the queue)
+        """
+        with self.lock.hold(priority):
+            return self.instr.query(command)
+
+    def session(self, priority=PRIORITY_NORMAL):
+        """
+        Context manager that gives the calling thread exclusive use of the
+          instrument for a sequence of commands that must not be interleaved
+
+        Parameters
+        ----------
+        priority: priority of the caller (PRIORITY_SAFETY jumps the queue)
+        """
+        return self.lock.hold(priority)
+
+    def initialize(self):
+        """
+        Puts the instrument in its start-up state once the session is opened
+        """
+        pass
+
+    def identify(self):
+        """
+        Queries the instrument for its identification string
+        """
+        return self.query("*IDN?")
+
+    def health_check(self):
+        """
+        Checks that the instrument still responds to a cheap identification query
+        """
+        try:
+            self.identify()
+            return True
+        except Exception:
+            return False
+
+    def snapshot(self):
+        """
+        Takes a reading of the instrument state, returning a dictionary with
+          the keys listed in snapshot_columns
+        """
+        if self.snapshot_query is None:
+            return {}
+        return dict(zip(self.snapshot_keys, self.query_values(self.snapshot_query, self.snapshot_separator)))
+
+    def read_snapshot(self):
+        """
+        Reads back the response to a snapshot query that has already been sent,
+          with the instrument held in a session (see sample_together)
+        """
+        return dict(zip(self.snapshot_keys, self.instr.read_ascii_values(separator=self.snapshot_separator)))
+
+    def close(self):
+        """
+        Closes the VISA session to the instrument
+        """
+        with self.lock.hold():
+            self.instr.close()
+
+class Kth6221(Instrument):
+    snapshot_columns = {"amplitude": "KTH OUTPUT (A)",
+                        "frequency": "KTH FREQ (HZ)"}
+
+    def __init__(self, rm, addr):
+        """
+        Class that allows for interfacing with Keithley 6221 DC/AC current source
+
+        Parameters
+        ----------
+        rm: VISA resource manager
+        addr: address of the instrument in your GPIB network
+        """
+        super().__init__(rm, addr)
+
+    def initialize(self):
         self.set_wave_freq()
         self.start_up()
 
@@ -30,25 +271,25 @@ class Kth6221:
           Earth ground, if the value is 0 the output low is set to the internal
           floating ground
         """
-        self.instr.write(f":OUTP:LTE {value}\r")
+        self.write(f":OUTP:LTE {value}\r")
 
     def get_curr_comp(self):
         """
         Queries the instrument for the current compliance
         """
-        return self.instr.query(":SOUR:CURR:COMP?")
+        return self.query(":SOUR:CURR:COMP?")
 
     def set_curr_comp(self, value=5):
         """
         Sets the current compliance of the instrument to the provided value
         """
-        self.instr.write(f":SOUR:CURR:COMP {value}\r")
+        self.write(f":SOUR:CURR:COMP {value}\r")
 
     def get_wave_func(self):
         """
         Queries the instrument for current wave function
         """
-        return self.instr.query(":SOUR:WAVE:FUNC?")
+        return self.query(":SOUR:WAVE:FUNC?")
 
     def set_wave_func(self, value="SIN"):
         """
@@ -56,48 +297,128 @@ class Kth6221:
         Acceptable values: SIN (sinusoid), SQU (square), RAMP (ramp), ARB{X}
         (arbitrary, where X is between 0 and 4)
         """
-        self.instr.write(f":SOUR:WAVE:FUNC {value}\r")
+        self.write(f":SOUR:WAVE:FUNC {value}\r")
 
     def get_wave_ampl(self):
         """
         Queries instrument for current wave function amplitude
         """
-        return self.instr.query(":SOUR:WAVE:AMPL?")
+        return self.query(":SOUR:WAVE:AMPL?")
 
     def set_wave_ampl(self, value=1e-6):
         """
         Sets current wave function amplitude
         """
-        self.instr.write(f":SOUR:WAVE:AMPL {value}\r")
+        self.write(f":SOUR:WAVE:AMPL {value}\r")
 
     def get_wave_freq(self):
         """
         Queries instrument for current wave function frequency
         """
-        return self.instr.query(":SOUR:WAVE:FREQ?")
+        return self.query(":SOUR:WAVE:FREQ?")
 
     def set_wave_freq(self, value=13):
         """
         Sets current wave function frequency to provided value (in Hertz)
         """
-        self.instr.write(f":SOUR:WAVE:FREQ {value}\r")
+        self.write(f":SOUR:WAVE:FREQ {value}\r")
 
     def start_output(self, tslp=2):
         """
         Enables current output
         tslp: number of seconds between arming and initiating output
         """
-        self.instr.write(":SOUR:WAVE:ARM\r")
+        self.write(":SOUR:WAVE:ARM\r")
         time.sleep(tslp)
-        self.instr.write(":SOUR:WAVE:INIT\r")
+        self.write(":SOUR:WAVE:INIT\r")
         
     def stop_output(self):
         """
-        Disables current output
+        Disables current output, of both the wave and delta modes. Sent as a
+          safety command, ahead of any queued commands
         """
-        self.instr.write(":SOUR:WAVE:ABOR\r")
+        self.write(":SOUR:WAVE:ABOR;:SOUR:SWE:ABOR\r", PRIORITY_SAFETY)
+
+    def nanovoltmeter_present(self):
+        """
+        Queries whether a 2182A nanovoltmeter is attached to the RS-232 port and
+          trigger link, as needed for delta mode
+        """
+        return self.query(":SOUR:DELT:NVPR?").strip() == "1"
+
+    def set_delta(self, high, delay=0.002, count=10):
+        """
+        Sets up delta mode, in which the output alternates between +high and
+          -high and the attached nanovoltmeter takes a reading after each
+          reversal. Each delta reading combines three reversals to cancel
+          thermoelectric offsets and their linear drift, and is stored in the
+          buffer of the current source
+
+        Parameters
+        ----------
+        high: output current of the positive half of each cycle (amps)
+        delay: delay between each reversal and its voltage reading (sec)
+        count: number of delta readings taken per measurement
+        """
+        with self.session():
+            self.write(f":SOUR:DELT:HIGH {high}\r")
+            self.write(f":SOUR:DELT:LOW {-high}\r")
+            self.write(f":SOUR:DELT:DEL {delay}\r")
+            self.write(f":SOUR:DELT:COUN {count}\r")
+            self.write(":SOUR:DELT:CAB ON\r")
+            self.write(f":TRAC:POIN {count}\r")
+            self.write(":FORM:ELEM READ\r")
+
+    def get_delta_high(self):
+        """
+        Queries instrument for the delta mode output current (amps)
+        """
+        return self.query(":SOUR:DELT:HIGH?")
+
+    def read_delta(self, count, timeout=30):
+        """
+        Runs a delta measurement, returning its readings (volts). The readings
+          are buffered on the instrument and transferred in a single query
+          once they have all been taken
+
+        Parameters
+        ----------
+        count: number of delta readings set up with set_delta
+        timeout: longest time to wait for the readings (sec)
+        """
+        with self.session():
+            self.write(":TRAC:CLE\r")
+            self.write(":SOUR:DELT:ARM\r")
+            self.write(":INIT:IMM\r")
+
+        # the instrument is only held while polling, so that a stop can be sent
+        start = time.monotonic()
+        while int(self.query(":TRAC:POIN:ACT?")) < count:
+            if time.monotonic() - start > timeout:
+                self.stop_output()
+                raise TimeoutError(f"{self.addr} took longer than {timeout} sec to take {count} delta readings")
+            time.sleep(0.05)
+
+        with self.session():
+            self.write(":SOUR:SWE:ABOR\r")
+            return self.query_values(":TRAC:DATA?")
+
+    def snapshot(self):
+        """
+        Reads the output amplitude (amps) and frequency (Hertz)
+        """
+        with self.session():
+            return {"amplitude": float(self.get_wave_ampl()),
+                    "frequency": float(self.get_wave_freq())}
+
+class SR850(Instrument):
+    snapshot_columns = {"X": "LIA X (V)",
+                        "Y": "LIA Y (V)",
+                        "R": "LIA R (V)",
+                        "T": "LIA THETA (deg)"}
+    snapshot_query = "SNAP? 1,2,3,4"
+    snapshot_keys = ("X", "Y", "R", "T")
 
-class SR850:
     def __init__(self, rm, addr):
         """
         Class that allows for interfacing with SR850 lock-in amplifier
@@ -107,9 +428,9 @@ class SR850:
         rm: VISA resource manager
         addr: address of the instrument in your GPIB network
         """
-        self.rm = rm
-        self.addr = addr
-        self.instr = self.rm.open_resource(self.addr)
+        super().__init__(rm, addr)
+
+    def initialize(self):
         self.auto_gain()
 
     def data_point(self):
@@ -122,25 +443,255 @@ class SR850:
         T: theta (phase angle)
 
         Note that X = R*COS(T), Y = R*SIN(T), and X^2 + Y^2 = R^2
+
+        All four values are taken at the same instant with a single query
+        """
+        return self.snapshot()
+
+    def auto_gain(self, timeout=60):
         """
-        return {"X": float(self.instr.query("OUTP? 1")),
-                "Y": float(self.instr.query("OUTP? 2")),
-                "R": float(self.instr.query("OUTP? 3")),
-                "T": float(self.instr.query("OUTP? 4"))}
+        Runs auto-gain function on instrument, waiting for it to finish
 
-    def auto_gain(self):
+        Parameters
+        ----------
+        timeout: longest time to wait for the auto-gain to finish (sec)
         """
-        Runs auto-gain function on instrument
+        self.write("AGAN\r")
+        self.wait_idle(timeout)
+
+    def wait_idle(self, timeout=60):
         """
-        self.instr.write("AGAN\r")
+        Waits until the instrument has no command in progress (bit 1 of the
+          serial poll status byte)
+
+        Parameters
+        ----------
+        timeout: longest time to wait (sec)
+        """
+        start = time.monotonic()
+        while not int(self.query("*STB? 1")):
+            if time.monotonic() - start > timeout:
+                raise TimeoutError(f"{self.addr} is still busy after {timeout} sec")
+            time.sleep(0.1)
+
+    def get_sensitivity(self):
+        """
+        Queries the sensitivity setting (index into SR850_SENSITIVITIES)
+        """
+        return int(self.query("SENS?"))
+
+    def set_sensitivity(self, value):
+        """
+        Sets the sensitivity setting (index into SR850_SENSITIVITIES)
+        """
+        self.write(f"SENS {value}\r")
+
+    def get_time_constant(self):
+        """
+        Queries the output time constant (sec)
+        """
+        return SR850_TIME_CONSTANTS[int(self.query("OFLT?"))]
+
+    def get_filter_slope(self):
+        """
+        Queries the low pass filter slope setting (0-3 for 6, 12, 18 and 24 dB/oct)
+        """
+        return int(self.query("OFSL?"))
+
+    def settle_time(self):
+        """
+        Time the output takes to settle after a step, from the time constant
+          and filter slope (sec)
+        """
+        with self.session():
+            return self.get_time_constant()*SR850_SETTLE_FACTORS[self.get_filter_slope()]
+
+    def overloaded(self):
+        """
+        Checks whether the input, filter or output has overloaded since the
+          last check (reading the status clears it)
+        """
+        return bool(int(self.query("LIAS?")) & 0b111)
 
     def auto_phase(self):
         """
         Runs auto-phase function on instrument
         """
-        self.instr.write("APHS\r")
+        self.write("APHS\r")
+
+class DeltaNanovoltmeter:
+    # readings are taken through the current source, so the nanovoltmeter
+    #   cannot be sampled together with other instruments
+    snapshot_query = None
+
+    def __init__(self, kth, count=10, delay=0.002, timeout=30):
+        """
+        Class that measures the voltage across a device with a Keithley 6221 in
+          delta mode and the 2182A nanovoltmeter attached to it, taking the
+          place of a lock-in. Datapoints are returned in the same form as the
+          lock-in readings, with the mean delta voltage as the in-phase (X)
+          component
+
+        Parameters
+        ----------
+        kth: Kth6221 object, with a 2182A attached to its RS-232 port and
+          trigger link
+        count: number of delta readings averaged per datapoint
+        delay: delay between each current reversal and its voltage reading (sec)
+        timeout: longest time to wait for the readings of a datapoint (sec)
+        """
+        self.kth = kth
+        self.count = count
+        self.delay = delay
+        self.timeout = timeout
+
+    def configure(self, current):
+        """
+        Sets up delta mode at the given output current, returning the output
+          current read back from the current source (amps)
+
+        Parameters
+        ----------
+        current: output current of the positive half of each cycle (amps)
+        """
+        if not self.kth.nanovoltmeter_present():
+            raise ConnectionError("No nanovoltmeter is attached to the current source")
+        self.kth.set_delta(current, self.delay, self.count)
+        return float(self.kth.get_delta_high())
+
+    def data_point(self):
+        """
+        Takes a datapoint, returning a dictionary with the mean delta voltage
+          as X (volts), its magnitude as R and its sign as the phase T (0 or
+          180 degrees). There is no quadrature component, so Y is always 0
+        """
+        readings = self.kth.read_delta(self.count, self.timeout)
+        mean = sum(readings)/len(readings)
+        return {"X": mean,
+                "Y": 0.0,
+                "R": abs(mean),
+                "T": 0.0 if mean >= 0 else 180.0}
+
+def sample_together(instruments, priority=PRIORITY_NORMAL):
+    """
+    Takes the snapshots of several instruments as close to the same instant as
+      the bus allows. Every instrument is held in a session and sent its
+      snapshot query in turn, and the responses are only read back once all
+      of the queries have been sent. Each instrument takes its reading when it
+      receives its query, so the readings are spread over the time taken to
+      send the queries, rather than over the time taken to complete each
+      query in turn
+
+    Returns a (snapshots, skew) tuple, with the snapshot of each instrument in
+      the order given and the time between the first and last query (sec)
+
+    Parameters
+    ----------
+    instruments: list of instruments that have a snapshot_query
+    priority: priority of the queries (PRIORITY_SAFETY jumps the queue)
+    """
+
+    with ExitStack() as stack:
+        for instrument in instruments:
+            stack.enter_context(instrument.session(priority))
+
+        start = time.monotonic()
+        for instrument in instruments:
+            instrument.instr.write(instrument.snapshot_query)
+        skew = time.monotonic() - start
+
+        return [instrument.read_snapshot() for instrument in instruments], skew
+
+class SR850RangeManager:
+    def __init__(self, lia, underrange=0.1, max_steps=4, on_change=None):
+        """
+        Class that keeps an SR850 on a valid sensitivity during a sweep. After
+          each datapoint the overload status is checked, and the sensitivity is
+          only changed if the point overloaded (coarser) or the signal fell
+          below a fraction of full scale (finer), in which case the point is
+          measured again once the output has settled
+
+        Parameters
+        ----------
+        lia: SR850 object
+        underrange: fraction of full scale below which the sensitivity is made finer
+        max_steps: largest number of sensitivity changes for a single datapoint
+        on_change: optional function called with the old and new sensitivity
+          settings whenever the sensitivity is changed
+        """
+        self.lia = lia
+        self.underrange = underrange
+        self.max_steps = max_steps
+        self.on_change = on_change
+        self.sensitivity = None
+        self.settle = 0.0
+
+    def refresh(self):
+        """
+        Reads the sensitivity and settle time from the instrument and clears
+          the overload status, returning the settle time (sec)
+        """
+        with self.lia.session():
+            self.sensitivity = self.lia.get_sensitivity()
+            self.settle = self.lia.settle_time()
+            self.lia.overloaded()
+        return self.settle
+
+    def _step(self, rdg):
+        """
+        Returns the sensitivity setting the reading calls for
+        """
+        if self.lia.overloaded():
+            return min(self.sensitivity + 1, len(SR850_SENSITIVITIES) - 1)
+        if (self.sensitivity > 0) and (abs(rdg["R"]) < self.underrange*SR850_SENSITIVITIES[self.sensitivity]):
+            return self.sensitivity - 1
+        return self.sensitivity
+
+    def read(self):
+        """
+        Takes a datapoint, re-ranging and measuring it again if needed
+        """
+        if self.sensitivity is None:
+            self.refresh()
+        return self.check(self.lia.data_point())
+
+    def check(self, rdg):
+        """
+        Checks a datapoint that has already been taken, re-ranging and
+          measuring it again if needed
+
+        Parameters
+        ----------
+        rdg: datapoint taken at the current sensitivity
+        """
+        if self.sensitivity is None:
+            self.refresh()
+
+        for _ in range(self.max_steps):
+            sensitivity = self._step(rdg)
+            if sensitivity == self.sensitivity:
+                break
+            self.lia.set_sensitivity(sensitivity)
+            if self.on_change is not None:
+                self.on_change(self.sensitivity, sensitivity)
+            self.sensitivity = sensitivity
+            time.sleep(self.settle)
+            # the overload latched by the switching transient is cleared, so
+            #   that only an overload of the point measured again counts
+            self.lia.overloaded()
+            rdg = self.lia.data_point()
+        return rdg
+
+class LS475(Instrument):
+    snapshot_columns = {"field": "MAGFIELD (G)",
+                        "temp": "TEMP (C)"}
+
+    # the magnetic field (Gauss) and probe temperature (Celsius) are read with
+    #   a single compound query
+    snapshot_query = "RDGFIELD?;RDGTEMP?"
+    snapshot_separator = ";"
+    snapshot_keys = ("field", "temp")
 
-class LS475:
     def __init__(self, rm, addr):
         """
         Class that allows for interfacing with Lakeshore 475 Gaussmeter
@@ -150,23 +701,31 @@ class LS475:
         rm: VISA resource manager
         addr: address of the instrument in your GPIB network
         """
-        self.rm = rm
-        self.addr = addr
-        self.instr = self.rm.open_resource(self.addr)
+        super().__init__(rm, addr)
 
     def get_field_reading(self):
         """
         Queries the instrument for the current magnetic field reading (in Gauss)
         """
-        return float(self.instr.query("RDGFIELD?"))
+        return float(self.query("RDGFIELD?"))
 
     def get_temp_reading(self):
         """
         Queries the instrument for the current temperature reading (in Celsius)
         """
-        return float(self.instr.query("RDGTEMP?"))
+        return float(self.query("RDGTEMP?"))
+
+class LS642(Instrument):
+    snapshot_columns = {"setpoint": "PSUP SP (A)",
+                        "current": "PSUP I (A)",
+                        "voltage": "PSUP V (V)"}
+
+    # the current setpoint (amps), output current (amps) and output voltage
+    #   (volts) are read with a single compound query
+    snapshot_query = "SETI?;RDGI?;RDGV?"
+    snapshot_separator = ";"
+    snapshot_keys = ("setpoint", "current", "voltage")
 
-class LS642:
     def __init__(self, rm, addr):
         """
         Class that allows for interfacing with Lakeshore 642 magnet
@@ -177,38 +736,49 @@ class LS642:
         rm: VISA resource manager
         addr: address of the instrument in your GPIB network
         """
-        self.rm = rm
-        self.addr = addr
-        self.instr = self.rm.open_resource(self.addr)
+        super().__init__(rm, addr)
 
     def get_current(self):
         """
         Queries instrument for current (amps)
         """
-        return self.instr.query("RDGI?")
+        return self.query("RDGI?")
 
     def get_setpoint(self):
         """
         Queries instrument for current setpoint (amps)
         """
-        return self.instr.query("SETI?")
+        return self.query("SETI?")
 
     def get_voltage(self):
         """
         Queries instrument for voltage (volts)
         """
-        return self.instr.query("RDGV?")
+        return self.query("RDGV?")
 
-    def set_current(self, value):
+    def set_current(self, value, priority=PRIORITY_NORMAL):
         """
         Sets instrument current output (amps)
         """
-        self.instr.write(f"SETI {value}\r")
+        self.write(f"SETI {value}\r", priority)
+
+    def zero(self):
+        """
+        Ramps the output current to zero. Sent as a safety command, ahead of
+          any queued commands
+        """
+        self.set_current(0, PRIORITY_SAFETY)
 
     def stop(self):
-        self.instr.write("STOP\r")
+        """
+        Stops the output current ramp. Sent as a safety command, ahead of any
+          queued commands
+        """
+        self.write("STOP\r", PRIORITY_SAFETY)
+
+class B1500A(Instrument):
+    snapshot_columns = {"current": "GATE I (A)"}
 
-class B1500A:
     def __init__(self, rm, addr):
         """
         Class that allows for interfacing with Agilent (Keysight) B1500A
@@ -220,11 +790,9 @@ class B1500A:
         addr: address of the instrument in your GPIB network
         """
 
-        self.rm = rm
-        self.addr = addr
-        self.instr = self.rm.open_resource(self.addr)
+        super().__init__(rm, addr)
 
-    def set_voltage(self, value, smu=3):
+    def set_voltage(self, value, smu=3, priority=PRIORITY_NORMAL):
         """
         Sets voltage of SMU to a given value
         
@@ -232,20 +800,39 @@ class B1500A:
         ----------
         value: voltage level to set SMU to
         smu: number of SMU whose voltage you are setting (default to 3 for our setup's backgate probe)
+        priority: priority of the command (PRIORITY_SAFETY jumps the queue)
         """
         
-        self.instr.write(f"DV {smu},0,{value}")
+        self.write(f"DV {smu},0,{value}", priority)
+
+    def get_current(self, smu=3):
+        """
+        Runs a high-speed spot measurement of the current through an SMU (amps),
+          e.g. to read the gate leakage current
+
+        Parameters
+        ----------
+        smu: number of SMU to measure (default to 3 for our setup's backgate probe)
+        """
+
+        with self.session():
+            self.write(f"TI {smu},0")
+            response = self.instr.read()
+
+        # strip the status/channel/data type header in front of the value
+        return float(re.sub(r"^[A-Z]+", "", response.strip()))
 
     def disconnect_smu(self, smu=3):
         """
-        Disconnects provided SMU to ensure voltage is shutoff
+        Disconnects provided SMU to ensure voltage is shutoff. Sent as a safety
+          command, ahead of any queued commands
 
         Parameters
         ----------
         smu: number of SMU to disconnect (default to 3 for our setup's backgate probe)
         """
 
-        self.instr.write(f"CL {smu}")
+        self.write(f"CL {smu}", PRIORITY_SAFETY)
 
     def connect_smu(self, smu=3):
         """
@@ -256,5 +843,92 @@ class B1500A:
         smu: number of SMU to connect (default to 3 for our setup's backgate probe)
         """
 
-        self.instr.write(f"CN {smu}")
-        
+        self.write(f"CN {smu}")
+
+    def snapshot(self):
+        """
+        Reads the backgate leakage current (amps)
+        """
+        return {"current": self.get_current()}
+
+class InstrumentPool:
+    def __init__(self, rm):
+        """
+        Class that keeps one open session per instrument, so that instruments are
+          only opened (and initialized) once rather than on every sweep
+
+        Parameters
+        ----------
+        rm: VISA resource manager
+        """
+        self.rm = rm
+        self.instruments = {}
+        self._lock = threading.Lock()
+
+    def get(self, cls, addr, on_open=None):
+        """
+        Returns a live instrument object for the given address, reusing the
+          pooled session if it still responds. A new session is only opened if
+          there is none or the pooled one has stopped responding, and is closed
+          again if the instrument fails to start up. Returns None if the
+          instrument cannot be reached. Instruments at different
+          addresses can be fetched from several threads at once
+
+        Parameters
+        ----------
+        cls: instrument class (e.g. SR850)
+        addr: address of the instrument in your GPIB network
+        on_open: optional function called with the instrument object after a
+          new session is opened, to put the instrument in a known state
+        """
+        with self._lock:
+            instrument = self.instruments.get(addr)
+        if instrument is not None:
+            if isinstance(instrument, cls) and instrument.health_check():
+                return instrument
+            self.release(addr)
+
+        try:
+            instrument = cls(self.rm, addr)
+        except Exception:
+            return None
+
+        try:
+            instrument.initialize()
+            if not instrument.health_check():
+                raise ConnectionError(f"{addr} is not responding")
+            if on_open is not None:
+                on_open(instrument)
+        except Exception:
+            try:
+                instrument.close()
+            except Exception:
+                pass
+            return None
+
+        with self._lock:
+            self.instruments[addr] = instrument
+        return instrument
+
+    def release(self, addr):
+        """
+        Closes the pooled session for the given address, if there is one
+
+        Parameters
+        ----------
+        addr: address of the instrument in your GPIB network
+        """
+        with self._lock:
+            instrument = self.instruments.pop(addr, None)
+        if instrument is not None:
+            try:
+                instrument.close()
+            except Exception:
+                pass
+
+    def close_all(self):
+        """
+        Closes every pooled session
+        """
+        for addr in list(self.instruments):
+            self.release(addr)
@@ -0,0 +1,128 @@
+import threading
+import time
+
+class ReadingCache:
+    def __init__(self):
+        """
+        Thread-safe store of the latest reading from each instrument, along with
+          the (wall clock) time at which it was taken
+        """
+        self._lock = threading.Lock()
+        self._readings = {}
+
+    def update(self, name, values, timestamp=None):
+        """
+        Stores the latest reading of an instrument
+
+        Parameters
+        ----------
+        name: name of the instrument the reading came from
+        values: dictionary of reading values
+        timestamp: time the reading was taken (defaults to now)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            self._readings[name] = (dict(values), timestamp)
+
+    def get(self, name, max_age=None):
+        """
+        Returns a (values, timestamp) tuple with the latest reading of an
+          instrument, or (None, None) if there is no reading (or it is older
+          than max_age)
+
+        Parameters
+        ----------
+        name: name of the instrument
+        max_age: optional maximum age of the reading (sec)
+        """
+        with self._lock:
+            reading = self._readings.get(name)
+
+        if reading is None:
+            return None, None
+
+        values, timestamp = reading
+        if (max_age is not None) and (time.time() - timestamp > max_age):
+            return None, None
+
+        return dict(values), timestamp
+
+class LivePoller:
+    def __init__(self, cache, sources, interval=1):
+        """
+        Class that polls instruments on a background thread between sweeps and
+          publishes their readings to a ReadingCache, so that the GUI never has
+          to touch the bus itself. While a sweep is running the poller is
+          paused and the sweep publishes its own readings to the cache instead
+
+        Parameters
+        ----------
+        cache: ReadingCache to publish readings to
+        sources: dictionary mapping instrument names to functions that return a
+          dictionary of reading values (or None if the instrument is not connected)
+        interval: time between polls (sec)
+        """
+        self.cache = cache
+        self.sources = sources
+        self.interval = interval
+
+        self._busy = threading.Lock()
+        self._paused = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts polling on a background thread
+        """
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops polling, waiting for any poll in progress to finish
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pause(self):
+        """
+        Pauses polling, waiting for any poll in progress to finish so the caller
+          has the instruments to itself on return
+        """
+        self._paused.set()
+        with self._busy:
+            pass
+
+    def resume(self):
+        """
+        Resumes polling after a pause
+        """
+        self._paused.clear()
+
+    def poll(self):
+        """
+        Reads every source once and publishes the readings to the cache
+        """
+        with self._busy:
+            for name, read in self.sources.items():
+                if self._paused.is_set() or self._stopped.is_set():
+                    return
+                try:
+                    values = read()
+                except Exception as e:
+                    print(f"Live readout of {name} failed: {e}")
+                    continue
+                if values is not None:
+                    self.cache.update(name, values)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if not self._paused.is_set():
+                self.poll()
+            self._stopped.wait(self.interval)
@@ -0,0 +1,260 @@
+import random
+
+from .config import COLORS, MAX_PLOT_RUNS, PLOT_DOWNSAMPLING, PLOT_HISTORY_POINTS
+
+# plot markers used to tell the detectors apart
+DETECTOR_MARKERS = ["o", "s", "^", "v", "D", "P", "X", "*"]
+
+def lttb_indices(x, y, n_out):
+    """
+    Picks the points of a curve to keep when downsampling it with the
+      largest-triangle-three-buckets algorithm, which keeps the visual shape
+      of the curve (including the switching edges of a spin valve)
+
+    Returns the indices of the points to keep, always including the first and
+      last point
+
+    Parameters
+    ----------
+    x: x values of the curve
+    y: y values of the curve
+    n_out: number of points to keep (at least 3)
+    """
+
+    # numpy is imported on first use to keep the GUI startup fast
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if (n_out >= n) or (n_out < 3):
+        return np.arange(n)
+
+    # the points between the first and last are split into n_out-2 buckets,
+    #   and from each the point making the largest triangle with the point
+    #   kept from the previous bucket and the mean of the next one is kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = [0]
+    for b in range(n_out - 2):
+        start, end = edges[b], edges[b+1]
+        if b + 2 < len(edges):
+            next_x = x[end:edges[b+2]].mean()
+            next_y = y[end:edges[b+2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        prev = indices[-1]
+        area = np.abs((x[prev] - next_x)*(y[start:end] - y[prev]) - (x[prev] - x[start:end])*(next_y - y[prev]))
+        indices.append(start + int(np.nanargmax(area)) if np.isfinite(area).any() else start)
+    indices.append(n - 1)
+
+    return np.array(indices)
+
+def minmax_indices(y, n_out):
+    """
+    Picks the points of a curve to keep when downsampling it by keeping the
+      minimum and maximum of each bucket of points, which never hides a
+      spike in a noisy trace
+
+    Returns the indices of the points to keep, in their original order
+
+    Parameters
+    ----------
+    y: y values of the curve
+    n_out: number of points to keep (two per bucket)
+    """
+
+    import numpy as np
+
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if (n_out >= n) or (n_out < 2):
+        return np.arange(n)
+
+    indices = set()
+    for bucket in np.array_split(np.arange(n), n_out//2):
+        values = y[bucket]
+        if np.isfinite(values).any():
+            indices.update((bucket[np.nanargmin(values)], bucket[np.nanargmax(values)]))
+        else:
+            indices.add(bucket[0])
+
+    return np.array(sorted(indices))
+
+def downsample(x, y, n_out, method="lttb"):
+    """
+    Downsamples a curve to about n_out points
+
+    Returns the downsampled (x, y) arrays
+
+    Parameters
+    ----------
+    x: x values of the curve
+    y: y values of the curve
+    n_out: number of points to keep
+    method: "lttb" (largest-triangle-three-buckets) or "minmax"
+    """
+
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    if method == "lttb":
+        indices = lttb_indices(x, y, n_out)
+    elif method == "minmax":
+        indices = minmax_indices(y, n_out)
+    else:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+
+    return x[indices], y[indices]
+
+class PlotHistory:
+    def __init__(self, max_runs, points, method="lttb"):
+        """
+        Class that keeps the lines of past runs on a plot at a reduced
+          resolution, so that the time taken to redraw the plot does not grow
+          over a long session. The lines of the active run are kept at full
+          resolution, the lines of a run are downsampled once the next run
+          starts, and the lines of the oldest runs are removed once more than
+          max_runs runs are shown
+
+        Parameters
+        ----------
+        max_runs: number of runs (including the active one) to show
+        points: number of points to keep of each line of a past run
+        method: "lttb" or "minmax" downsampling (see downsample)
+        """
+        self.max_runs = max_runs
+        self.points = points
+        self.method = method
+        self.runs = []
+
+    def add_run(self, lines):
+        """
+        Registers the lines of a new active run, downsampling the lines of the
+          previous run and removing those of the oldest runs beyond max_runs.
+          A line may belong to several runs (e.g. an averaged curve that keeps
+          growing), and is only removed once no remaining run holds it
+
+        Parameters
+        ----------
+        lines: list of matplotlib Line2D objects drawn for the run
+        """
+        if self.runs:
+            for line in self.runs[-1]:
+                x, y = line.get_data()
+                if len(x) > self.points:
+                    line.set_data(*downsample(x, y, self.points, self.method))
+
+        self.runs.append(list(lines))
+
+        while len(self.runs) > self.max_runs:
+            oldest = self.runs.pop(0)
+            kept = {id(line) for run in self.runs for line in run}
+            for line in oldest:
+                if id(line) not in kept:
+                    line.remove()
+                    kept.add(id(line))
+
+    def clear(self):
+        """
+        Forgets every run, after the axes they were drawn on have been cleared
+        """
+        self.runs = []
+
+class SweepPlots:
+    def __init__(self, axes, canvases):
+        """
+        Class that draws the live plots of a field sweep as the sweep engine
+          measures it, with one plot per leg. Every test matrix entry gets
+          new lines (one per detector) in a random color. From the second
+          repeat of an entry on, its averaged curve is drawn in black. The
+          lines of past entries are downsampled (see PlotHistory). The plot
+          of a leg is redrawn after each of its datapoints, on the thread
+          that reports the datapoint
+
+        Parameters
+        ----------
+        axes: dictionary mapping each leg to the matplotlib Axes of its plot
+        canvases: dictionary mapping each leg to the canvas of its figure
+        """
+        self.axes = axes
+        self.canvases = canvases
+        self.histories = {leg: PlotHistory(MAX_PLOT_RUNS, PLOT_HISTORY_POINTS, PLOT_DOWNSAMPLING) for leg in axes}
+        self.lines = {leg: {} for leg in axes}
+        self.avg_lines = {}
+        self.entry_avg_lines = {}
+
+    def reset(self, xlabel):
+        """
+        Clears the plots before a new sweep
+
+        Parameters
+        ----------
+        xlabel: label of the x axis of the plots
+        """
+        for ax in self.axes.values():
+            ax.cla()
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel("R_NL (Ohm)")
+        self.lines = {leg: {} for leg in self.axes}
+        self.avg_lines = {}
+        self.entry_avg_lines = {}
+        for history in self.histories.values():
+            history.clear()
+
+    def start_entry(self, engine, entry):
+        """
+        Sets up the lines of a test matrix entry the engine is starting
+
+        Parameters
+        ----------
+        engine: SweepEngine running the sweep
+        entry: test matrix entry
+        """
+        plot_color = random.choice(COLORS)
+        label = f"Frequency={entry['frequency']:g} Hz, Current={entry['current']:g} uA, BGV={entry['bgv']:g} V"
+
+        for leg, ax in self.axes.items():
+            data = engine.data[leg]
+            self.lines[leg] = {}
+            for column, detector, marker in zip(engine.rnl_columns, engine.detectors, DETECTOR_MARKERS):
+                line_label = f"{detector}, {label}" if len(engine.detectors) > 1 else label
+                self.lines[leg][column], = ax.plot(data["MAGFIELD (G)"], data[column], color=plot_color, marker=marker,
+                                                   markersize=3, label=line_label)
+
+        # averaged curve, drawn from the second repeat of an entry on
+        key = engine.repeat_key(entry)
+        if engine.repeats.get(key) and (key not in self.avg_lines):
+            self.avg_lines[key] = {leg: ax.plot([], [], color="black", linewidth=2, label=f"Average, {label}")[0]
+                                   for leg, ax in self.axes.items()}
+        self.entry_avg_lines = self.avg_lines.get(key, {})
+
+        for leg, history in self.histories.items():
+            history.add_run(list(self.lines[leg].values()) + [line for line_leg, line in self.entry_avg_lines.items()
+                                                              if line_leg == leg])
+
+    def point(self, engine, leg):
+        """
+        Redraws the plot of a leg after one of its datapoints
+
+        Parameters
+        ----------
+        engine: SweepEngine running the sweep
+        leg: "forward" or "reverse"
+        """
+        data = engine.data[leg]
+        ax = self.axes[leg]
+
+        for column, line in self.lines[leg].items():
+            line.set_data(data["MAGFIELD (G)"], data[column])
+
+        stats = engine.entry_stats
+        if (stats is not None) and (leg in self.entry_avg_lines):
+            field, r_nl, _ = stats.curve(leg)
+            self.entry_avg_lines[leg].set_data(field, r_nl)
+        ax.relim()
+        ax.autoscale_view()
+        self.canvases[leg].draw()
+        self.canvases[leg].flush_events()
@@ -0,0 +1,504 @@
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from .config import ARM_DELAY, RAMP_WAIT
+from .engine import DATA_COLUMNS, LEGS, SweepEngine, detector_column
+from .plotting import SweepPlots
+from .stream import StreamServer
+from .utils import sweep_profile
+
+# readings served by the replay instruments, and the column each is read from
+PSUP_COLUMNS = {"setpoint": "PSUP SP (A)", "current": "PSUP I (A)", "voltage": "PSUP V (V)"}
+GMETER_COLUMNS = {"field": "MAGFIELD (G)", "temp": "TEMP (C)"}
+LIA_KEYS = {"X": "LIA X (V)", "Y": "LIA Y (V)", "R": "LIA R (V)", "T": "LIA THETA (deg)"}
+
+def load_recording(path):
+    """
+    Loads a recorded entry from its *_forward.csv file and the *_reverse.csv
+      file saved alongside it (if there is one)
+
+    Returns a dictionary mapping each leg to a list of rows, each a dictionary
+      of column name to value, with the datapoint timestamps in seconds
+
+    Parameters
+    ----------
+    path: path of the *_forward.csv file
+    """
+
+    import pandas as pd
+
+    if not path.endswith("_forward.csv"):
+        raise ValueError(f"'{path}' is not a *_forward.csv file")
+
+    recording = {}
+    for leg in LEGS:
+        leg_path = path[:-len("_forward.csv")] + f"_{leg}.csv"
+        if (leg == "reverse") and not os.path.isfile(leg_path):
+            recording[leg] = []
+            continue
+        frame = pd.read_csv(leg_path)
+        frame["DATETIME"] = pd.to_datetime(frame["DATETIME"]).astype("int64")/1e9
+        recording[leg] = frame.to_dict("records")
+    return recording
+
+def synthetic_recording(points=200, current=10e-6, spin_signal=0.05, noise=0.002, interval=1.0, seed=None):
+    """
+    Builds a recording of a spin valve sweep, for replaying without any
+      archived data. The non-local resistance steps down by the spin signal
+      while the electrodes are antiparallel, between 50 and 150 G (-50 and
+      -150 G on the reverse leg)
+
+    Returns the recording in the form returned by load_recording
+
+    Parameters
+    ----------
+    points: number of datapoints per leg
+    current: injection current amplitude (amps)
+    spin_signal: change in non-local resistance between the P and AP states (ohms)
+    noise: standard deviation of the non-local resistance noise (ohms)
+    interval: time between datapoints (sec)
+    seed: optional seed of the noise
+    """
+
+    rng = np.random.default_rng(seed)
+    step = 2*2.5/(points - 1)
+    forward, reverse = sweep_profile(-2.5, 2.5, step)
+    start = time.time()
+
+    recording = {}
+    for leg, setpoints in zip(LEGS, (forward, reverse)):
+        sign = 1 if leg == "forward" else -1
+        rows = []
+        for n, setpoint in enumerate(setpoints):
+            field = 100*setpoint
+            antiparallel = 50 < sign*field < 150
+            r_nl = 1.0 - (spin_signal if antiparallel else 0.0) + rng.normal(0, noise)
+            row = dict.fromkeys(DATA_COLUMNS, 0.0)
+            row.update({"DATETIME": start + n*interval,
+                        "PSUP SP (A)": setpoint,
+                        "PSUP I (A)": setpoint,
+                        "PSUP V (V)": 0.1*setpoint,
+                        "MAGFIELD (G)": field,
+                        "TEMP (C)": 20.0,
+                        "LIA X (V)": r_nl*current,
+                        "LIA R (V)": abs(r_nl*current),
+                        "KTH OUTPUT (A)": current,
+                        "KTH FREQ (HZ)": 13.0,
+                        "R_NL (ohm)": r_nl})
+            rows.append(row)
+        recording[leg] = rows
+    return recording
+
+def recording_detectors(recording):
+    """
+    Returns the names of the detectors of a recording, from its R_NL columns
+    """
+
+    columns = recording["forward"][0]
+    if "R_NL (ohm)" in columns:
+        return ["LIA"]
+    return [column[len("R_NL (ohm) ["):-1] for column in columns if column.startswith("R_NL (ohm) [")]
+
+def point_interval(recording):
+    """
+    Returns the mean time between the datapoints of the forward leg of a
+      recording (sec)
+    """
+
+    times = [row["DATETIME"] for row in recording["forward"]]
+    if len(times) < 2:
+        return 0.0
+    return max(times[-1] - times[0], 0.0)/(len(times) - 1)
+
+class ReplayCursor:
+    def __init__(self, recording):
+        """
+        Class that steps through the datapoints of a recording as they are
+          measured, so that the replay instruments all answer with the readings
+          of the same datapoint. The legs are replayed in order, and from the
+          start again for every test matrix entry
+
+        Parameters
+        ----------
+        recording: dictionary mapping each leg to a list of rows
+        """
+        self.rows = [row for leg in LEGS for row in recording[leg]]
+        self.index = -1
+
+    def advance(self):
+        """
+        Moves on to the next datapoint, returning its row
+        """
+        self.index = (self.index + 1) % len(self.rows)
+        return self.rows[self.index]
+
+    @property
+    def row(self):
+        return self.rows[max(self.index, 0)]
+
+class ReplayInstrument:
+    # replay instruments are read one by one, never sampled together
+    snapshot_query = None
+    snapshot_columns = {}
+
+    def __init__(self, cursor):
+        """
+        Base class of the instruments that stand in for the real ones while a
+          recording is replayed. Commands are accepted and ignored, and
+          readings are answered from the datapoint the cursor is on
+
+        Parameters
+        ----------
+        cursor: ReplayCursor shared by the replay instruments
+        """
+        self.cursor = cursor
+
+    def session(self, priority=0):
+        return nullcontext()
+
+class ReplayMagnetSupply(ReplayInstrument):
+    def set_current(self, value, priority=0):
+        pass
+
+    def snapshot(self):
+        # the power supply is read first at every datapoint
+        row = self.cursor.advance()
+        return {key: row[column] for key, column in PSUP_COLUMNS.items()}
+
+class ReplayGaussmeter(ReplayInstrument):
+    def snapshot(self):
+        row = self.cursor.row
+        return {key: row[column] for key, column in GMETER_COLUMNS.items()}
+
+class ReplayCurrentSource(ReplayInstrument):
+    def set_wave_ampl(self, value):
+        pass
+
+    def set_wave_freq(self, value):
+        pass
+
+    def get_wave_ampl(self):
+        return str(self.cursor.rows[0]["KTH OUTPUT (A)"])
+
+    def start_output(self, tslp=2):
+        pass
+
+    def stop_output(self):
+        pass
+
+class ReplayParameterAnalyzer(ReplayInstrument):
+    def set_voltage(self, value, smu=3, priority=0):
+        pass
+
+    def get_current(self, smu=3):
+        return 0.0
+
+    def connect_smu(self, smu=3):
+        pass
+
+    def disconnect_smu(self, smu=3):
+        pass
+
+class ReplayLockIn(ReplayInstrument):
+    def __init__(self, cursor, detector, detectors):
+        """
+        Replay lock-in, answering with the readings of one detector of the
+          recording. It reports the finest sensitivity and never overloads,
+          so lock-in ranging leaves it alone
+
+        Parameters
+        ----------
+        cursor: ReplayCursor shared by the replay instruments
+        detector: name of the detector
+        detectors: names of every detector of the recording
+        """
+        super().__init__(cursor)
+        self.columns = {key: detector_column(column, detector, detectors) for key, column in LIA_KEYS.items()}
+
+    def data_point(self):
+        row = self.cursor.row
+        return {key: row[column] for key, column in self.columns.items()}
+
+    def get_sensitivity(self):
+        return 0
+
+    def set_sensitivity(self, value):
+        pass
+
+    def settle_time(self):
+        return 0.0
+
+    def overloaded(self):
+        return False
+
+def replay_instruments(recording):
+    """
+    Returns replay instruments serving a recording, in the form taken by the
+      sweep engines
+
+    Parameters
+    ----------
+    recording: dictionary mapping each leg to a list of rows
+    """
+
+    cursor = ReplayCursor(recording)
+    detectors = recording_detectors(recording)
+    return {"kth": ReplayCurrentSource(cursor),
+            "mag_psup": ReplayMagnetSupply(cursor),
+            "gmeter": ReplayGaussmeter(cursor),
+            "spa": ReplayParameterAnalyzer(cursor),
+            "lia": {detector: ReplayLockIn(cursor, detector, detectors) for detector in detectors}}
+
+def replay_plots():
+    """
+    Returns SweepPlots drawing the sweep plots of the GUI off screen, on
+      figures of the same size
+    """
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    axes = {}
+    canvases = {}
+    for leg in LEGS:
+        figure = Figure(figsize=(7,2), dpi=100)
+        axes[leg] = figure.add_subplot(1,1,1)
+        canvases[leg] = FigureCanvasAgg(figure)
+    plots = SweepPlots(axes, canvases)
+    plots.reset("Mag. Field (G)")
+    return plots
+
+class StreamViewer:
+    def __init__(self, port, delay=0.0):
+        """
+        Class that follows the live stream of a run like a remote viewer, on
+          its own thread, optionally taking a while over every message to act
+          as a slow viewer
+
+        Parameters
+        ----------
+        port: port of the stream server on this host
+        delay: time spent on every message received (sec)
+        """
+        self.port = port
+        self.delay = delay
+        self.messages = 0
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        self._sock = socket.create_connection(("127.0.0.1", self.port))
+        self._sock.sendall(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._thread.join()
+
+    def _run(self):
+        buffer = b""
+        try:
+            while True:
+                chunk = self._sock.recv(65536)
+                if not chunk:
+                    return
+                buffer += chunk
+                messages = buffer.split(b"\n\n")
+                buffer = messages.pop()
+                for message in messages:
+                    if message.startswith(b"event:"):
+                        self.messages += 1
+                        if self.delay:
+                            time.sleep(self.delay)
+        except OSError:
+            pass
+
+def max_sustained_rate(times, window):
+    """
+    Returns the highest number of datapoints per second over any window of the
+      given length, or the overall rate if the run is shorter than the window
+
+    Parameters
+    ----------
+    times: monotonic times at which the datapoints were completed (sec)
+    window: length of the window (sec)
+    """
+
+    times = np.asarray(times)
+    if len(times) < 2:
+        return 0.0
+    if times[-1] - times[0] <= window:
+        return (len(times) - 1)/(times[-1] - times[0])
+    counts = np.searchsorted(times, times + window, side="right") - np.arange(len(times))
+    valid = times + window <= times[-1]
+    return float(counts[valid].max())/window
+
+def replay(recording, folder, speedup=0.0, entries=1, plot=True, viewers=1, viewer_delay=0.0, window=5.0):
+    """
+    Replays a recording through the sweep engine, as if it were being measured,
+      and reports how well the stages after the instruments keep up. The
+      engine records every datapoint (checkpointing it to the save folder)
+      and averages the repeats of each entry as in a real run. The run is
+      streamed to local viewers. The sweep plots are drawn off screen by the
+      plotting code of the GUI, after every datapoint and on the engine
+      thread as in the GUI, so their draw time slows the replay down as it
+      would a real run
+
+    Returns a dictionary describing the replay
+
+    Parameters
+    ----------
+    recording: dictionary mapping each leg to a list of rows (see
+      load_recording and synthetic_recording)
+    folder: folder the engine saves the replayed data to
+    speedup: factor by which the recording is sped up, or 0 to replay it as
+      fast as possible
+    entries: number of times to replay the recording, as repeats of a single
+      test matrix entry
+    plot: whether to draw the sweep plots
+    viewers: number of stream viewers
+    viewer_delay: time each viewer spends on every message (sec)
+    window: length of the window the highest sustained rate is found over (sec)
+    """
+
+    interval = point_interval(recording)
+    scale = 1/speedup if speedup > 0 else 0.0
+    first = recording["forward"][0]
+    entry = {"frequency": float(first["KTH FREQ (HZ)"]),
+             "current": float(first["KTH OUTPUT (A)"])*1e6,
+             "bgv": float(first.get("BGV (V)", 0.0))}
+    settings = {"folder": folder, "row": "replay", "col": "0", "notes": "Replayed run", "electrodes": {},
+                "forward": [row["PSUP SP (A)"] for row in recording["forward"]],
+                "reverse": [row["PSUP SP (A)"] for row in recording["reverse"]],
+                "delay": interval*scale,
+                "ramp_wait": RAMP_WAIT*scale,
+                "arm_delay": ARM_DELAY*scale,
+                "test_matrix": [entry]*entries}
+
+    stream = StreamServer()
+    stream.start()
+    viewer_list = [StreamViewer(stream.port, viewer_delay) for _ in range(viewers)]
+    for viewer in viewer_list:
+        viewer.start()
+
+    times = []
+    plots = replay_plots() if plot else None
+    draw_times = []
+
+    def on_entry(entry_index, entry):
+        if plots is not None:
+            plots.start_entry(engine, entry)
+
+    def on_point(leg, points_done, duration):
+        times.append(time.monotonic())
+        if plots is not None:
+            start = time.monotonic()
+            plots.point(engine, leg)
+            draw_times.append(time.monotonic() - start)
+
+    engine = SweepEngine(replay_instruments(recording), settings, on_entry=on_entry, on_point=on_point, stream=stream)
+
+    # the stream queue depths are sampled while the replay runs
+    depths = {"stream": 0}
+    running = threading.Event()
+    running.set()
+
+    def sample_depths():
+        while running.is_set():
+            depths["stream"] = max([depths["stream"]] + stream.queue_depths())
+            time.sleep(0.01)
+
+    sampler = threading.Thread(target=sample_depths, daemon=True)
+    sampler.start()
+
+    start = time.monotonic()
+    completed = engine.run()
+    elapsed = time.monotonic() - start
+
+    running.clear()
+    sampler.join()
+    # the viewers are given a moment to catch up before the stream is closed
+    time.sleep(0.5)
+    for viewer in viewer_list:
+        viewer.stop()
+    stream.stop()
+
+    n_points = len(times)
+    report = {"completed": completed,
+              "points": n_points,
+              "elapsed": elapsed,
+              "target_rate": (speedup/interval if interval > 0 else float("inf")) if speedup > 0 else None,
+              "mean_rate": n_points/elapsed if elapsed > 0 else 0.0,
+              "max_sustained_rate": max_sustained_rate(times, window),
+              "acquire_time": engine.timing["acquire"].mean,
+              "record_time": engine.timing["record"].mean,
+              "stream_published": stream.published,
+              "stream_dropped": stream.dropped,
+              "stream_max_depth": depths["stream"],
+              "viewer_messages": [viewer.messages for viewer in viewer_list]}
+    if plots is not None:
+        report.update({"draw_time": float(np.mean(draw_times)) if draw_times else 0.0,
+                       "max_draw_time": max(draw_times, default=0.0)})
+    return report
+
+def format_report(report):
+    """
+    Returns a text summary of a replay report
+    """
+
+    lines = [f"Replayed {report['points']} points in {report['elapsed']:.2f} s"
+             + ("" if report["completed"] else " (run did not complete)")]
+    if report["target_rate"] is not None:
+        lines.append(f"  Target rate:          {report['target_rate']:10.1f} points/s")
+    lines.append(f"  Mean rate:            {report['mean_rate']:10.1f} points/s")
+    lines.append(f"  Max sustained rate:   {report['max_sustained_rate']:10.1f} points/s")
+    lines.append(f"  Record time:          {1e3*report['record_time']:10.2f} ms/point (saving and checkpointing)")
+    lines.append(f"  Acquire time:         {1e3*report['acquire_time']:10.2f} ms/point (replay instruments)")
+    lines.append(f"  Stream published:     {report['stream_published']:10d} messages")
+    lines.append(f"  Stream dropped:       {report['stream_dropped']:10d} messages")
+    lines.append(f"  Stream queue depth:   {report['stream_max_depth']:10d} messages at most")
+    lines.append(f"  Viewer messages:      {', '.join(str(n) for n in report['viewer_messages']) or '-'} received")
+    if "draw_time" in report:
+        lines.append(f"  Draw time:            {1e3*report['draw_time']:10.2f} ms/point mean, "
+                     f"{1e3*report['max_draw_time']:.2f} ms max")
+        if report["draw_time"] > 0:
+            lines.append(f"  Plot-bound rate:      {1/report['draw_time']:10.1f} points/s at most")
+    return "\n".join(lines)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded (or synthetic) sweep through the sweep engine, "
+                                                 "live plots and stream faster than real time, to load-test them")
+    parser.add_argument("recording", nargs="?", help="*_forward.csv file of a recorded entry, a synthetic sweep is "
+                                                     "replayed if none is given")
+    parser.add_argument("--points", type=int, default=200, help="datapoints per leg of the synthetic sweep")
+    parser.add_argument("--speedup", type=float, default=0.0, help="speed-up of the replay (0 for as fast as possible)")
+    parser.add_argument("--entries", type=int, default=1, help="number of times to replay the recording")
+    parser.add_argument("--no-plot", action="store_true", help="do not draw the sweep plots")
+    parser.add_argument("--viewers", type=int, default=1, help="number of stream viewers")
+    parser.add_argument("--viewer-delay", type=float, default=0.0, help="time each viewer spends per message (sec)")
+    parser.add_argument("--window", type=float, default=5.0, help="window of the max sustained rate (sec)")
+    parser.add_argument("--folder", help="folder to save the replayed data to (a temporary folder by default)")
+    args = parser.parse_args(args)
+
+    recording = load_recording(args.recording) if args.recording else synthetic_recording(args.points)
+    folder = args.folder or tempfile.mkdtemp(prefix="magsweep_replay_")
+    print(f"Saving the replayed data to {folder}")
+
+    report = replay(recording, folder, args.speedup, args.entries, not args.no_plot,
+                    args.viewers, args.viewer_delay, args.window)
+    print(format_report(report))
+
+if __name__ == "__main__":
+    main()
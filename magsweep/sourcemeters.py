@@ -0,0 +1,47 @@
+from .instruments import Instrument
+
+class Kth2400(Instrument):
+    snapshot_columns = {"voltage": "K2400 V (V)",
+                        "current": "K2400 I (A)"}
+
+    def __init__(self, rm, addr):
+        """
+        Class that allows for interfacing with Keithley 2400 source meter
+
+        Parameters
+        ----------
+        rm: VISA resource manager
+        addr: address of the instrument in your GPIB network
+        """
+        super().__init__(rm, addr)
+
+    def get_output(self):
+        """
+        Queries whether the output is on
+        """
+        return self.query(":OUTP?").strip() == "1"
+
+    def set_voltage(self, value):
+        """
+        Sources a DC voltage (volts)
+        """
+        self.write(f":SOUR:FUNC VOLT;:SOUR:VOLT:LEV {value}")
+
+    def get_reading(self):
+        """
+        Triggers a measurement, returning the measured voltage (volts) and
+          current (amps). The output must be on
+        """
+        values = self.query(":READ?").split(",")
+        return {"voltage": float(values[0]),
+                "current": float(values[1])}
+
+    def snapshot(self):
+        """
+        Reads the measured voltage (volts) and current (amps), or NaN while the
+          output is off
+        """
+        with self.session():
+            if not self.get_output():
+                return {"voltage": float("nan"), "current": float("nan")}
+            return self.get_reading()
@@ -0,0 +1,508 @@
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import queue
+import signal
+import time
+
+from .checkpoint import Checkpoint
+from .config import BGV_LIMIT, CURRENT_LIMIT, DELTA_COUNT, FREQ_LIMIT, STATION_HANG_TIMEOUT, TEMP_LIMIT
+from .drivers import REQUIRED_ROLES, ROLE_SETUP, detector_specs, engine_instruments, instrument_roles, registry
+from .estimate import format_duration
+from .utils import compile_sweep_spec, sweep_profile
+
+def connect_instruments(config, pool):
+    """
+    Connects the instruments of a station and returns them in the form taken
+      by the sweep engines
+
+    Parameters
+    ----------
+    config: contents of the config.json of the station
+    pool: InstrumentPool to open the instruments in
+    """
+
+    roles = instrument_roles(config)
+    instruments = {}
+    for role, spec in roles.items():
+        instruments[role] = pool.get(registry.load(spec["driver"]), spec["addr"], ROLE_SETUP.get(role))
+
+    lias = {detector: pool.get(registry.load(spec["driver"]), spec["addr"])
+            for detector, spec in detector_specs(config).items()}
+
+    missing = [role for role in REQUIRED_ROLES if instruments[role] is None]
+    missing += [f"lock-in {detector}" for detector, lia in lias.items() if lia is None]
+    if missing:
+        raise ConnectionError(f"Could not connect to {', '.join(missing)}")
+
+    return engine_instruments(instruments, lias, roles)
+
+def shutdown_outputs(instruments):
+    """
+    Zeroes the magnet, stops the current source and turns off the backgate of a
+      station, as safety commands. Every output is shut down even if another
+      one fails to
+
+    Parameters
+    ----------
+    instruments: instruments of the station, as returned by connect_instruments
+    """
+
+    from .instruments import PRIORITY_SAFETY
+
+    steps = [instruments["mag_psup"].zero,
+             instruments["kth"].stop_output,
+             lambda: instruments["spa"].set_voltage(0, priority=PRIORITY_SAFETY),
+             instruments["spa"].disconnect_smu]
+    for step in steps:
+        try:
+            step()
+        except Exception as e:
+            print(e)
+
+def job_settings(job):
+    """
+    Builds the run settings of a sweep engine from a job of a station plan. The
+      job holds the same fields as the GUI...
+        folder, row, col: save folder and device row and column
+        frequency, current, bgv: sweep entries (e.g. "13.7", "1uA, 5uA")
+        temperatures: optional sweep entry of temperatures (K)
+        runs_per: number of runs with each set of parameters (default 1)
+        sweep: [lower limit, upper limit, step] of the magnet current (amps)
+        both_ways: whether to sweep back down (default true)
+        delay: delay between datapoints (sec)
+        notes, electrodes, target_uncertainty, field_read_every, synchronized,
+          detection, delta_count: optional
+      A job may instead give the "forward", "reverse" and "test_matrix" of the
+      engine settings directly
+
+    Parameters
+    ----------
+    job: dictionary describing the job
+    """
+
+    settings = {"folder": job["folder"],
+                "row": str(job.get("row", "")),
+                "col": str(job.get("col", "")),
+                "notes": job.get("notes", ""),
+                "electrodes": job.get("electrodes", {}),
+                "delay": float(job.get("delay", 0.5)),
+                "target_uncertainty": job.get("target_uncertainty"),
+                "field_read_every": int(job.get("field_read_every", 1)),
+                "synchronized": bool(job.get("synchronized", False)),
+                "detection": job.get("detection", "lockin"),
+                "delta_count": int(job.get("delta_count", DELTA_COUNT))}
+
+    if "forward" in job:
+        settings["forward"] = job["forward"]
+        settings["reverse"] = job.get("reverse", [])
+    else:
+        lower, upper, step = job["sweep"]
+        settings["forward"], settings["reverse"] = sweep_profile(lower, upper, step, job.get("both_ways", True))
+    if not settings["forward"]:
+        raise ValueError(f"Invalid sweep for {job['folder']}")
+
+    if "test_matrix" in job:
+        settings["test_matrix"] = job["test_matrix"]
+    else:
+        freqs = compile_sweep_spec(str(job["frequency"]), "Hz", (0, FREQ_LIMIT)).tolist()
+        currents = compile_sweep_spec(str(job["current"]), "uA", (-CURRENT_LIMIT/1e-6, CURRENT_LIMIT/1e-6)).tolist()
+        bgvs = compile_sweep_spec(str(job.get("bgv", "0")), "V", (-BGV_LIMIT, BGV_LIMIT)).tolist()
+        test_matrix = [{"frequency": f, "current": c, "bgv": b}
+                       for f, c, b in itertools.product(freqs, currents, bgvs)
+                       for _ in range(int(job.get("runs_per", 1)))]
+        if job.get("temperatures"):
+            temperatures = compile_sweep_spec(str(job["temperatures"]), "K", (0, TEMP_LIMIT)).tolist()
+            test_matrix = [dict(entry, temperature=t) for t in temperatures for entry in test_matrix]
+        settings["test_matrix"] = test_matrix
+
+    return settings
+
+def _run_job(name, job, pool, config, messages, stop_event):
+    """
+    Runs a single job on a station worker, reporting its status and progress
+      to the supervisor
+    """
+
+    from .engine import SweepEngine, TemperatureSweepEngine
+
+    def send(kind, **fields):
+        messages.put(dict(fields, type=kind, station=name, job_id=job["job_id"], t=time.time()))
+
+    engine = None
+    instruments = None
+
+    # the stop is checked on every status as well as every datapoint, as long
+    #   phases such as a temperature settling report their status only
+    def on_status(text, color):
+        if stop_event.is_set() and (engine is not None):
+            engine.stop()
+        send("status", text=text, color=color)
+
+    def on_point(leg, points_done, duration):
+        if stop_event.is_set():
+            engine.stop()
+        remaining = engine.estimator.remaining(engine.entry_index, engine.legs.index(leg), points_done)
+        send("progress", entry_index=engine.entry_index, n_entries=engine.n_entries, leg=leg,
+             points_done=points_done, leg_length=engine.leg_length(leg), remaining=remaining)
+
+    try:
+        settings = job["settings"]
+        instruments = connect_instruments(config, pool)
+        if "temperature" in settings["test_matrix"][0]:
+            if instruments["temp"] is None:
+                raise ValueError("a temperature series needs a \"temp\" temperature controller role")
+            engine_cls = TemperatureSweepEngine
+        else:
+            engine_cls = SweepEngine
+
+        resume = None
+        if job.get("resume"):
+            resume = Checkpoint(settings["folder"]).load()
+            if resume is not None:
+                settings = resume["settings"]
+
+        engine = engine_cls(instruments, settings, on_status=on_status, on_point=on_point)
+        completed = engine.run(resume)
+    except Exception as e:
+        completed = False
+        error = str(e)
+    else:
+        error = None
+
+    # the outputs are shut down here rather than left to the engine, which
+    #   does not on every failure, since the supervisor ends workers that are
+    #   slow to stop
+    if (instruments is not None) and not completed:
+        shutdown_outputs(instruments)
+
+    if error is None:
+        send("done", completed=completed)
+    else:
+        send("done", completed=False, error=error)
+
+def station_worker(name, config, jobs, messages, stop_event):
+    """
+    Runs the jobs of a station in a worker process, with the station's own
+      VISA resource manager, until it is sent None
+
+    Parameters
+    ----------
+    name: name of the station
+    config: contents of the config.json of the station
+    jobs: queue the jobs of the station are received from
+    messages: queue the status and progress of the jobs are sent to
+    stop_event: event set by the supervisor to stop the job being run
+    """
+
+    import pyvisa as visa
+
+    from .instruments import InstrumentPool
+
+    # the supervisor stops the jobs on Ctrl+C, so that the outputs are shut down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    rm = visa.ResourceManager(config["backend"])
+    pool = InstrumentPool(rm)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            _run_job(name, job, pool, config, messages, stop_event)
+    finally:
+        pool.close_all()
+        rm.close()
+
+class StationSupervisor:
+    def __init__(self, stations, hang_timeout=STATION_HANG_TIMEOUT, stream=None):
+        """
+        Class that runs queues of jobs (devices to sweep) on several probe
+          stations at once from one host. Each station runs its jobs in its
+          own worker process, with its own VISA resource manager, so that a
+          station that hangs or crashes does not hold up the others. A job can
+          be assigned to a station, or left for the first station that is free
+
+        A station that has not reported any status or progress for hang_timeout
+          while running a job is considered hung. Its worker process is killed
+          and its remaining jobs are cancelled. The instruments of that station
+          are left as they were, and the job can be resumed from its
+          checkpoint once the station has been seen to
+
+        Parameters
+        ----------
+        stations: dictionary mapping station names to the contents of their
+          config.json
+        hang_timeout: time without any report from a running station after
+          which it is considered hung (sec)
+        stream: optional StreamServer that the state of the stations is
+          published to
+        """
+        self.configs = dict(stations)
+        self.hang_timeout = hang_timeout
+        self.stream = stream
+
+        self._context = multiprocessing.get_context("spawn")
+        self._messages = self._context.Queue()
+        self._workers = {}
+        self._job_ids = itertools.count()
+
+        # jobs waiting for a particular station, and for any station
+        self.queues = {name: [] for name in self.configs}
+        self.shared_queue = []
+        self.jobs = {}
+
+        self.stations = {name: {"state": "stopped", "job_id": None, "text": "", "progress": None,
+                                "last_seen": None, "done": 0}
+                         for name in self.configs}
+
+    def submit(self, job, station=None, resume=False):
+        """
+        Adds a job to the queue of a station (or of any station), returning
+          its id
+
+        Parameters
+        ----------
+        job: dictionary describing the job (see job_settings)
+        station: name of the station to run the job on, or None for any
+        resume: whether to resume the run checkpointed in the job's folder
+        """
+        if (station is not None) and (station not in self.configs):
+            raise KeyError(f"Unknown station {station}")
+
+        job_id = next(self._job_ids)
+        self.jobs[job_id] = {"job_id": job_id, "settings": job_settings(job), "resume": resume,
+                             "station": station, "state": "queued", "error": None}
+        (self.queues[station] if station is not None else self.shared_queue).append(job_id)
+        return job_id
+
+    def start(self):
+        """
+        Starts a worker process for every station
+        """
+        for name, config in self.configs.items():
+            jobs = self._context.Queue()
+            stop_event = self._context.Event()
+            process = self._context.Process(target=station_worker, name=f"station-{name}",
+                                            args=(name, config, jobs, self._messages, stop_event), daemon=True)
+            process.start()
+            self._workers[name] = {"process": process, "jobs": jobs, "stop_event": stop_event}
+            self.stations[name]["state"] = "idle"
+
+    def stop(self, timeout=30):
+        """
+        Stops the jobs being run, waits up to timeout for the stations to shut
+          down their outputs, and ends the worker processes
+
+        Parameters
+        ----------
+        timeout: time to wait for each station to finish its job (sec)
+        """
+        for name, worker in self._workers.items():
+            worker["stop_event"].set()
+            worker["jobs"].put(None)
+
+        deadline = time.monotonic() + timeout
+        for name, worker in self._workers.items():
+            worker["process"].join(max(deadline - time.monotonic(), 0))
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+            self.stations[name]["state"] = "stopped"
+        self._workers = {}
+
+    def busy(self):
+        """
+        Checks whether any station is running a job, or has jobs waiting that
+          it can still run
+        """
+        for name, station in self.stations.items():
+            if station["state"] == "running":
+                return True
+            if (station["state"] == "idle") and (self.queues[name] or self.shared_queue):
+                return True
+        return False
+
+    def poll(self, timeout=1.0):
+        """
+        Handles the reports of the stations, hands out waiting jobs to the idle
+          stations and checks for hung stations
+
+        Parameters
+        ----------
+        timeout: longest time to wait for a report (sec)
+        """
+        try:
+            message = self._messages.get(timeout=timeout)
+            while True:
+                self._handle(message)
+                message = self._messages.get_nowait()
+        except queue.Empty:
+            pass
+
+        self._check_workers()
+        self._dispatch()
+        if self.stream is not None:
+            self.stream.publish("stations", {"stations": self.stations, "queued": self._queued()})
+
+    def _handle(self, message):
+        station = self.stations[message["station"]]
+        job = self.jobs[message["job_id"]]
+        station["last_seen"] = time.monotonic()
+
+        if message["type"] == "status":
+            station["text"] = message["text"]
+        elif message["type"] == "progress":
+            station["progress"] = {key: message[key] for key in ("entry_index", "n_entries", "leg", "points_done",
+                                                                 "leg_length", "remaining")}
+        elif message["type"] == "done":
+            job["state"] = "complete" if message["completed"] else "failed"
+            job["error"] = message.get("error")
+            if job["error"]:
+                station["text"] = f"Failed: {job['error']}"
+            if station["state"] == "running":
+                station["state"] = "idle"
+            station["job_id"] = None
+            station["progress"] = None
+            station["done"] += 1
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for name, worker in self._workers.items():
+            station = self.stations[name]
+            if station["state"] not in ("idle", "running"):
+                continue
+
+            if not worker["process"].is_alive():
+                reason = f"worker process exited with code {worker['process'].exitcode}"
+            elif (station["state"] == "running") and (now - station["last_seen"] > self.hang_timeout):
+                reason = f"no report for {format_duration(now - station['last_seen'])}"
+                worker["process"].terminate()
+            else:
+                continue
+
+            print(f"Station {name} is down ({reason})")
+            station["state"] = "down"
+            station["text"] = reason
+            if station["job_id"] is not None:
+                self.jobs[station["job_id"]].update(state="failed", error=reason)
+                station["job_id"] = None
+            for job_id in self.queues[name]:
+                self.jobs[job_id].update(state="cancelled", error=f"station {name} is down")
+            self.queues[name] = []
+
+    def _dispatch(self):
+        running_folders = {self.jobs[station["job_id"]]["settings"]["folder"]
+                           for station in self.stations.values() if station["job_id"] is not None}
+
+        for name, station in self.stations.items():
+            if station["state"] != "idle":
+                continue
+
+            for job_queue in (self.queues[name], self.shared_queue):
+                # two runs must never share a save folder, as they would share a checkpoint
+                job_id = next((job_id for job_id in job_queue
+                               if self.jobs[job_id]["settings"]["folder"] not in running_folders), None)
+                if job_id is not None:
+                    break
+            else:
+                continue
+
+            job_queue.remove(job_id)
+            job = self.jobs[job_id]
+            job.update(state="running", station=name)
+            running_folders.add(job["settings"]["folder"])
+
+            worker = self._workers[name]
+            worker["stop_event"].clear()
+            worker["jobs"].put({"job_id": job_id, "settings": job["settings"], "resume": job["resume"]})
+            station.update(state="running", job_id=job_id, text="Starting", progress=None, last_seen=time.monotonic())
+
+    def _queued(self):
+        return {name: len(job_queue) for name, job_queue in self.queues.items()}
+
+    def dashboard(self):
+        """
+        Returns a text summary of the state and progress of every station
+        """
+        lines = []
+        for name, station in self.stations.items():
+            line = f"{name:<12}{station['state']:<9}done {station['done']}, queued {len(self.queues[name])}"
+            progress = station["progress"]
+            if progress is not None:
+                eta = datetime.datetime.now() + datetime.timedelta(seconds=progress["remaining"])
+                line += (f" | run {progress['entry_index']+1}/{progress['n_entries']}, {progress['leg']} point "
+                         f"{progress['points_done']}/{progress['leg_length']}, ETA {eta.strftime('%a %H:%M')}")
+            lines.append(f"{line} | {station['text']}")
+        if self.shared_queue:
+            lines.append(f"{len(self.shared_queue)} jobs waiting for any station")
+        return "\n".join(lines)
+
+def load_plan(path):
+    """
+    Loads a station plan: a JSON file with a "stations" dictionary mapping
+      station names to the paths of their config.json files, and a "jobs"
+      list of jobs, each with an optional "station" to run on (see
+      job_settings for the other fields)
+
+    Returns a (stations, jobs) tuple, with the contents of each config file
+
+    Parameters
+    ----------
+    path: path of the plan file
+    """
+
+    with open(path, "r") as f:
+        plan = json.load(f)
+
+    stations = {}
+    for name, config_path in plan["stations"].items():
+        with open(config_path, "r") as f:
+            stations[name] = json.load(f)
+    return stations, plan["jobs"]
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run queues of sweeps on several probe stations at once")
+    parser.add_argument("plan", help="JSON file listing the stations and jobs")
+    parser.add_argument("--resume", action="store_true", help="resume the runs checkpointed in the job folders")
+    parser.add_argument("--hang-timeout", type=float, default=STATION_HANG_TIMEOUT,
+                        help="time without a report after which a station is considered hung (sec)")
+    parser.add_argument("--stream-port", type=int, help="serve the state of the stations on this port")
+    parser.add_argument("--interval", type=float, default=10, help="time between dashboard updates (sec)")
+    args = parser.parse_args(args)
+
+    stations, jobs = load_plan(args.plan)
+
+    stream = None
+    if args.stream_port is not None:
+        from .stream import StreamServer
+
+        stream = StreamServer("0.0.0.0", args.stream_port)
+        stream.start()
+
+    supervisor = StationSupervisor(stations, args.hang_timeout, stream)
+    for job in jobs:
+        supervisor.submit(job, job.get("station"), args.resume)
+
+    supervisor.start()
+    try:
+        last_update = 0
+        while supervisor.busy():
+            supervisor.poll()
+            if time.monotonic() - last_update > args.interval:
+                print(supervisor.dashboard() + "\n")
+                last_update = time.monotonic()
+    except KeyboardInterrupt:
+        print("Stopping the stations...")
+    finally:
+        supervisor.stop()
+        if stream is not None:
+            stream.stop()
+
+    for job in supervisor.jobs.values():
+        error = f" ({job['error']})" if job["error"] else ""
+        print(f"{job['settings']['folder']} [{job['station'] or 'any'}]: {job['state']}{error}")
+
+if __name__ == "__main__":
+    main()
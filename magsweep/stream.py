@@ -0,0 +1,238 @@
+import asyncio
+import json
+import math
+import threading
+
+from .config import STREAM_HEARTBEAT, STREAM_QUEUE_SIZE
+
+# events whose latest message is sent to viewers as soon as they connect
+LATEST_EVENTS = ("status", "entry", "progress", "stations")
+
+# page served to browsers, showing the stream as it arrives
+INDEX_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Magnetic Sweep</title>
+<style>body {font-family: Helvetica, sans-serif; margin: 2em} td {padding: 0 1em 0 0}</style></head>
+<body>
+<h2>Magnetic Sweep</h2>
+<p id="status">Waiting for the run...</p>
+<p id="entry"></p>
+<p id="progress"></p>
+<table id="point"></table>
+<table id="stations"></table>
+<script>
+const source = new EventSource("/events");
+const show = (id, text) => document.getElementById(id).textContent = text;
+source.addEventListener("status", e => {
+    const status = JSON.parse(e.data);
+    show("status", status.text);
+    document.getElementById("status").style.background = status.color;
+});
+source.addEventListener("entry", e => {
+    const entry = JSON.parse(e.data);
+    show("entry", `Run ${entry.entry_index + 1}/${entry.n_entries}: ${JSON.stringify(entry.entry)}`);
+});
+source.addEventListener("progress", e => {
+    const p = JSON.parse(e.data);
+    show("progress", `${p.leg} point ${p.points_done}/${p.leg_length}, ETA ${p.eta}`);
+});
+source.addEventListener("point", e => {
+    const row = JSON.parse(e.data).row;
+    document.getElementById("point").innerHTML = Object.entries(row)
+        .map(([column, value]) => `<tr><td>${column}</td><td>${value}</td></tr>`).join("");
+});
+source.addEventListener("stations", e => {
+    const stations = JSON.parse(e.data).stations;
+    document.getElementById("stations").innerHTML = Object.entries(stations)
+        .map(([name, s]) => `<tr><td>${name}</td><td>${s.state}</td><td>${s.progress ?
+            `run ${s.progress.entry_index + 1}/${s.progress.n_entries}, ${s.progress.leg} point ${s.progress.points_done}/${s.progress.leg_length}` : ""}</td><td>${s.text}</td></tr>`)
+        .join("");
+});
+</script>
+</body>
+</html>
+"""
+
+def _jsonable(value):
+    """
+    Replaces the NaN and infinite floats of a value with None, as they have no
+      JSON representation
+    """
+
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return value
+
+class StreamServer:
+    def __init__(self, host="127.0.0.1", port=0, queue_size=STREAM_QUEUE_SIZE):
+        """
+        Class that serves the progress of a run to remote viewers over HTTP,
+          from an asyncio event loop on a background thread. Browsers are sent
+          a page that follows the run, and the run is streamed as server-sent
+          events from /events. The latest status, entry and progress are also
+          served as JSON from /state
+
+        Publishing a message never blocks the caller: it is handed to the event
+          loop, which copies it to a bounded queue per viewer. When a viewer
+          falls behind and its queue is full, its oldest messages are dropped
+
+        Parameters
+        ----------
+        host: address to listen on ("0.0.0.0" for every network interface)
+        port: port to listen on (0 picks a free port, see the port attribute)
+        queue_size: largest number of messages held for a single viewer
+        """
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+
+        # number of messages published, and dropped for viewers that fell behind
+        self.published = 0
+        self.dropped = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+        self._clients = set()
+        self._latest = {}
+        self._state = {}
+
+    def start(self):
+        """
+        Starts serving on a background thread, returning once the server is
+          listening
+        """
+        self._started.clear()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._server is None:
+            raise OSError(f"Could not listen on {self.host}:{self.port}")
+
+    def stop(self):
+        """
+        Disconnects every viewer and stops the server
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def publish(self, event, data):
+        """
+        Sends a message to every connected viewer. Safe to call from any thread
+
+        Parameters
+        ----------
+        event: name of the event (e.g. "point")
+        data: JSON serializable dictionary describing the event
+        """
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._broadcast, event, data)
+
+    @property
+    def n_clients(self):
+        """
+        Number of viewers connected to the stream
+        """
+        return len(self._clients)
+
+    def queue_depths(self):
+        """
+        Returns the number of messages waiting to be sent to each viewer
+        """
+        return [queue.qsize() for queue in list(self._clients)]
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port))
+        except OSError as e:
+            print(f"Could not start the stream server: {e}")
+            self._loop.close()
+            self._loop = None
+            self._started.set()
+            return
+
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for task in asyncio.all_tasks(self._loop):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+            self._loop = None
+            self._server = None
+
+    def _broadcast(self, event, data):
+        self.published += 1
+        data = _jsonable(data)
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+        if event in LATEST_EVENTS:
+            self._latest[event] = message
+            self._state[event] = data
+
+        for queue in self._clients:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(message)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # the headers of the request are not needed
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if (not parts) or (parts[0] != "GET"):
+                self._respond(writer, "405 Method Not Allowed", "text/plain", b"Method not allowed")
+            elif path == "/":
+                self._respond(writer, "200 OK", "text/html; charset=utf-8", INDEX_PAGE.encode())
+            elif path == "/state":
+                self._respond(writer, "200 OK", "application/json", json.dumps(self._state).encode())
+            elif path == "/events":
+                await self._stream(writer)
+            else:
+                self._respond(writer, "404 Not Found", "text/plain", b"Not found")
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode() + body)
+
+    async def _stream(self, writer):
+        queue = asyncio.Queue(self.queue_size)
+        for message in self._latest.values():
+            queue.put_nowait(message)
+        self._clients.add(queue)
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # comment line, keeps idle connections from timing out
+                    message = b": keepalive\n\n"
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self._clients.discard(queue)
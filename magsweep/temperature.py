@@ -0,0 +1,63 @@
+from .instruments import Instrument
+
+class LS332(Instrument):
+    snapshot_columns = {"A": "TEMP A (K)",
+                        "B": "TEMP B (K)",
+                        "setpoint": "TEMP SP (K)"}
+
+    def __init__(self, rm, addr):
+        """
+        Class that allows for interfacing with Lakeshore 332 temperature
+          controller
+
+        Parameters
+        ----------
+        rm: VISA resource manager
+        addr: address of the instrument in your GPIB network
+        """
+        super().__init__(rm, addr)
+
+    def get_temperature(self, channel="A"):
+        """
+        Queries instrument for the temperature of a sensor input (kelvin)
+
+        Parameters
+        ----------
+        channel: sensor input to read ("A" or "B")
+        """
+        return float(self.query(f"KRDG? {channel}"))
+
+    def get_setpoint(self, loop=1):
+        """
+        Queries instrument for the temperature setpoint of a control loop (kelvin)
+        """
+        return float(self.query(f"SETP? {loop}"))
+
+    def set_setpoint(self, value, loop=1):
+        """
+        Sets the temperature setpoint of a control loop (kelvin)
+        """
+        self.write(f"SETP {loop},{value}")
+
+    def snapshot(self):
+        """
+        Reads both sensor inputs and the loop 1 setpoint (kelvin)
+        """
+        with self.session():
+            return {"A": self.get_temperature("A"),
+                    "B": self.get_temperature("B"),
+                    "setpoint": self.get_setpoint()}
+
+class LS340(LS332):
+    def __init__(self, rm, addr):
+        """
+        Class that allows for interfacing with Lakeshore 340 temperature
+          controller, which shares the temperature and setpoint commands of
+          the 332
+
+        Parameters
+        ----------
+        rm: VISA resource manager
+        addr: address of the instrument in your GPIB network
+        """
+        super().__init__(rm, addr)
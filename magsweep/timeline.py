@@ -0,0 +1,106 @@
+import argparse
+import datetime
+
+from .estimate import format_duration
+from .events import read_events
+
+def split_runs(events):
+    """
+    Splits the events of a log into runs, each starting at a run_start event
+      (a log can hold several runs, as a resumed run appends to the same file)
+
+    Parameters
+    ----------
+    events: list of event dictionaries, in the order they were logged
+    """
+
+    runs = []
+    for event in events:
+        if (event["event"] == "run_start") or (not runs):
+            runs.append([])
+        runs[-1].append(event)
+    return runs
+
+def phase_table(events):
+    """
+    Summarises the time spent in each phase of a run, returning a list of
+      (phase, count, total, mean, max) tuples sorted by the total time spent
+
+    Parameters
+    ----------
+    events: list of event dictionaries of a run
+    """
+
+    phases = {}
+    for event in events:
+        if "duration" not in event:
+            continue
+        phases.setdefault(event["event"], []).append(event["duration"])
+
+    table = [(phase, len(durations), sum(durations), sum(durations)/len(durations), max(durations))
+             for phase, durations in phases.items()]
+    return sorted(table, key=lambda row: row[2], reverse=True)
+
+def summarise_run(events, top=10):
+    """
+    Returns a text summary of a run: its outcome, the time spent in each phase
+      and the slowest individual events
+
+    Parameters
+    ----------
+    events: list of event dictionaries of a run
+    top: number of slowest events to list
+    """
+
+    start = events[0]
+    end = events[-1]
+    started = datetime.datetime.fromtimestamp(start["wall"]).strftime("%Y-%m-%d %H:%M:%S")
+
+    lines = [f"Run started {started} ({start.get('engine', 'unknown engine')}"
+             + (", resumed)" if start.get("resume") else ")")]
+    lines.append(f"  Duration: {format_duration(end['t'] - start['t'])}")
+
+    n_entries = start.get("n_entries")
+    entries_done = sum(1 for event in events if event["event"] == "entry_end")
+    lines.append(f"  Entries completed: {entries_done}" + (f" of {n_entries}" if n_entries is not None else ""))
+
+    if end["event"] == "run_end":
+        outcome = "completed" if end.get("completed") else ("stopped" if end.get("stopped") else "failed")
+    else:
+        outcome = "interrupted (no run_end event)"
+    lines.append(f"  Outcome: {outcome}")
+
+    errors = [event for event in events if event["event"] in ("error", "timeout")]
+    for event in errors:
+        lines.append(f"  {event['event']} at +{event['t'] - start['t']:.1f} s: {event.get('message', event.get('error'))}")
+
+    lines.append("")
+    lines.append(f"  {'Phase':<20}{'Count':>8}{'Total (s)':>12}{'Mean (s)':>12}{'Max (s)':>12}")
+    for phase, count, total, mean, longest in phase_table(events):
+        lines.append(f"  {phase:<20}{count:>8}{total:>12.2f}{mean:>12.4f}{longest:>12.4f}")
+
+    timed = sorted((event for event in events if "duration" in event), key=lambda event: event["duration"], reverse=True)
+    if timed[:top]:
+        lines.append("")
+        lines.append(f"  Slowest {min(top, len(timed))} events:")
+        for event in timed[:top]:
+            details = ", ".join(f"{key}={value}" for key, value in event.items()
+                                if key not in ("event", "t", "wall", "duration"))
+            lines.append(f"    +{event['t'] - start['t']:>10.1f} s  {event['event']:<20}{event['duration']:>10.4f} s  {details}")
+
+    return "\n".join(lines)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Summarise the event logs of magnetic sweep runs")
+    parser.add_argument("logs", nargs="+", help="event log files (magsweep_events.jsonl)")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest events to list per run")
+    args = parser.parse_args(args)
+
+    for path in args.logs:
+        print(path)
+        for events in split_runs(read_events(path)):
+            print(summarise_run(events, args.top))
+            print()
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,255 @@
-import numpy as np
+import re
 
-def parse_entry(entry):
+# multipliers for SI prefixes that may precede a unit in an entry string
+SI_PREFIXES = {"p": 1e-12,
+               "n": 1e-9,
+               "u": 1e-6,
+               "µ": 1e-6,
+               "m": 1e-3,
+               "": 1.0,
+               "k": 1e3,
+               "M": 1e6}
+
+_VALUE_RE = re.compile(r"^([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([^\d\s.+-]*)$")
+_FUNC_RE = re.compile(r"^(lin|linspace|log|logspace)\s*\((.*)\)$", re.IGNORECASE)
+
+def _unit_scale(unit):
+    """
+    Splits a unit string such as "uA" or "Hz" into its base unit and the
+      multiplier of its SI prefix
+
+    Parameters
+    ----------
+    unit: unit string (None or "" for a dimensionless axis)
+    """
+
+    if not unit:
+        return "", 1.0
+
+    for prefix, scale in SI_PREFIXES.items():
+        if prefix and unit.startswith(prefix) and len(unit) > len(prefix):
+            return unit[len(prefix):], scale
+
+    return unit, 1.0
+
+def _parse_value(token, unit=None):
+    """
+    Parses a single number, optionally followed by an SI-prefixed unit, and
+      returns it expressed in the unit of the axis
+
+    Parameters
+    ----------
+    token: string to be parsed (e.g. "13.7", "500nA", "1.5 kHz")
+    unit: unit of the axis the value belongs to (e.g. "uA")
+    """
+
+    match = _VALUE_RE.match(token.strip())
+    if match is None:
+        raise ValueError(f"'{token.strip()}' is not a number")
+
+    value = float(match.group(1))
+    suffix = match.group(2)
+    if suffix == "":
+        return value
+
+    base, axis_scale = _unit_scale(unit)
+    if not base:
+        raise ValueError(f"'{token.strip()}' has a unit but this field has none")
+
+    if suffix.lower().endswith(base.lower()):
+        prefix = suffix[:len(suffix)-len(base)]
+        if prefix in SI_PREFIXES:
+            return value*SI_PREFIXES[prefix]/axis_scale
+
+    raise ValueError(f"'{token.strip()}' does not have units of {base}")
+
+def _split_terms(entry):
+    """
+    Splits an entry string on the commas that are not inside parentheses
+    """
+
+    terms = []
+    depth = 0
+    start = 0
+    for n, char in enumerate(entry):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                raise ValueError("Unbalanced parentheses")
+        elif char == "," and depth == 0:
+            terms.append(entry[start:n])
+            start = n + 1
+
+    if depth != 0:
+        raise ValueError("Unbalanced parentheses")
+
+    terms.append(entry[start:])
+    return terms
+
+def _compile_term(term, unit=None):
+    """
+    Compiles one comma-separated term of an entry string into an array
+
+    Parameters
+    ----------
+    term: string to be compiled
+    unit: unit of the axis the values belong to
+    """
+
+    # numpy is imported on first use to keep the GUI startup fast
+    import numpy as np
+
+    term = term.strip()
+    if term == "":
+        raise ValueError("Empty value in list")
+
+    func = _FUNC_RE.match(term)
+    if func is not None:
+        args = func.group(2).split(",")
+        if len(args) != 3:
+            raise ValueError(f"{func.group(1)}() takes start, end and number of points")
+        start = _parse_value(args[0], unit)
+        end = _parse_value(args[1], unit)
+        try:
+            num = int(args[2])
+        except ValueError:
+            raise ValueError(f"Number of points in {func.group(1)}() must be an integer")
+        if num < 1:
+            raise ValueError(f"Number of points in {func.group(1)}() must be positive")
+
+        if func.group(1).lower().startswith("lin"):
+            return np.linspace(start, end, num)
+
+        if start == 0 or end == 0 or (start > 0) != (end > 0):
+            raise ValueError("log() limits must be non-zero and of the same sign")
+        return np.geomspace(start, end, num)
+
+    if ".." in term:
+        # inclusive range, start..end or start..end:step
+        start, rest = term.split("..", 1)
+        params = rest.split(":")
+        if len(params) > 2:
+            raise ValueError(f"'{term}' is not a valid range")
+        start = _parse_value(start, unit)
+        end = _parse_value(params[0], unit)
+        step = _parse_value(params[1], unit) if len(params) == 2 else 1.0
+        if step == 0:
+            raise ValueError("Range step cannot be zero")
+        num = int(np.floor((end - start)/step + 1e-9)) + 1
+        if num < 1:
+            raise ValueError(f"'{term}' is an empty range")
+        return start + step*np.arange(num)
+
+    if ":" in term:
+        # end-exclusive range, start:end or start:end:step
+        params = term.split(":")
+        if len(params) > 3:
+            raise ValueError(f"'{term}' is not a valid range")
+        start = _parse_value(params[0], unit)
+        end = _parse_value(params[1], unit)
+        step = _parse_value(params[2], unit) if len(params) == 3 else 1.0
+        if step == 0:
+            raise ValueError("Range step cannot be zero")
+        values = np.arange(start, end, step)
+        if len(values) == 0:
+            raise ValueError(f"'{term}' is an empty range")
+        return values
+
+    return np.array([_parse_value(term, unit)])
+
+def compile_sweep_spec(entry, unit=None, limits=None):
     """
-    Parses entry string to extract run information
+    Compiles a sweep specification string into an array of values
 
     Types of input strings...
-    sequence: start:end:step
-    multiple values: value1, value2, value3
+    sequence (end excluded): start:end:step
+    sequence (end included): start..end:step
+    linearly spaced: lin(start, end, num)
+    logarithmically spaced: log(start, end, num)
     single value: value1
+    multiple values (union of any of the above): term1, term2, term3
+
+    The step defaults to 1 when left out of a sequence. Any number may be
+      followed by an SI-prefixed unit (e.g. "500nA" or "0.1kHz"), in which
+      case it is converted into the unit of the axis. Duplicate values are
+      dropped, keeping the order of first appearance.
+
+    Parameters
+    ----------
+    entry: string to be compiled
+    unit: unit of the axis the values belong to (e.g. "uA", "Hz" or "V")
+    limits: optional (lower, upper) tuple that every value must lie within,
+      inclusive, expressed in the unit of the axis
+
+    Raises ValueError with a readable message if the string is invalid or a
+      value falls outside of the limits
+    """
+
+    import numpy as np
+
+    if entry.strip() == "":
+        raise ValueError("No values given")
+
+    values = np.concatenate([_compile_term(term, unit) for term in _split_terms(entry)])
+
+    # round off floating point noise from the ranges before removing duplicates
+    values = np.round(values, 12)
+    _, first = np.unique(values, return_index=True)
+    values = values[np.sort(first)]
+
+    if limits is not None:
+        lower, upper = limits
+        outside = values[(values < lower) | (values > upper)]
+        if len(outside) > 0:
+            unit_str = f" {unit}" if unit else ""
+            raise ValueError(f"{outside[0]:g}{unit_str} is outside of the limits {lower:g} to {upper:g}{unit_str}")
+
+    return values
+
+def parse_entry(entry, unit=None, limits=None):
+    """
+    Parses entry string to extract run information. See compile_sweep_spec
+      for the accepted syntax
+
+    Returns a list of values, or None if the string is empty or invalid
 
     Parameters
     ----------
     entry: string to be parsed
+    unit: unit of the axis the values belong to (e.g. "uA", "Hz" or "V")
+    limits: optional (lower, upper) tuple that every value must lie within
     """
 
-    if ":" in entry:
-        params = entry.split(":")
-        if len(params) == 2:
-            start = params[0]
-            end = params[1]
-            step = 1
-            
-        elif len(params) == 3:
-            start = params[0]
-            end = params[1]
-            step = params[2]
-        else:
-            return None
-            
-        return list(np.arange(int(start), int(end), int(step)))
-
-    elif "," in entry:
-        return [int(i) for i in entry.split(",")]
-
-    elif entry == "":
+    try:
+        return compile_sweep_spec(entry, unit, limits).tolist()
+    except ValueError:
         return None
-    
-    else:
-        return [int(entry)]
-        
+
+def sweep_profile(start, end, step, symmetric=True):
+    """
+    Builds the magnet current setpoints for the forward and reverse legs of a
+      sweep. The forward leg runs from start to end inclusive, and the reverse
+      leg retraces it backwards (or is empty if the sweep is not symmetric)
+
+    Returns a (forward, reverse) tuple of lists of setpoints (amps)
+
+    Parameters
+    ----------
+    start: lower limit of the sweep (amps)
+    end: upper limit of the sweep (amps)
+    step: change in current between datapoints (amps)
+    symmetric: whether to sweep back from end to start
+    """
+
+    import numpy as np
+
+    if step <= 0 or end <= start:
+        return [], []
+
+    num = int(np.floor((end - start)/step + 1e-9)) + 1
+    forward = [round(float(i), 3) for i in (start + step*np.arange(num))]
+    reverse = forward[::-1] if symmetric else []
+
+    return forward, reverse